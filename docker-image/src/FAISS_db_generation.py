@@ -1,193 +1,136 @@
-import os, sys
-import pandas as pd
-import openai
-import glob
+import io
+import pickle
+import faiss
+import numpy as np
 from dotenv import load_dotenv, find_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    TextLoader,
-    UnstructuredWordDocumentLoader,
-    UnstructuredPowerPointLoader
-)
+from src.textUtils import CachedEmbeddings, EMBEDDING_MODEL, embed_texts_cached
+from src.clients import get_openai_client
 
 # Load environment variables from .env file
 load_dotenv(find_dotenv())
-# item_01
-def create_database(course_dir):
-    # Validate existence of Course directory
-    if not os.path.isdir(course_dir):
-        print(f"The provided path is not a valid directory: {course_dir}")
-        sys.exit(1)
-
-
-    loader_mapping = {
-        ".pdf": PyPDFLoader,
-        ".txt": TextLoader,
-        ".docx": UnstructuredWordDocumentLoader,
-        ".pptx": UnstructuredPowerPointLoader
-    }
-
-    all_documents = []
-    for ext, loader_cls in loader_mapping.items():
-        pattern = os.path.join(course_dir, f"**/*{ext}")
-        for file_path in glob.glob(pattern, recursive=True):
-            try:
-                loader = loader_cls(file_path)
-                docs = loader.load()
-                all_documents.extend(docs)
-            except Exception as e:
-                print(f"Failed to load {file_path}: {e}")
-        
-        if not all_documents:
-            print("No supported documents found.")
-            return
-
-    # Splitting the text into chunks
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200) # Divide into 1000 char chunks w/ 200 char overlap to retain context across chunks
-    texts = text_splitter.split_documents(all_documents) # contains the document chunks
-    print(f"Number of text chunks: {len(texts)}")
-
-    # FAISS Vector Store Creation
-    embedding = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY")) # convert text into OpenAI vector embeddings
-    vectordb = FAISS.from_documents(documents=texts, embedding=embedding)
-
-    # vectordb.save_local(output_dir)
-    vectordb.save_local(course_dir)
-# item_02
-def generate_citations(course_dir):
-    # Validate existence of Course directory
-    if not os.path.isdir(course_dir):
-        print(f"The provided path is not a valid directory: {course_dir}")
-        sys.exit(1)
-
-    # Initialize OpenAI embeddings
-    embedding = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-    # Load the FAISS index
-    vectordb = FAISS.load_local(course_dir, embedding, allow_dangerous_deserialization=True)
-
-    # Get the document store data
-    docstore_data = vectordb.docstore.__dict__['_dict']
-    values_list = list(docstore_data.values())
-    all_keys = list(docstore_data.keys())
-
-    # Create initial DataFrame
-    df = pd.DataFrame({"Keys": all_keys, "Values": values_list})
-
-    # Extract source from metadata
-    df["Source"] = df["Values"].apply(lambda x: x.metadata.get("source", "unknown"))
-
-    # Get unique sources
-    unique_sources = df['Source'].unique()
-
-    def obtain_reference_using_gpt(text_for_obtaining_reference):
-        completion = openai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a straightforward assistant who provides quick, direct APA 7th-style citations. "
-                        "Use only the provided text chunk. If you cannot generate a citation, respond with 'I do not know'."
-                    ),
-                },
-                {
-                    "role": "user",
-                    "content": f"Text chunk: {text_for_obtaining_reference}",
-                }
-            ],
-        )
-        return completion.choices[0].message.content.strip()
-
-    # Generate citations
-    reference_dict = {}
-    for source in unique_sources:
-        df_for_each = df[df["Source"] == source].iloc[:3]
-        combined_text = " ".join(df_for_each["Values"].apply(lambda x: x.page_content))
-        reference = obtain_reference_using_gpt(combined_text)
-        reference_dict[source] = reference
-
-    # Add citation to each chunk’s metadata
-    for key, doc in docstore_data.items():
-        original_source = doc.metadata.get("source", "unknown")
-        if original_source in reference_dict:
-            doc.metadata["citation"] = reference_dict[original_source]
-
-    # Save updated FAISS index
-    vectordb.save_local(course_dir)
-    print(f"Saved updated FAISS index with citation metadata to: {course_dir}")
-
-    # Optionally write CSV too
-    citation_records = [{"Source": k, "Reference": v} for k, v in reference_dict.items()]
-    pd.DataFrame(citation_records).to_csv(
-        os.path.join(course_dir, "citations.csv"), index=False, encoding='utf-8'
+
+def obtain_reference_using_gpt(text_for_obtaining_reference):
+    completion = get_openai_client().chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You are a straightforward assistant who provides quick, direct APA 7th-style citations. "
+                    "Use only the provided text chunk. If you cannot generate a citation, respond with 'I do not know'."
+                ),
+            },
+            {
+                "role": "user",
+                "content": f"Text chunk: {text_for_obtaining_reference}",
+            }
+        ],
+    )
+    return completion.choices[0].message.content.strip()
+
+# Serializes a LangChain FAISS store to the same (index.faiss, index.pkl)
+# byte layout that save_local writes, without touching the filesystem
+def vectorstore_to_bytes(vectordb):
+    index_bytes = faiss.serialize_index(vectordb.index).tobytes()
+    pkl_bytes = pickle.dumps((vectordb.docstore, vectordb.index_to_docstore_id))
+    return index_bytes, pkl_bytes
+
+# Classes a stored index.pkl may reference (current and pre-split LangChain paths)
+_DOCSTORE_CLASSES = {
+    ("langchain_community.docstore.in_memory", "InMemoryDocstore"),
+    ("langchain.docstore.in_memory", "InMemoryDocstore"),
+    ("langchain_core.documents.base", "Document"),
+    ("langchain_core.documents", "Document"),
+    ("langchain.schema.document", "Document"),
+    ("langchain.schema", "Document"),
+}
+
+class _DocstoreUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in _DOCSTORE_CLASSES:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from index.pkl")
+        return super().find_class(module, name)
+
+def load_docstore_bytes(pkl_bytes):
+    """Decodes index.pkl bytes, allowing only docstore/Document classes."""
+    docstore, index_to_docstore_id = _DocstoreUnpickler(io.BytesIO(pkl_bytes)).load()
+    return docstore, index_to_docstore_id
+
+class _PlainDataUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from index metadata")
+
+def load_metadata_bytes(pkl_bytes):
+    """Decodes a course index metadata pickle, which holds only builtin types."""
+    return _PlainDataUnpickler(io.BytesIO(pkl_bytes)).load()
+
+# Stores that predate the 'model' metadata key were embedded with LangChain's
+# OpenAIEmbeddings default
+LEGACY_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+def _docstore_model(docstore):
+    for doc in docstore.__dict__['_dict'].values():
+        return doc.metadata.get('model', LEGACY_EMBEDDING_MODEL)
+    return None
+
+def vectorstore_model(vectordb):
+    """Embedding model a store's vectors were built with (None if it is empty)."""
+    return _docstore_model(vectordb.docstore)
+
+def stored_vectorstore_model(pkl_bytes):
+    """vectorstore_model for a stored index.pkl, without loading the index."""
+    return _docstore_model(load_docstore_bytes(pkl_bytes)[0])
+
+# Inverse of vectorstore_to_bytes: builds the store straight from DB bytes.
+# Queries are embedded with the model the store was built with (both models
+# are 1536-d, so mixing them fails silently with bad neighbours); stores from
+# before the model was recorded keep working as ada-002 until re-embedded
+def vectorstore_from_bytes(index_bytes, pkl_bytes):
+    index = faiss.deserialize_index(np.frombuffer(index_bytes, dtype=np.uint8))
+    docstore, index_to_docstore_id = load_docstore_bytes(pkl_bytes)
+    model = _docstore_model(docstore) or EMBEDDING_MODEL
+    return FAISS(
+        embedding_function=CachedEmbeddings(model=model),
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
     )
-    print(f"Saved citation lookup table to citations.csv.")
-
-# item_03
-def replace_sources(course_dir):
-    # Validate existence of Course directory
-    if not os.path.isdir(course_dir):
-        print(f"The provided path is not a valid directory: {course_dir}")
-        sys.exit(1)
-
-    # Initialize OpenAI embeddings
-    embedding = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-
-    # Load the FAISS index
-    vectordb = FAISS.load_local(course_dir, embedding, allow_dangerous_deserialization=True)
-
-    # Load the CSV file with sources and references
-    csv_filename = os.path.join(course_dir, "citations.csv")
-    if not os.path.isfile(csv_filename):
-        print(f"Error: Citations CSV file not found at: {csv_filename}")
-        sys.exit(1)
-    citations_df = pd.read_csv(csv_filename)
-
-    # Create a dictionary for quick lookup
-    source_to_reference = dict(zip(citations_df['Source'], citations_df['Reference']))
-
-    # Get all keys from the vector database
-    all_keys = list(vectordb.docstore.__dict__['_dict'].keys())
-
-    # Function to replace source with reference
-    def replace_source_with_reference(doc):
-        original_source = doc.metadata["source"]
-        if original_source in source_to_reference:
-            doc.metadata["source"] = source_to_reference[original_source]
-        return doc
-
-    # Iterate through all documents and replace the source with the reference
-    for key in all_keys:
-        vectordb.docstore.__dict__['_dict'][key] = replace_source_with_reference(
-            vectordb.docstore.__dict__['_dict'][key]
-        )
-
-    # Save the modified vectordb to local
-    vectordb.save_local(course_dir)
-
-    print(f"Sources in the FAISS database have been replaced with their corresponding references.")
-
-    # Optionally, verify a few entries
-    # This should show chunks with the same citation when using a single PDF
-    # print("\nVerifying a few entries:")
-    # for i in range(min(5, len(all_keys))):
-    #   print(f"Document {i + 1} source:", vectordb.docstore.__dict__['_dict'][all_keys[i]].metadata["source"])
-
-# item_03.5    
-# Remove all files except for index.faiss and index.pkl from the folder
-def file_cleanup(course_dir):
-    # Validate existence of Course directory
-    if not os.path.isdir(course_dir):
-        print(f"The provided path is not a valid directory: {course_dir}")
-        sys.exit(1)
-
-    files_to_keep = {'index.faiss', 'index.pkl'}
-
-    for file in os.listdir(course_dir):
-        file_path = os.path.join(course_dir, file)
-        if os.path.isfile(file_path) and file not in files_to_keep:
-            os.remove(file_path)
-            # print(f"Deleted: {file_path}")
\ No newline at end of file
+
+# Builds a LangChain FAISS store from already-embedded chunks, a batch at a
+# time, so callers never hold more than one batch of vectors. Every chunk's
+# metadata records the embedding model
+class VectorstoreBuilder:
+    def __init__(self):
+        self.vectordb = None
+
+    def add(self, chunks, vectors, metadatas):
+        text_embeddings = [(chunk, [float(x) for x in vec]) for chunk, vec in zip(chunks, vectors)]
+        metadatas = [{**md, 'model': EMBEDDING_MODEL} for md in metadatas]
+        if self.vectordb is None:
+            self.vectordb = FAISS.from_embeddings(
+                text_embeddings=text_embeddings,
+                embedding=CachedEmbeddings(model=EMBEDDING_MODEL),
+                metadatas=metadatas,
+            )
+        else:
+            self.vectordb.add_embeddings(text_embeddings, metadatas=metadatas)
+
+    def to_bytes(self):
+        return vectorstore_to_bytes(self.vectordb)
+
+def build_vectorstore_bytes(chunks, vectors, metadatas):
+    builder = VectorstoreBuilder()
+    builder.add(chunks, vectors, metadatas)
+    return builder.to_bytes()
+
+# Re-embeds a stored file store with EMBEDDING_MODEL, keeping its chunk texts
+# and metadata (citations included), so no re-extraction or LLM call is needed
+def reembed_vectorstore_bytes(index_bytes, pkl_bytes):
+    docstore, index_to_docstore_id = load_docstore_bytes(pkl_bytes)
+    docs = [docstore.search(index_to_docstore_id[i]) for i in sorted(index_to_docstore_id)]
+    if not docs:
+        return index_bytes, pkl_bytes
+    texts = [d.page_content for d in docs]
+    vectors = embed_texts_cached(texts, model=EMBEDDING_MODEL)
+    return build_vectorstore_bytes(texts, vectors, [d.metadata for d in docs])
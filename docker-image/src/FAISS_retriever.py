@@ -4,11 +4,15 @@ import os
 import sys
 from dotenv import load_dotenv, find_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.chains import RetrievalQA
+from langchain.chains.question_answering import load_qa_chain
 from langchain_core.globals import set_verbose, set_debug
 from langchain.schema import BaseRetriever, Document
 import warnings
+from src.textUtils import CachedEmbeddings, count_tokens, content_hash
+from src.db.queries import get_chunk_group_summaries, store_chunk_group_summaries
+from src.clients import get_chat_model, get_model_chain
+from context_packer import pack_documents, context_budget
+from FAISS_db_generation import LEGACY_EMBEDDING_MODEL, vectorstore_model
 
 # Load environment variables
 load_dotenv(find_dotenv())
@@ -20,6 +24,24 @@ warnings.filterwarnings("ignore", message=".*LangChainDeprecationWarning.*")
 set_verbose(False)
 set_debug(False)
 
+# Whole-file prompts over MAP_REDUCE_MIN_TOKENS are answered map-reduce style:
+# groups of ~MAP_REDUCE_GROUP_TOKENS are summarized in one parallel wave
+# (cached by content hash in ChunkGroupSummary), then the query runs on the summaries
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "16000"))
+MAP_REDUCE_GROUP_TOKENS = int(os.getenv("MAP_REDUCE_GROUP_TOKENS", "4000"))
+MAP_REDUCE_MAX_CONCURRENCY = int(os.getenv("MAP_REDUCE_MAX_CONCURRENCY", "32"))
+MAP_REDUCE_SUMMARY_TOKENS = int(os.getenv("MAP_REDUCE_SUMMARY_TOKENS", "800"))
+MAP_REDUCE_MAX_TOKENS = int(os.getenv("MAP_REDUCE_MAX_TOKENS", "2000000"))
+
+# Bump when MAP_PROMPT changes so cached summaries are regenerated
+MAP_PROMPT_VERSION = "1"
+MAP_PROMPT = (
+    "You are condensing one section of a longer document so it can later be turned into course material. "
+    "Rewrite the section as a dense, faithful summary in plain prose. Keep every key idea, definition, "
+    "name, term, date, number, step and example; drop only repetition and filler. "
+    "Do not add anything that is not in the section."
+)
+
 # OpenAI-powered fallback retriever
 class OpenAIRetriever(BaseRetriever):
     def __init__(self, llm):
@@ -69,14 +91,24 @@ def process_llm_response(llm_response):
     
 #     return similar_chunks
 
-# Performs an LLM query using the top similar chunks and falls back to OpenAI knowledge if not enough
-def cascading_LLM_response(query, faiss_index_path, threshold=2):
-    embedding = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
+# Accepts an already-loaded FAISS store (e.g. from faiss_cache) or an index
+# directory; a directory store is queried with the model it was built with
+def _as_vectorstore(faiss_index):
+    if isinstance(faiss_index, FAISS):
+        return faiss_index
     vectordb = FAISS.load_local(
-        faiss_index_path, embedding, allow_dangerous_deserialization=True
+        faiss_index, CachedEmbeddings(model=LEGACY_EMBEDDING_MODEL), allow_dangerous_deserialization=True
     )
+    model = vectorstore_model(vectordb)
+    if model and model != LEGACY_EMBEDDING_MODEL:
+        vectordb.embedding_function = CachedEmbeddings(model=model)
+    return vectordb
+
+# Performs an LLM query using the top similar chunks and falls back to OpenAI knowledge if not enough
+def cascading_LLM_response(query, faiss_index, threshold=2):
+    llm = get_chat_model("gpt-4o-mini", temperature=0)
+
+    vectordb = _as_vectorstore(faiss_index)
     faiss_retriever = vectordb.as_retriever(search_kwargs={"k" : 5})
 
     # Query FAISS first
@@ -91,53 +123,107 @@ def cascading_LLM_response(query, faiss_index_path, threshold=2):
         openai_docs = openai_retriever._get_relevant_documents(query)
         final_docs = faiss_docs + openai_docs
 
-    # Create a custom retriever that returns out final_docs
-    class ListRetriever(BaseRetriever):
-        def _get_relevant_documents(self, q):
-            return final_docs
-    
-    combined_retriever = ListRetriever()
+    # Overlapping windows are trimmed and the "stuff" prompt capped
+    final_docs = pack_documents(final_docs, model="gpt-4o-mini")
 
     # Run QA chain on combined docs
-    qa_chain = RetrievalQA.from_chain_type(
-        llm,
-        chain_type="stuff",
-        retriever=combined_retriever,
-        return_source_documents=True
-    )
+    return _stuff_response(llm, query, final_docs, return_source_documents=True)
 
-    llm_response = qa_chain.invoke(query)
+# Runs a "stuff" QA chain over exactly the given documents; same result keys as RetrievalQA.
+# The chain is built once per shared chat model (chains are stateless)
+def _stuff_response(llm, query, docs, return_source_documents=False):
+    chain = get_model_chain(llm, "stuff_qa", lambda model: load_qa_chain(model, chain_type="stuff"))
 
+    output = chain.invoke({"input_documents": docs, "question": query})
+    llm_response = {"query": query, "result": output["output_text"]}
+    if return_source_documents:
+        llm_response["source_documents"] = docs
     return llm_response
 
-# Perfoms LLM query using all of the provided chunks and does not fall back to OpenAI knowledge
-def LLM_response_all_chunks(query, faiss_index_path):
-    embedding = OpenAIEmbeddings(api_key=os.getenv("OPENAI_API_KEY"))
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-    vectordb = FAISS.load_local(
-        faiss_index_path, embedding, allow_dangerous_deserialization=True
+# Joins consecutive texts into groups of roughly max_tokens each
+def _group_texts(texts, max_tokens, model):
+    groups, current, used = [], [], 0
+    for t in texts:
+        cost = count_tokens(t, model)
+        if current and used + cost > max_tokens:
+            groups.append("\n\n".join(current))
+            current, used = [], 0
+        current.append(t)
+        used += cost
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def _summary_cache_io(fn, *args):
+    # The cache is an optimization: a DB hiccup must never fail the prompt itself
+    from src.db.session import Session
+    db = Session()
+    try:
+        return fn(db, *args)
+    except Exception as e:
+        db.rollback()
+        print(f"Chunk group summary cache unavailable: {e}")
+        return None
+    finally:
+        db.close()
+
+# Map step: one summary per text, cached ones from the DB, the rest in one parallel wave
+def _map_summaries(llm, texts):
+    model = llm.model_name
+    hashes = [content_hash(f"{MAP_PROMPT_VERSION}\n{t}") for t in texts]
+    summaries = _summary_cache_io(get_chunk_group_summaries, set(hashes), model) or {}
+
+    missing = {h: t for h, t in zip(hashes, texts) if h not in summaries}
+    if missing:
+        replies = llm.batch(
+            [[("system", MAP_PROMPT), ("user", t)] for t in missing.values()],
+            config={"max_concurrency": MAP_REDUCE_MAX_CONCURRENCY},
+            max_tokens=MAP_REDUCE_SUMMARY_TOKENS,
+        )
+        fresh = {h: r.content.strip() for h, r in zip(missing, replies)}
+        _summary_cache_io(store_chunk_group_summaries, fresh, model)
+        summaries.update(fresh)
+    return [summaries[h] for h in hashes]
+
+# Summarizes groups of chunks in parallel, re-summarizing the summaries until
+# they fit one prompt, then answers the query from them (reduce)
+def map_reduce_response(llm, query, docs):
+    model = llm.model_name
+    summaries = _map_summaries(llm, _group_texts([d.page_content for d in docs], MAP_REDUCE_GROUP_TOKENS, model))
+    while len(summaries) > 1 and sum(count_tokens(s, model) for s in summaries) > MAP_REDUCE_MIN_TOKENS:
+        groups = _group_texts(summaries, MAP_REDUCE_GROUP_TOKENS, model)
+        if len(groups) >= len(summaries):
+            break
+        summaries = _map_summaries(llm, groups)
+
+    # Summaries that no longer shrink can still exceed the window; cap them
+    parts = [Document(page_content=s, metadata={"part": i + 1}) for i, s in enumerate(summaries)]
+    parts = pack_documents(parts, model=model, budget=context_budget(model, 'document'))
+    return _stuff_response(llm, query, parts)
+
+# Perfoms LLM query using all of the provided chunks and does not fall back to OpenAI knowledge.
+# mode: "stuff" (one prompt, capped at the document budget), "map_reduce", or "auto" by size
+def LLM_response_all_chunks(query, faiss_index, mode="auto"):
+    llm = get_chat_model("gpt-4o-mini", temperature=0)
+
+    vectordb = _as_vectorstore(faiss_index)
+    all_chunks = pack_documents(
+        list(vectordb.docstore.__dict__["_dict"].values()),
+        model="gpt-4o-mini",
+        budget=MAP_REDUCE_MAX_TOKENS
     )
-    all_chunks = list(vectordb.docstore.__dict__["_dict"].values())
-
-    class FullDumpRetriever(BaseRetriever):
-        def _get_relevant_documents(self, q):
-            return all_chunks
 
-    retriever = FullDumpRetriever()
+    if mode == "auto":
+        total = sum(count_tokens(d.page_content, "gpt-4o-mini") for d in all_chunks)
+        mode = "map_reduce" if total > MAP_REDUCE_MIN_TOKENS else "stuff"
+    if mode == "map_reduce":
+        return map_reduce_response(llm, query, all_chunks)
 
-    qa_chain = RetrievalQA.from_chain_type(
-        llm,
-        chain_type="stuff",
-        retriever=retriever,
-        return_source_documents=False
-    )
-
-    llm_response = qa_chain.invoke(query)
-    return llm_response
+    all_chunks = pack_documents(all_chunks, model="gpt-4o-mini", budget=context_budget("gpt-4o-mini", 'document'))
+    return _stuff_response(llm, query, all_chunks)
 
-def answer_to_QA(query, faiss_index_path):
-    llm_response = cascading_LLM_response(query, faiss_index_path)
+def answer_to_QA(query, faiss_index):
+    llm_response = cascading_LLM_response(query, faiss_index)
     
     # Response without citations
     answer_txt = process_llm_response(llm_response)
@@ -146,8 +232,8 @@ def answer_to_QA(query, faiss_index_path):
 
     return answer_txt
 
-def answer_to_QA_all_chunks(query, faiss_index_path):
-    llm_response = LLM_response_all_chunks(query, faiss_index_path)
+def answer_to_QA_all_chunks(query, faiss_index, mode="auto"):
+    llm_response = LLM_response_all_chunks(query, faiss_index, mode)
     answer_txt = process_llm_response(llm_response)
 
     return answer_txt
@@ -0,0 +1,113 @@
+"""
+Buffered File analytics counters (raw views, personalized views, chats).
+
+View and chat routes used to load the File row, add one in Python and
+commit: a row lock per hit on popular lectures, and lost updates when two
+requests read the same value. They now call `increment()`, which only
+touches an in-process dict; `flush()` writes the aggregated deltas as one
+batched `UPDATE "File" SET x = x + n`.
+
+- A background thread flushes every ANALYTICS_FLUSH_SECONDS, or sooner once
+  ANALYTICS_FLUSH_MAX_FILES files have pending counts.
+- Reports call flush() first so they include everything counted so far.
+- A failed flush puts its deltas back for the next one. Counts are flushed
+  at interpreter exit; a worker that is killed loses at most one interval.
+"""
+import os
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+
+from src.db.session import Session
+from src.db.queries import FILE_COUNTERS, increment_file_counters
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_FLUSH_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "5"))
+ANALYTICS_FLUSH_MAX_FILES = int(os.getenv("ANALYTICS_FLUSH_MAX_FILES", "500"))
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()   # one flush at a time, so flush() returns only once earlier counts are written
+_pending = defaultdict(Counter)  # file id -> {counter: n}
+_stats = {'increments': 0, 'flushes': 0, 'rowsWritten': 0, 'failures': 0}
+_wake = threading.Event()
+_flusher = None
+_flusher_pid = None
+
+
+def increment(file_id, counter: str, n: int = 1):
+    """Counts `n` for one of FILE_COUNTERS on a file; never touches the DB."""
+    if counter not in FILE_COUNTERS:
+        raise ValueError(f"Unknown file counter: {counter}")
+    with _lock:
+        _pending[str(file_id)][counter] += n
+        _stats['increments'] += 1
+        full = len(_pending) >= ANALYTICS_FLUSH_MAX_FILES
+    _ensure_flusher()
+    if full:
+        _wake.set()
+
+
+def flush() -> int:
+    """Writes all pending counts; returns the number of files updated."""
+    with _flush_lock:
+        with _lock:
+            batch = dict(_pending)
+            _pending.clear()
+        if not batch:
+            return 0
+        db = Session()
+        try:
+            increment_file_counters(db, batch)
+        except Exception:
+            db.rollback()
+            with _lock:
+                for file_id, counts in batch.items():
+                    _pending[file_id].update(counts)
+                _stats['failures'] += 1
+            raise
+        finally:
+            db.close()
+        with _lock:
+            _stats['flushes'] += 1
+            _stats['rowsWritten'] += len(batch)
+        return len(batch)
+
+
+def _flush_loop():
+    while True:
+        _wake.wait(ANALYTICS_FLUSH_SECONDS)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            logger.warning("Analytics counter flush failed: %s", e)
+
+
+def _ensure_flusher():
+    global _flusher, _flusher_pid
+    # Threads don't survive fork; a forked worker starts its own
+    if _flusher is not None and _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher is None or _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            _flusher = threading.Thread(target=_flush_loop, name="analytics-flush", daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception as e:
+        logger.warning("Analytics counter flush at exit failed: %s", e)
+
+
+def get_counter_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats['pendingFiles'] = len(_pending)
+        stats['pendingCounts'] = sum(sum(c.values()) for c in _pending.values())
+    return stats
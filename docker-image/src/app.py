@@ -1,30 +1,38 @@
 import os
 import uuid
-import tempfile
+import logging
 import pickle
 import faiss
 import numpy as np
-import tempfile
-import shutil
 import json
 from datetime import datetime
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, g
 from flask_cors import CORS
 import firebase_admin
 from firebase_admin import auth, credentials
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import text
 from src.db.schema import Base
-from openai import OpenAI
-from transcriber import transcribe_audio
-from indexer import rebuild_course_index, rebuild_file_index, store_file_embeddings
+from src.db.session import engine, Session
+from src.db.pool_metrics import pool_stats
+from src.clients import get_openai_client
+from indexer import remove_file_from_course_index
+from index_coordinator import apply_course_index_update, request_course_rebuild
+from semantic_cache import (
+    SEMANTIC_CACHE_ENABLED, persona_bucket, bucket_answers, lookup as semantic_lookup, store as semantic_store,
+    get_semantic_cache_stats
+)
+from context_packer import pack_chunks
+from auth_cache import verify_session, get_identity, invalidate_session, invalidate_user, get_auth_cache_stats
+from chat_history import recent_turns, history_messages
+from analytics_counters import increment as count_file_event, flush as flush_file_counters, get_counter_stats
+from faiss_cache import get_file_vectorstore, get_course_index, get_faiss_cache_stats, invalidate as invalidate_faiss_cache
 from io import BytesIO
-from src.textUtils import openai_embed_text
+from src.textUtils import embed_query, get_embedding_cache_stats, get_query_cache_stats
 
 from src.db.queries import (
     # User & Role
-    get_access_code_by_course, get_access_code_by_id, get_course_title, get_enrollment, get_file_metrics_for_course, get_files_without_raw_by_module, get_module_metrics_for_course, get_report_by_course, get_student_questions_for_course, get_user_by_id, get_user_by_email, get_user_by_firebase_uid,
+    get_access_code_by_course, get_access_code_by_id, file_has_index, get_file_course_id, get_course_students, get_modules_with_files, get_users_with_roles, get_course_title, get_enrollment, get_file_metrics_for_course, get_module_metrics_for_course, get_report_by_course, get_student_questions_for_course, get_user_by_id, get_user_by_email, get_user_by_firebase_uid,
     create_user, update_user, delete_user,
     get_role_by_user_id, set_role,
     # Profiles
@@ -41,7 +49,8 @@ from src.db.queries import (
     update_personalized_file, delete_personalized_file,
     get_chat_by_id, get_chats_by_student, create_chat, update_chat, delete_chat,
     get_message_by_id, get_messages_by_chat, create_message, delete_messages_after,
-    get_report_by_id, create_report, update_report, delete_report
+    get_report_by_id, create_report, update_report, delete_report,
+    create_ingestion_job, get_ingestion_job_by_id, search_file_chunks
 )
 
 from src.prompts import (
@@ -53,9 +62,9 @@ from src.prompts import (
     prompt_generate_personalized_file_content
 )
 
-from FAISS_db_generation import create_database, generate_citations, replace_sources, file_cleanup
-
 load_dotenv()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 
@@ -64,15 +73,6 @@ app.config['TESTING'] = False
 cred = credentials.Certificate(os.getenv("FIREBASE_KEY_PATH", "firebaseKey.json"))
 firebase_admin.initialize_app(cred)
 
-POSTGRES_URL = os.getenv("POSTGRES_URL")
-if not POSTGRES_URL:
-    raise RuntimeError("POSTGRES_URL not set")
-engine = create_engine(
-    POSTGRES_URL,
-    pool_pre_ping=True,   # Validate connection before each checkout
-    pool_recycle=1800     # Recycle connections every 30 minutes to avoid idle EOF
-)
-Session = sessionmaker(bind=engine, expire_on_commit=False)
 Base.metadata.create_all(engine)
 
 # ---------------------------------------------------------------------------
@@ -107,12 +107,32 @@ if 'university' not in instr_cols:
         conn.execute(text('ALTER TABLE "InstructorProfile" ADD COLUMN university VARCHAR(128)'))
         conn.commit()
 
+def get_db():
+    """
+    The request's Session, opened on first use and closed by teardown_db on
+    every exit path. Routes may still close it early to hand the connection
+    back before slow work; the next use reopens it.
+    """
+    if 'db' not in g:
+        g.db = Session()
+    return g.db
+
+
+@app.teardown_appcontext
+def teardown_db(exc):
+    db = g.pop('db', None)
+    if db is not None:
+        if exc is not None:
+            db.rollback()
+        db.close()
+
+
 def get_user_session():
     token = request.cookies.get('session')
     if not token:
         return {'error': 'Missing session cookie'}
     try:
-        return auth.verify_session_cookie(token, check_revoked=True)
+        return verify_session(token)
     except Exception as e:
         return {'error': str(e)}
 
@@ -124,19 +144,26 @@ def verify_role(required_role):
 
     firebase_uid = session['uid']
 
-    db = Session()
-    user = get_user_by_firebase_uid(db, firebase_uid)
-    if not user:
-        db.close()
-        return None, (jsonify({'error': 'User not found'}), 404)
+    def load_identity():
+        db = Session()
+        try:
+            user = get_user_by_firebase_uid(db, firebase_uid)
+            if not user:
+                return None
+            role = get_role_by_user_id(db, user.id)
+            return user.id, role.role_type if role else None
+        finally:
+            db.close()
 
-    role = get_role_by_user_id(db, user.id) 
-    db.close()
+    identity = get_identity(firebase_uid, load_identity)
+    if not identity:
+        return None, (jsonify({'error': 'User not found'}), 404)
 
-    if not role or role.role_type != required_role:
+    user_id, role_type = identity
+    if role_type != required_role:
         return None, (jsonify({'error': 'Forbidden'}), 403)
 
-    return user.id, None
+    return user_id, None
 
 
 def verify_admin():    return verify_role('admin')
@@ -151,7 +178,7 @@ def me_get():
         return jsonify(session), 401
 
     firebase_uid = session['uid']
-    db = Session()
+    db = get_db()
     user = get_user_by_firebase_uid(db, firebase_uid)
     if not user:
         app.logger.error(f"User with firebase_uid {firebase_uid} not found in local DB.")
@@ -204,7 +231,7 @@ def me_patch():
     firebase_uid = session['uid']
     data = request.get_json() or {}
 
-    db = Session()
+    db = get_db()
     user = get_user_by_firebase_uid(db, firebase_uid)
     if not user:
         db.close()
@@ -259,7 +286,7 @@ def me_delete():
 
     firebase_uid = session['uid']
 
-    db = Session()
+    db = get_db()
     user = get_user_by_firebase_uid(db, firebase_uid)
     if not user:
         db.close()
@@ -293,7 +320,7 @@ def register_instructor():
     if not email or not pwd or not name:
         return jsonify({'error':'Email, password, and name required'}), 400
 
-    db = Session()
+    db = get_db()
     existing_user = get_user_by_firebase_uid(db, firebase_uid)
     if not existing_user:
         existing_user = get_user_by_email(db, email)
@@ -331,7 +358,7 @@ def register_student():
     if not email or not pwd:
         return jsonify({'error':'Email and password required'}), 400
 
-    db = Session()
+    db = get_db()
     existing_user = get_user_by_firebase_uid(db, firebase_uid)
     if not existing_user:
         existing_user = get_user_by_email(db, email)
@@ -358,7 +385,7 @@ def instructor_profile():
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
 
     if request.method == 'POST':
         data = request.get_json() or {}
@@ -400,6 +427,8 @@ def instructor_profile():
     # DELETE
     delete_instructor_profile(db, user_id)
     delete_user(db, user_id)
+    invalidate_user(user_id)
+    invalidate_session(request.cookies['session'])
     db.close()
     resp = jsonify({'message':'Instructor deleted'})
     resp.set_cookie('session','',max_age=0)
@@ -410,7 +439,7 @@ def student_courses():
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     courses = get_courses_by_student_id(db, user_id)
     db.close()
     return jsonify([
@@ -432,7 +461,7 @@ def student_create_courses():
     if err: 
         return err
         
-    db = Session()
+    db = get_db()
     if request.method == 'POST':
         data = request.get_json() or {}
         title = data.get('title')
@@ -481,7 +510,9 @@ def student_create_courses():
     try:
         # Get all courses where creator_id matches the student's user_id
         stmt = text("""
-            SELECT c.* FROM "Course" c
+            SELECT c.id, c.title, c.description, c.code, c.term, c.published,
+                   c.created_at, c.last_updated
+            FROM "Course" c
             WHERE c.creator_id = :user_id
             ORDER BY c.created_at DESC
         """)
@@ -509,7 +540,7 @@ def instructor_courses():
     user_id, err = verify_instructor()
     if err: 
         return err
-    db = Session()
+    db = get_db()
     if request.method == 'POST':
         data = request.get_json() or {}
         title = data.get('title')
@@ -557,7 +588,7 @@ def student_manage_course(course_id):
     if err:
         return err
         
-    db = Session()
+    db = get_db()
     try:
         # Get the course and verify ownership
         course = get_course_by_id(db, course_id)
@@ -615,7 +646,7 @@ def student_manage_modules(course_id):
     if err:
         return err
         
-    db = Session()
+    db = get_db()
     try:
         # Verify the course exists and is owned by the student
         course = get_course_by_id(db, course_id)
@@ -666,7 +697,7 @@ def student_manage_single_module(module_id):
     if err:
         return err
         
-    db = Session()
+    db = get_db()
     try:
         # Get the module and verify ownership through the course
         module = get_module_by_id(db, module_id)
@@ -729,7 +760,7 @@ def student_manage_module_files(module_id):
     if err:
         return err
         
-    db = Session()
+    db = get_db()
     try:
         # Get the module and verify ownership through the course
         module = get_module_by_id(db, module_id)
@@ -754,15 +785,6 @@ def student_manage_module_files(module_id):
                 db.close()
                 return jsonify({'error': 'No selected file'}), 400
                 
-            # Process file upload similar to instructor_files
-            transcription = None
-            mimetype = fobj.mimetype or ""
-            
-            # Handle audio transcription if needed
-            if mimetype.startswith("audio/") or mimetype in ["application/octet-stream", "video/mp4"]:
-                transcription = transcribe_audio(fobj)
-                fobj.stream.seek(0)
-                
             file_bytes = fobj.read()
             
             # Create file record
@@ -776,68 +798,17 @@ def student_manage_module_files(module_id):
                 file_data=file_bytes
             )
             
-            if transcription is not None:
-                update_file(db, new_file.id, transcription=transcription)
-                
-            # Process file for search indexing
-            tmp_root = tempfile.mkdtemp(prefix=f"faiss_tmp_{new_file.id}_")
-            tmp_idx_dir = os.path.join(tmp_root, "faiss_index")
-            os.makedirs(tmp_idx_dir, exist_ok=True)
-            
-            try:
-                if transcription is not None:
-                    input_filename = "transcription.txt"
-                    with open(os.path.join(tmp_idx_dir, input_filename), "w", encoding="utf-8") as txt:
-                        txt.write(transcription)
-                else:
-                    ext = os.path.splitext(fobj.filename)[1]
-                    input_filename = f"uploaded{ext}"
-                    with open(os.path.join(tmp_idx_dir, input_filename), "wb") as out:
-                        out.write(file_bytes)
-                
-                # Generate FAISS index files
-                create_database(tmp_idx_dir)
-                generate_citations(tmp_idx_dir)
-                file_cleanup(tmp_idx_dir)
-                
-                # Read generated index files
-                with open(os.path.join(tmp_idx_dir, "index.faiss"), "rb") as fidx:
-                    file_idx = fidx.read()
-                with open(os.path.join(tmp_idx_dir, "index.pkl"), "rb") as fpkl:
-                    file_pkl = fpkl.read()
-                    
-                # Store index in DB
-                update_file(db, new_file.id,
-                          index_faiss=file_idx,
-                          index_pkl=file_pkl)
-                
-                # Rebuild course-level index
-                idx_bytes, pkl_bytes = rebuild_course_index(db, course.id)
-                update_course(
-                    db,
-                    course_id=course.id,
-                    index_faiss=idx_bytes,
-                    index_pkl=pkl_bytes
-                )
-                store_file_embeddings(db, str(new_file.id))
-                
-            except Exception as e:
-                app.logger.error(f"Error processing file: {str(e)}")
-                return jsonify({'error': f'Failed to process file: {str(e)}'}), 500
-                
-            finally:
-                if os.path.exists(tmp_root):
-                    shutil.rmtree(tmp_root)
-            
-            db.commit()
+            # Transcription, extraction and embedding run in the ingestion worker
+            job = create_ingestion_job(db, 'ingest_file', file_id=new_file.id,
+                                       course_id=course.id, created_by=user_id)
             return jsonify({
                 'id': str(new_file.id),
                 'title': new_file.title,
                 'filename': new_file.filename,
                 'file_type': new_file.file_type,
                 'file_size': new_file.file_size,
-                'transcription': transcription
-            }), 201
+                'jobId': str(job.id)
+            }), 202
             
         elif request.method == 'GET':
             # List all files in the module
@@ -864,7 +835,7 @@ def student_manage_file(file_id):
     if err:
         return err
         
-    db = Session()
+    db = get_db()
     try:
         # Get the file and verify ownership through the module and course
         file = get_file_by_id(db, file_id)
@@ -899,7 +870,7 @@ def student_manage_file(file_id):
             else:
                 # Return file details
                 # Check if file has embeddings (FAISS index and pickle data)
-                has_embeddings = file.index_faiss is not None and file.index_pkl is not None
+                has_embeddings = file_has_index(db, file.id)
                 
                 return jsonify({
                     'id': str(file.id),
@@ -917,15 +888,13 @@ def student_manage_file(file_id):
             # Delete the file
             delete_file(db, file_id)
             db.commit()
+            invalidate_faiss_cache('file', file_id)
             
-            # Rebuild course index after file deletion
+            # Drop the deleted file's vectors from the course index
             if course.id:
-                idx_bytes, pkl_bytes = rebuild_course_index(db, course.id)
-                update_course(
-                    db,
-                    course_id=course.id,
-                    index_faiss=idx_bytes,
-                    index_pkl=pkl_bytes
+                apply_course_index_update(
+                    db, course.id,
+                    lambda latest: remove_file_from_course_index(db, latest, file_id)
                 )
             
             return jsonify({'message': 'File deleted successfully'}), 200
@@ -940,7 +909,7 @@ def student_manage_file(file_id):
 def instructor_manage_course(course_id):
     user_id, err = verify_instructor()
     if err: return err
-    db = Session()
+    db = get_db()
     c = get_course_by_id(db, course_id)
     if not c or str(c.instructor_id)!=str(user_id):
         db.close(); return jsonify({'error':'Forbidden'}), 403
@@ -954,13 +923,25 @@ def instructor_manage_course(course_id):
     delete_course(db, course_id)
     db.close(); return jsonify({'message':'Deleted'}), 200
 
+@app.route('/instructor/courses/<course_id>/reindex', methods=['POST'])
+def instructor_reindex_course(course_id):
+    user_id, err = verify_instructor()
+    if err: return err
+    db = get_db()
+    c = get_course_by_id(db, course_id)
+    if not c or str(c.instructor_id)!=str(user_id):
+        db.close(); return jsonify({'error':'Forbidden'}), 403
+    # Repeated requests collapse into the one queued rebuild job
+    job = request_course_rebuild(db, c.id, created_by=user_id)
+    db.close(); return jsonify({'jobId':str(job.id)}), 202
+
 @app.route('/instructor/courses/<course_id>/accesscodes', methods=['POST','GET'])
 def instructor_accesscodes(course_id):
     user_id, err = verify_instructor()
     if err: 
         return err
 
-    db = Session()
+    db = get_db()
     c = get_course_by_id(db, course_id)
     if not c or str(c.instructor_id) != str(user_id):
         db.close()
@@ -981,7 +962,7 @@ def instructor_delete_accesscode(code_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     ac = get_access_code_by_id(db, code_id)
     if not ac:
         db.close()
@@ -1000,7 +981,7 @@ def instructor_course_details(course_id):
     if err:
         return err
 
-    db = Session()
+    db = get_db()
     course = get_course_by_id(db, course_id)
     if not course or str(course.instructor_id) != str(user_id):
         db.close()
@@ -1030,7 +1011,7 @@ def instructor_unenroll(enrollment_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     e = get_enrollment(db, enrollment_id)
     if not e:
         db.close()
@@ -1050,17 +1031,14 @@ def instructor_course_students(course_id):
     if err:
         return err
 
-    db = Session()
+    db = get_db()
     course = get_course_by_id(db, course_id)
     if not course or str(course.instructor_id) != str(user_id):
         db.close()
         return jsonify({'error': 'Forbidden'}), 403
 
-    enrollments = course.enrollments
     students = []
-    for e in enrollments:
-        student = get_user_by_id(db, e.user_id)
-        profile = get_student_profile(db, e.user_id)
+    for e, student, profile in get_course_students(db, course.id):
         students.append({
             'id': str(student.id),
             'email': student.email,
@@ -1080,7 +1058,7 @@ def instructor_modules(course_id):
     if err:
         return err
 
-    db = Session()
+    db = get_db()
     course = get_course_by_id(db, course_id)
 
     if not course or str(course.instructor_id) != str(user_id):
@@ -1109,7 +1087,7 @@ def instructor_manage_module(module_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     m = get_module_by_id(db, module_id)
     if not m:
         db.close()
@@ -1136,7 +1114,7 @@ def instructor_files(module_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     module = get_module_by_id(db, module_id)
     if not module:
         db.close()
@@ -1151,15 +1129,6 @@ def instructor_files(module_id):
         if not fobj:
             db.close()
             return jsonify({'error': 'Missing file'}), 400
-        transcription = None
-        mimetype = fobj.mimetype or ""
-        print(f"📎 Uploaded file mimetype: {mimetype}")
-
-        if mimetype.startswith("audio/") or mimetype in ["application/octet-stream", "video/mp4"]:
-            print("🧠 Attempting transcription...")
-            transcription = transcribe_audio(fobj)
-            fobj.stream.seek(0)
-
         file_bytes = fobj.read()
         new_file = create_file(
             db,
@@ -1170,68 +1139,16 @@ def instructor_files(module_id):
             file_size=len(file_bytes),
             file_data=file_bytes
         )
-        if transcription is not None:
-            update_file(db, new_file.id, transcription=transcription)
-        
-        # Create temporary directory and write uploaded file
-        tmp_root = tempfile.mkdtemp(prefix=f"faiss_tmp_{new_file.id}_")
-        tmp_idx_dir = os.path.join(tmp_root, "faiss_index")
-        os.makedirs(tmp_idx_dir, exist_ok=True)
-        # If transcription, use transcribed text, otherwise use uploaded file
-        if transcription is not None:
-            input_filename = "transcription.txt"
-            with open(os.path.join(tmp_idx_dir, input_filename), "w", encoding="utf-8") as txt:
-                txt.write(transcription)
-        else:
-            # Extract file extension
-            ext = os.path.splitext(fobj.filename)[1]
-            input_filename = f"uploaded{ext}"
-            with open(os.path.join(tmp_idx_dir, input_filename), "wb") as out:
-                out.write(file_bytes)
-
-        # Generate FAISS index files
-        create_database(tmp_idx_dir)
-        generate_citations(tmp_idx_dir)
-        file_cleanup(tmp_idx_dir)
-
-        # Read generated index files
-        try:
-            with open(os.path.join(tmp_idx_dir, "index.faiss"), "rb") as fidx:
-                file_idx = fidx.read()
-            with open(os.path.join(tmp_idx_dir, "index.pkl"), "rb") as fpkl:
-                file_pkl = fpkl.read()
-        except Exception as e:
-            shutil.rmtree(tmp_root)
-            db.close()
-            return jsonify({'error': f'Failed to read index files: {e}'}), 500
-        
-        # Store index in DB
-        app.logger.debug("FILE INDEX sizes:", len(file_idx), len(file_pkl))
-        update_file(db, new_file.id,
-                    index_faiss=file_idx,
-                    index_pkl=file_pkl)        
-        
-        # Rebuild course-level index
-        idx_bytes, pkl_bytes = rebuild_course_index(db, course.id)
-        app.logger.debug("COURSE INDEX sizes:", len(idx_bytes), len(pkl_bytes))
-        update_course(
-            db,
-            course_id=course.id,
-            index_faiss=idx_bytes,
-            index_pkl=pkl_bytes
-        )
-        store_file_embeddings(db, str(new_file.id))
-
-        # Cleanup
-        
-        shutil.rmtree(tmp_root)
+        # Transcription, extraction and embedding run in the ingestion worker
+        job = create_ingestion_job(db, 'ingest_file', file_id=new_file.id,
+                                   course_id=course.id, created_by=user_id)
         db.close()
 
         return jsonify({
-            'id':            str(new_file.id),
-            'filename':      new_file.filename,
-            'transcription': transcription
-        }), 201
+            'id':       str(new_file.id),
+            'filename': new_file.filename,
+            'jobId':    str(job.id)
+        }), 202
 
     # GET: Return file list
     files = get_files_by_module(db, module_id)
@@ -1248,7 +1165,7 @@ def instructor_files(module_id):
 
 @app.route('/instructor/modules/<module_id>/files/upload', methods=['POST'])
 def upload_to_module(module_id):
-    db = Session()
+    db = get_db()
     try:
         file = request.files.get('file')
         if not file:
@@ -1265,8 +1182,10 @@ def upload_to_module(module_id):
             file_data=file_data,
         )
 
-        num_chunks = store_file_embeddings(db, str(new_file.id))
-        return jsonify({"message": f"File added and embedded into course. {num_chunks} chunks."})
+        job = create_ingestion_job(db, 'ingest_file', file_id=new_file.id,
+                                   course_id=new_file.module.course_id)
+        return jsonify({"message": "File added and queued for embedding.",
+                        "id": str(new_file.id), "jobId": str(job.id)}), 202
 
     except Exception as e:
         db.rollback()
@@ -1274,9 +1193,51 @@ def upload_to_module(module_id):
     finally:
         db.close()
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def ingestion_job_status(job_id):
+    session = get_user_session()
+    if 'error' in session:
+        return jsonify(session), 401
+
+    db = get_db()
+    try:
+        user = get_user_by_firebase_uid(db, session['uid'])
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        try:
+            job = get_ingestion_job_by_id(db, job_id)
+        except ValueError:
+            job = None
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+
+        # Visible to the uploader and to whoever owns the course
+        course = get_course_by_id(db, job.course_id) if job.course_id else None
+        owners = {str(job.created_by)}
+        if course:
+            owners |= {str(course.instructor_id), str(course.creator_id)}
+        if str(user.id) not in owners:
+            return jsonify({'error': 'Forbidden'}), 403
+
+        return jsonify({
+            'id':         str(job.id),
+            'kind':       job.kind,
+            'status':     job.status,
+            'progress':   job.progress,
+            'message':    job.message,
+            'result':     job.result,
+            'fileId':     str(job.file_id) if job.file_id else None,
+            'attempts':   job.attempts,
+            'createdAt':  job.created_at.isoformat() if job.created_at else None,
+            'startedAt':  job.started_at.isoformat() if job.started_at else None,
+            'finishedAt': job.finished_at.isoformat() if job.finished_at else None
+        }), 200
+    finally:
+        db.close()
+
 @app.route('/courses/<course_id>/search', methods=['POST'])
 def search_course_chunks(course_id):
-    db = Session()
+    db = get_db()
     try:
         data = request.get_json()
         query = data.get("query")
@@ -1284,18 +1245,10 @@ def search_course_chunks(course_id):
             return jsonify({"error": "Missing query"}), 400
 
         # Embed the query sentence
-        vector_list = openai_embed_text([query])[0].tolist()
-        pgvector_str = f"[{','.join(map(str, vector_list))}]"
-
-        # Perform vector similarity search
-        sql = text("""
-            SELECT content
-            FROM "FileChunk"
-            WHERE course_id = :cid
-            ORDER BY embedding <-> :query_vec
-            LIMIT 5
-        """)
-        rows = db.execute(sql, {"cid": course_id, "query_vec": pgvector_str}).fetchall()
+        vector_list = embed_query(query).tolist()
+
+        # Perform vector similarity search (HNSW, filtered to the course)
+        rows = search_file_chunks(db, course_id, vector_list, k=5)
         return jsonify({"results": [{"content": row[0]} for row in rows]})
 
     except Exception as e:
@@ -1309,7 +1262,7 @@ def instructor_manage_file(file_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     f = get_file_by_id(db, file_id)
     if not f:
         db.close()
@@ -1335,6 +1288,11 @@ def instructor_manage_file(file_id):
         db.close()
         return jsonify({'id': str(updated.id)}), 200
     delete_file(db, file_id)
+    invalidate_faiss_cache('file', file_id)
+    apply_course_index_update(
+        db, course.id,
+        lambda latest: remove_file_from_course_index(db, latest, file_id)
+    )
     db.close()
     return jsonify({'message': 'Deleted'}), 200
 
@@ -1343,7 +1301,7 @@ def instructor_file_content(file_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     f = get_file_by_id(db, file_id)
     if not f:
         db.close()
@@ -1362,7 +1320,7 @@ def student_profile():
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
 
     if request.method == 'POST':
         data = request.get_json() or {}
@@ -1415,6 +1373,8 @@ def student_profile():
     # DELETE
     delete_student_profile(db, user_id)
     delete_user(db, user_id)
+    invalidate_user(user_id)
+    invalidate_session(request.cookies['session'])
     db.close()
     resp = jsonify({'message':'Student deleted'})
     resp.set_cookie('session','',max_age=0)
@@ -1425,7 +1385,7 @@ def student_enrollments():
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     if request.method == 'POST':
         code = request.get_json().get('accessCode')
         ac = get_access_code_by_code(db, code=code)
@@ -1478,7 +1438,7 @@ def student_file_content(file_id):
     if err:
         return err
 
-    db = Session()
+    db = get_db()
 
     f = get_file_by_id(db, file_id)
     if not f:
@@ -1503,7 +1463,7 @@ def student_unenroll(enrollment_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     e = get_enrollment(db, enrollment_id)
     if not e or str(e.user_id) != str(user_id):
         db.close()
@@ -1519,7 +1479,7 @@ def moduleswithfiles(course_id):
         return jsonify(session), 401
 
     firebase_uid = session['uid']
-    db = Session()
+    db = get_db()
     user = get_user_by_firebase_uid(db, firebase_uid)
     role = get_role_by_user_id(db, user.id)
 
@@ -1536,10 +1496,9 @@ def moduleswithfiles(course_id):
         db.close()
         return jsonify({'error':'Forbidden'}), 403
 
-    modules = get_modules_by_course(db, course_id)
     out = []
-    for m in modules:
-        rows = get_files_without_raw_by_module(db, m.id)
+    for m in get_modules_with_files(db, course_id):
+        rows = sorted(m.files, key=lambda f: f.ordering)
         out.append({
             'id':       str(m.id),
             'title':    m.title,
@@ -1562,7 +1521,7 @@ def student_modules(course_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     if not get_enrollment_by_student_course(db, user_id, course_id):
         db.close()
         return jsonify({'error': 'Forbidden'}), 403
@@ -1575,7 +1534,7 @@ def student_files(module_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     m = get_module_by_id(db, module_id)
     if not m or not get_enrollment_by_student_course(db, user_id, m.course_id):
         db.close()
@@ -1589,7 +1548,7 @@ def student_list_pfiles():
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     pfs = get_personalized_files_by_student(db, user_id)
     db.close()
     return jsonify([{
@@ -1629,42 +1588,26 @@ def generate_personalized_file_content():
         persona.append(f"they study best **{profile['schedule']}**")
     full_persona = ". ".join(persona)
 
-    # Fetch FAISS data from DB
-    db_session = Session()
+    # Fetch the file's FAISS store (cached across requests)
+    db_session = get_db()
     try:
-        file = get_file_by_id(db_session, file_id)
-        if file:
-            # Create temp directory
-            tmp_root = tempfile.mkdtemp(prefix=f"faiss_tmp_{file_id}_")
-            tmp_idx_dir = os.path.join(tmp_root, "faiss_index")
-            os.makedirs(tmp_idx_dir, exist_ok=True) 
-            
-            faiss_bytes = file.index_faiss
-            pkl_bytes = file.index_pkl
-    except Exception as e:
-        print(f"Error fetching file for ID {file_id}: {e}")
+        vectordb = get_file_vectorstore(db_session, file_id)
     finally:
         db_session.close()
+    if vectordb is None:
+        return jsonify({"error": "File not found or not indexed yet"}), 404
 
     try:
-        with open(os.path.join(tmp_idx_dir, "index.faiss"), "wb") as idx_faiss:
-            idx_faiss.write(faiss_bytes)
-        with open(os.path.join(tmp_idx_dir, "index.pkl"), "wb") as idx_pkl:
-            idx_pkl.write(pkl_bytes)
-
-        # Generate response using the temp directory
-        response = prompt_generate_personalized_file_content(tmp_idx_dir, full_persona)
+        # Generate response from the in-memory store
+        response = prompt_generate_personalized_file_content(vectordb, full_persona)
         # Verify JSON is valid
         try:
             response_json = json.loads(response)
         except (ValueError, AttributeError, IndexError) as e:
             return jsonify({"error": "Invalid JSON returned from AI response", "details": str(e)}), 400
 
-        # Recursively remove temp directory
-        shutil.rmtree(tmp_root)
-            
         # Save personalized file to DB
-        db = Session()
+        db = get_db()
         print("Saving personalized file with original_file_id:", file_id)
         try:
             saved_file = create_personalized_file(
@@ -1687,7 +1630,7 @@ def get_student_personalized_file(pf_id):
     if err:
         return err
 
-    db = Session()
+    db = get_db()
     pf = get_personalized_file_by_id(db, pf_id)
 
     if not pf or str(pf.user_id) != str(user_id):
@@ -1709,15 +1652,13 @@ def student_chats():
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     if request.method == 'POST':
         data = request.get_json() or {}
         file_id = data.get('fileId')
         c = create_chat(db, user_id, file_id, data.get('title'))
         if file_id:
-            f = get_file_by_id(db, file_id)
-            f.chat_count += 1
-            db.commit()
+            count_file_event(file_id, 'chat_count')
         db.close()
         return jsonify({'id': str(c.id)}), 201
     chats = get_chats_by_student(db, user_id)
@@ -1729,7 +1670,7 @@ def student_manage_chat(chat_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     chat = get_chat_by_id(db, chat_id)
     if not chat or str(chat.user_id) != str(user_id):
         db.close()
@@ -1753,7 +1694,7 @@ def student_messages(chat_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
+    db = get_db()
     if request.method == 'POST':
         data = request.get_json() or {}
         m = create_message(db, chat_id, data['role'], data['content'])
@@ -1773,7 +1714,7 @@ def student_delete_trailing():
     msg_id = data.get('id')
     if not msg_id:
         return jsonify({'error': 'Message ID required'}), 400
-    db = Session()
+    db = get_db()
     msg = get_message_by_id(db, msg_id)
     if not msg or str(msg.chat.user_id) != str(user_id):
         db.close()
@@ -1788,7 +1729,7 @@ def instructor_get_report(course_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     try:
         course = get_course_by_id(db, course_id)
         if not course or str(course.instructor_id) != str(user_id):
@@ -1806,11 +1747,12 @@ def instructor_create_or_update_report(course_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     try:
         course = get_course_by_id(db, course_id)
         if not course or str(course.instructor_id) != str(user_id):
             return jsonify({'error': 'Forbidden'}), 403
+        flush_file_counters()
         file_metrics = get_file_metrics_for_course(db, course_id)
         module_metrics = get_module_metrics_for_course(db, course_id)
         questions = get_student_questions_for_course(db, course_id)
@@ -1838,7 +1780,7 @@ def instructor_update_report(report_id):
     data = request.get_json() or {}
     if 'summary' not in data:
         return jsonify({'error': 'summary required'}), 400
-    db = Session()
+    db = get_db()
     try:
         rpt = get_report_by_id(db, report_id)
         if not rpt:
@@ -1858,7 +1800,7 @@ def instructor_delete_report(report_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     try:
         rpt = get_report_by_id(db, report_id)
         if not rpt:
@@ -1871,6 +1813,58 @@ def instructor_delete_report(report_id):
         db.close()
     return '', 204
 
+def _sse(payload: dict, event: str = None) -> str:
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(payload)}\n\n"
+
+def _stream_chat_reply(client, chat_id, messages, on_complete=None):
+    """
+    SSE body for /ai-chat: a `meta` event with the chat id, one `data` event
+    per token delta, then `done` (or `error`). Whatever was generated is saved
+    as the assistant message when the stream ends, including when the client
+    disconnects mid-answer (the server closes the generator).
+    `on_complete(db, reply)` runs only for replies that finished streaming.
+    The stream outlives the request (and teardown_db), so it writes through
+    its own Session, opened only once the reply is over.
+    """
+    parts = []
+    stream = None
+    completed = False
+    try:
+        yield _sse({'chatId': chat_id}, event='meta')
+        stream = client.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.5,
+            max_tokens=300,
+            stream=True,
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield _sse({'delta': delta})
+        completed = True
+        yield _sse({'assistant': "".join(parts).strip(), 'chatId': chat_id}, event='done')
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        app.logger.error(f"ai-chat stream failed: {e}")
+        yield _sse({'error': 'Internal server error', 'details': str(e)}, event='error')
+    finally:
+        if stream is not None:
+            # stop generating upstream if the client went away
+            stream.close()
+        assistant_reply = "".join(parts).strip()
+        if assistant_reply:
+            db = Session()
+            try:
+                create_message(db, chat_id, role="assistant", content=assistant_reply)
+                if completed and on_complete:
+                    on_complete(db, assistant_reply)
+            finally:
+                db.close()
+
 @app.route('/ai-chat', methods=['POST'])
 def ai_chat():
     try:
@@ -1884,12 +1878,13 @@ def ai_chat():
         chat_id      = data.get('id')
         file_id      = data.get('fileId')
         user_message = data.get('userMessage') or data.get('message')
-        history      = data.get('messages', [])
+        # Token streaming is opt-in; old clients keep getting one JSON reply
+        wants_stream = bool(data.get('stream')) or 'text/event-stream' in request.headers.get('Accept', '')
 
         if not user_message:
             return jsonify({'error': 'User message is required'}), 400
 
-        db = Session()
+        db = get_db()
         course_id = None
         f = get_file_by_id(db, file_id)
         print(f"Saving to chat ID: {chat_id}")
@@ -1921,30 +1916,43 @@ def ai_chat():
             chat_id = str(chat.id)
 
             if f:
-                f.chat_count += 1
-                db.commit()
+                count_file_event(f.id, 'chat_count')
 
         if not f or not f.module:
             db.close()
             return jsonify({'error': 'File or module not found'}), 404
 
         course_id = f.module.course_id
-        # 4. Save incoming user message
-        create_message(db, chat_id, role='user', content=user_message)
+        # 4. Save incoming user message; history comes from the DB, not the client
+        user_msg = create_message(db, chat_id, role='user', content=user_message)
+        turns = recent_turns(db, chat, exclude_id=user_msg.id)
 
         # 5. Embed query and retrieve top 5 chunks
-        vector_list = openai_embed_text([user_message])[0].tolist()
-        pgvector_str = f"[{','.join(map(str, vector_list))}]"
-
-        sql = text("""
-            SELECT content
-            FROM "FileChunk"
-            WHERE course_id = :cid
-            ORDER BY embedding <-> :query_vec
-            LIMIT 3
-        """)
-        rows = db.execute(sql, {"cid": course_id, "query_vec": pgvector_str}).fetchall()
-        retrieved_chunks = [row[0] for row in rows if row[0]]
+        vector_list = embed_query(user_message).tolist()
+
+        # 5a. Opt-in semantic cache; only first turns, as follow-ups depend on the history
+        bucket = None
+        if SEMANTIC_CACHE_ENABLED and not turns and not chat.summary:
+            sp = get_student_profile(db, user_id)
+            bucket = persona_bucket(sp.onboard_answers) if sp else None
+        if bucket:
+            cached_reply = semantic_lookup(db, course_id, bucket, vector_list)
+            if cached_reply:
+                create_message(db, chat_id, role="assistant", content=cached_reply)
+                db.close()
+                if wants_stream:
+                    body = _sse({'chatId': chat_id}, event='meta') + _sse({'delta': cached_reply}) \
+                        + _sse({'assistant': cached_reply, 'chatId': chat_id, 'cached': True}, event='done')
+                    return Response(body, mimetype='text/event-stream')
+                return jsonify({"assistant": cached_reply, "chatId": chat_id, "cached": True}), 200
+
+        def remember_reply(db, reply):
+            if bucket and reply:
+                semantic_store(db, course_id, bucket, user_message, vector_list, reply)
+
+        rows = search_file_chunks(db, course_id, vector_list, k=3)
+        retrieved_chunks = pack_chunks([row[0] for row in rows], model="gpt-4o",
+                                       distances=[row[3] for row in rows])
 
         # 6. Build messages for OpenAI
         messages = [
@@ -1975,13 +1983,9 @@ def ai_chat():
             }
             messages.append(material_prompt)
 
-        # Add chat history
-        for m in history:
-            if m.get("role") and m.get("content"):
-                messages.append({
-                    "role": m["role"],
-                    "content": m["content"]
-                })
+        # Add chat history, bounded by HISTORY_TOKEN_BUDGET plus a rolling summary
+        client = get_openai_client()
+        messages.extend(history_messages(db, client, chat, turns))
 
         messages.append({"role": "user", "content": user_message})
 
@@ -1992,7 +1996,11 @@ def ai_chat():
             return jsonify({'error': 'Student profile not found'}), 404
 
         answers = sp.onboard_answers or {}
-        name           = sp.name
+        if bucket:
+            # The reply may be served to the whole bucket, so personalize it
+            # with the bucket's fields only
+            answers = bucket_answers(answers)
+        name           = sp.name if not bucket else None
         job            = answers.get('job')
         traits         = answers.get('traits')
         learning_style = answers.get('learningStyle')
@@ -2032,7 +2040,13 @@ def ai_chat():
         print(messages)
 
         # 8. Call OpenAI
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        if wants_stream:
+            return Response(
+                _stream_chat_reply(client, chat_id, messages, on_complete=remember_reply),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
         resp = client.chat.completions.create(
             model="gpt-4o",
             messages=messages,
@@ -2044,6 +2058,7 @@ def ai_chat():
 
         # 9. Save assistant reply (optional)
         create_message(db, chat_id, role="assistant", content=assistant_reply)
+        remember_reply(db, assistant_reply)
 
         db.close()
 
@@ -2058,10 +2073,13 @@ def ai_chat():
 
 @app.route('/courses/<course_id>/citations', methods=['GET'])
 def citations_route(course_id):
-    course = get_course_by_id(Session(), course_id)
-    if not course.index_pkl:
+    db = get_db()
+    try:
+        _, metadata = get_course_index(db, course_id)
+    finally:
+        db.close()
+    if not metadata:
         return jsonify({'error':'No index built'}), 404
-    metadata = pickle.loads(course.index_pkl)
     citations = [
       {'source': md.get('source','Unknown'),
        'citation': f"Mock APA Citation for {md.get('filename')}"}
@@ -2091,6 +2109,8 @@ def session_login():
 
 @app.route('/sessionLogout', methods=['POST'])
 def session_logout():
+    if request.cookies.get('session'):
+        invalidate_session(request.cookies['session'])
     resp = jsonify({'message': 'Logged out'})
     resp.set_cookie('session', '', max_age=0)
     return resp, 200
@@ -2100,13 +2120,10 @@ def admin_users():
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     if request.method == 'GET':
-        from src.db.schema import User
-        users = db.query(User).all()
         result = []
-        for u in users:
-            role = get_role_by_user_id(db, u.id)
+        for u, role in get_users_with_roles(db):
             result.append({
                 'id': str(u.id),
                 'email': u.email,
@@ -2138,7 +2155,7 @@ def admin_manage_user(user_id):
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     user = get_user_by_id(db, user_id)
     if not user:
         db.close()
@@ -2158,19 +2175,36 @@ def admin_manage_user(user_id):
         updated = update_user(db, user_id=user_id, **data)
         if 'role_type' in data:
             set_role(db, user_id, data['role_type'])
+        invalidate_user(user_id)
         db.close()
         return jsonify({'id': str(updated.id), 'email': updated.email}), 200
 
     delete_user(db, user_id)
+    invalidate_user(user_id)
     db.close()
     return jsonify({'message': 'Deleted'}), 200
 
+@app.route('/admin/metrics', methods=['GET'])
+def admin_metrics():
+    admin_id, err = verify_admin()
+    if err:
+        return err
+    return jsonify({
+        'embeddingCache': get_embedding_cache_stats(),
+        'queryEmbeddingCache': get_query_cache_stats(),
+        'semanticAnswerCache': get_semantic_cache_stats(),
+        'faissCache': get_faiss_cache_stats(),
+        'authCache': get_auth_cache_stats(),
+        'fileCounters': get_counter_stats(),
+        'dbPool': pool_stats(engine)
+    }), 200
+
 @app.route('/admin/news', methods=['GET', 'POST'])
 def admin_news():
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     from src.db.queries import list_news, create_news
     if request.method == 'GET':
         items = list_news(db)
@@ -2195,7 +2229,7 @@ def admin_manage_news(news_id):
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     from src.db.queries import get_news_by_id, update_news, delete_news
     n = get_news_by_id(db, news_id)
     if not n:
@@ -2223,7 +2257,7 @@ def admin_market():
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     from src.db.queries import list_market, create_market
     if request.method == 'GET':
         items = list_market(db)
@@ -2247,7 +2281,7 @@ def admin_manage_market(market_id):
     admin_id, err = verify_admin()
     if err:
         return err
-    db = Session()
+    db = get_db()
     from src.db.queries import get_market_by_id, update_market, delete_market
     m = get_market_by_id(db, market_id)
     if not m:
@@ -2291,7 +2325,7 @@ def save_model_id():
     if not model:
         return jsonify({'error': 'Model ID is required'}), 400
 
-    db = Session()
+    db = get_db()
     updated = update_student_profile(db, user_id, model_preference=model)
     db.close()
 
@@ -2307,18 +2341,16 @@ def raw_file_view(file_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
-    f = get_file_by_id(db, file_id)
-    if not f:
+    db = get_db()
+    course_id = get_file_course_id(db, file_id)
+    if not course_id:
         db.close()
         return jsonify({'error': 'File not found'}), 404
-    m = get_module_by_id(db, f.module_id)
-    if not m or not get_enrollment_by_student_course(db, user_id, m.course_id):
+    if not get_enrollment_by_student_course(db, user_id, course_id):
         db.close()
         return jsonify({'error': 'Forbidden'}), 403
-    f.view_count_raw += 1
-    db.commit()
     db.close()
+    count_file_event(file_id, 'view_count_raw')
     return '', 204
 
 @app.route('/student/files/<file_id>/view-personalized', methods=['POST'])
@@ -2326,18 +2358,16 @@ def personalized_file_view(file_id):
     user_id, err = verify_student()
     if err:
         return err
-    db = Session()
-    f = get_file_by_id(db, file_id)
-    if not f:
+    db = get_db()
+    course_id = get_file_course_id(db, file_id)
+    if not course_id:
         db.close()
         return jsonify({'error': 'File not found'}), 404
-    m = get_module_by_id(db, f.module_id)
-    if not m or not get_enrollment_by_student_course(db, user_id, m.course_id):
+    if not get_enrollment_by_student_course(db, user_id, course_id):
         db.close()
         return jsonify({'error': 'Forbidden'}), 403
-    f.view_count_personalized += 1
-    db.commit()
     db.close()
+    count_file_event(file_id, 'view_count_personalized')
     return '', 204
 
 @app.route('/instructor/courses/<course_id>/faqs', methods=['GET'])
@@ -2345,7 +2375,7 @@ def instructor_course_faqs(course_id):
     user_id, err = verify_instructor()
     if err:
         return err
-    db = Session()
+    db = get_db()
     try:
         course = get_course_by_id(db, course_id)
         if not course or str(course.instructor_id) != str(user_id):
@@ -0,0 +1,170 @@
+"""
+Short-lived, size-bounded cache for request authentication.
+
+- Session cookies: a cookie is verified with Firebase (check_revoked=True,
+  a network call) the first time it is seen; its claims are then served from
+  memory for AUTH_CACHE_TTL_SECONDS, never past the cookie's own expiry.
+- Identities: the (user_id, role_type) a Firebase uid maps to, so verify_role
+  skips its two queries on a hit.
+- Revocation is checked in the background every
+  AUTH_REVOCATION_CHECK_SECONDS: one get_user per cached uid, evicting
+  sessions issued before the user's tokens_valid_after or of disabled users.
+  A revoked session therefore stays usable for at most that interval.
+
+Entries are keyed by a hash of the cookie, not the cookie itself. Callers
+invalidate on logout (invalidate_session) and on role or user changes
+(invalidate_user); other processes catch up within the TTL.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from firebase_admin import auth
+
+logger = logging.getLogger(__name__)
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "300"))
+AUTH_REVOCATION_CHECK_SECONDS = float(os.getenv("AUTH_REVOCATION_CHECK_SECONDS", "60"))
+
+_lock = threading.Lock()
+_sessions = OrderedDict()     # sha256(cookie) -> (claims, expires_at)
+_identities = OrderedDict()   # firebase uid -> ((user_id, role_type), expires_at)
+_stats = {'hits': 0, 'misses': 0, 'revoked': 0}
+_checker = None
+_checker_pid = None
+
+
+def _key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _get(entries: OrderedDict, key):
+    entry = entries.get(key)
+    if entry is None:
+        return None
+    value, expires_at = entry
+    if expires_at <= time.time():
+        del entries[key]
+        return None
+    entries.move_to_end(key)
+    return value
+
+
+def _put(entries: OrderedDict, key, value, expires_at: float):
+    entries[key] = (value, expires_at)
+    entries.move_to_end(key)
+    while len(entries) > AUTH_CACHE_SIZE:
+        entries.popitem(last=False)
+
+
+def verify_session(token: str) -> dict:
+    """
+    Verified claims for a session cookie; raises like
+    auth.verify_session_cookie when the cookie is invalid or revoked.
+    """
+    key = _key(token)
+    with _lock:
+        claims = _get(_sessions, key)
+        _stats['hits' if claims is not None else 'misses'] += 1
+    if claims is not None:
+        return claims
+
+    claims = auth.verify_session_cookie(token, check_revoked=True)
+    expires_at = time.time() + AUTH_CACHE_TTL_SECONDS
+    if isinstance(claims.get('exp'), (int, float)):
+        expires_at = min(expires_at, claims['exp'])
+    with _lock:
+        _put(_sessions, key, claims, expires_at)
+    _ensure_revocation_checker()
+    return claims
+
+
+def get_identity(firebase_uid, load):
+    """
+    (user_id, role_type) for a Firebase uid, calling `load()` on a miss.
+    `load` returns that tuple, or None for an unknown user (not cached).
+    """
+    with _lock:
+        identity = _get(_identities, str(firebase_uid))
+    if identity is not None:
+        return identity
+    identity = load()
+    if identity is not None:
+        with _lock:
+            _put(_identities, str(firebase_uid), identity, time.time() + AUTH_CACHE_TTL_SECONDS)
+    return identity
+
+
+def invalidate_session(token: str):
+    with _lock:
+        _sessions.pop(_key(token), None)
+
+
+def invalidate_user(user_id):
+    """Drops the cached identity of a local user (role changed, deleted, ...)."""
+    with _lock:
+        for uid in [uid for uid, ((cached_id, _), _) in _identities.items() if str(cached_id) == str(user_id)]:
+            del _identities[uid]
+
+
+def check_revocations():
+    """One background pass: evicts sessions Firebase no longer honours."""
+    with _lock:
+        by_uid = {}
+        for key, (claims, _) in _sessions.items():
+            by_uid.setdefault(claims.get('uid'), []).append((key, claims))
+
+    for uid, entries in by_uid.items():
+        try:
+            user = auth.get_user(uid)
+        except auth.UserNotFoundError:
+            user = None
+        except Exception as e:
+            logger.warning("Revocation check for %s failed: %s", uid, e)
+            continue
+        valid_after = (user.tokens_valid_after_timestamp or 0) / 1000 if user else None
+        revoked = [
+            key for key, claims in entries
+            if user is None or user.disabled or claims.get('auth_time', 0) < valid_after
+        ]
+        if revoked:
+            with _lock:
+                for key in revoked:
+                    _sessions.pop(key, None)
+                _identities.pop(str(uid), None)
+                _stats['revoked'] += len(revoked)
+
+
+def _revocation_loop():
+    while True:
+        time.sleep(AUTH_REVOCATION_CHECK_SECONDS)
+        try:
+            check_revocations()
+        except Exception as e:
+            logger.warning("Revocation check failed: %s", e)
+
+
+def _ensure_revocation_checker():
+    global _checker, _checker_pid
+    # Threads don't survive fork; a forked worker starts its own
+    if _checker is not None and _checker_pid == os.getpid():
+        return
+    with _lock:
+        if _checker is None or _checker_pid != os.getpid():
+            _checker_pid = os.getpid()
+            _checker = threading.Thread(target=_revocation_loop, name="auth-revocation", daemon=True)
+            _checker.start()
+
+
+def get_auth_cache_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats['sessions'] = len(_sessions)
+        stats['identities'] = len(_identities)
+    lookups = stats['hits'] + stats['misses']
+    stats['hitRate'] = stats['hits'] / lookups if lookups else None
+    return stats
@@ -0,0 +1,101 @@
+"""
+Server-side chat history for /ai-chat.
+
+The prompt carries at most HISTORY_TOKEN_BUDGET tokens of recent turns,
+loaded from the Message table rather than trusted from the client. Turns
+that fall out of that window are folded into Chat.summary by a small model
+and never sent verbatim again; Chat.summarized_until / summarized_until_id
+mark the newest folded message by (created_at, id), so each turn is
+summarized once and only later ones are loaded, even when several messages
+share a timestamp.
+
+On overflow the window is trimmed to HISTORY_KEEP_RATIO of the budget, so the
+summarizer runs every few turns instead of on every one. The summary itself
+is capped at HISTORY_SUMMARY_MAX_TOKENS, which keeps the whole history part
+of the prompt bounded however long the chat gets.
+"""
+import os
+import logging
+
+from sqlalchemy.orm import Session
+
+from src.textUtils import count_tokens
+from src.db.queries import get_messages_by_chat, update_chat_summary
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_KEEP_RATIO = float(os.getenv("HISTORY_KEEP_RATIO", "0.5"))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", "gpt-4o-mini")
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "300"))
+
+# Framing tokens the chat format adds around each message's content
+_MESSAGE_OVERHEAD = 4
+
+
+def _window_start(turns, budget: int) -> int:
+    """Index where the newest run of `turns` that fits in `budget` begins."""
+    used, start = 0, len(turns)
+    while start > 0:
+        cost = count_tokens(turns[start - 1].content) + _MESSAGE_OVERHEAD
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def recent_turns(db: Session, chat, exclude_id=None) -> list:
+    """User/assistant messages not yet covered by the chat's summary, oldest first."""
+    return [
+        m for m in get_messages_by_chat(db, chat.id, after=chat.summarized_until, after_id=chat.summarized_until_id)
+        if m.id != exclude_id and m.role in ('user', 'assistant')
+    ]
+
+
+def summarize_turns(client, summary, turns) -> str:
+    transcript = "\n".join(f"{m.role}: {m.content}" for m in turns)
+    previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+    resp = client.chat.completions.create(
+        model=HISTORY_SUMMARY_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "You maintain a running summary of a tutoring conversation. "
+                    "Merge the new turns into the summary. Keep the topics covered, "
+                    "what the student asked and struggled with, and any facts or "
+                    "preferences they stated. Be concise and write in the third person."
+                )
+            },
+            {"role": "user", "content": f"{previous}New turns:\n{transcript}"}
+        ],
+        temperature=0,
+        max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+    )
+    return resp.choices[0].message.content.strip()
+
+
+def history_messages(db: Session, client, chat, turns) -> list:
+    """
+    Prompt messages for the conversation so far: the rolling summary as a
+    system message (if any), then the recent `turns` verbatim. Folds turns
+    that overflow the budget into the summary first.
+    """
+    summary = chat.summary
+    if _window_start(turns, HISTORY_TOKEN_BUDGET) > 0:
+        keep = _window_start(turns, int(HISTORY_TOKEN_BUDGET * HISTORY_KEEP_RATIO))
+        folded, turns = turns[:keep], turns[keep:]
+        try:
+            summary = summarize_turns(client, summary, folded)
+            update_chat_summary(db, chat.id, summary, folded[-1].created_at, folded[-1].id)
+        except Exception as e:
+            # The prompt stays bounded either way; the fold is retried next turn
+            db.rollback()
+            logger.warning("Chat %s history summarization failed: %s", chat.id, e)
+
+    messages = []
+    if summary:
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+    messages.extend({"role": m.role, "content": m.content} for m in turns)
+    return messages
@@ -0,0 +1,118 @@
+"""
+Process-wide OpenAI clients sharing one pooled, keep-alive HTTP client.
+
+Building an OpenAI/ChatOpenAI client per request also builds a fresh httpx
+connection pool, so every call pays DNS + TCP + TLS setup again. Here one
+httpx.Client per process holds the connections, and the OpenAI and LangChain
+chat clients on top of it are built once and reused (all are thread-safe).
+
+- Clients are keyed by the API key and base URL in the environment, so
+  rotating OPENAI_API_KEY or pointing OPENAI_BASE_URL elsewhere takes effect
+  without a restart.
+- A forked child (gunicorn, multiprocessing) builds its own pool instead of
+  inheriting the parent's sockets.
+
+Tuning: OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_SECONDS,
+OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_MAX_RETRIES.
+"""
+import os
+import threading
+
+import httpx
+from openai import OpenAI
+from langchain_openai import ChatOpenAI
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "64"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "32"))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+# The SDK's own default: Whisper on long lectures and non-streaming whole-file
+# generations can legitimately take minutes
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "600"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+_lock = threading.Lock()
+_pid = None
+_http_client = None
+_openai_clients = {}
+_chat_models = {}
+_model_chains = {}   # (chat model key, name) -> object built on that model
+
+
+def _reset_after_fork():
+    global _pid, _http_client
+    if _pid != os.getpid():
+        _pid = os.getpid()
+        _http_client = None
+        _openai_clients.clear()
+        _chat_models.clear()
+        _model_chains.clear()
+
+
+def _env_key():
+    return os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_BASE_URL")
+
+
+def get_http_client() -> httpx.Client:
+    """The process's pooled HTTP client for OpenAI traffic."""
+    global _http_client
+    with _lock:
+        _reset_after_fork()
+        if _http_client is None:
+            _http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                follow_redirects=True,
+            )
+        return _http_client
+
+
+def get_openai_client() -> OpenAI:
+    """Shared OpenAI SDK client on the pooled HTTP client."""
+    http_client = get_http_client()
+    api_key, base_url = _env_key()
+    with _lock:
+        client = _openai_clients.get((api_key, base_url))
+        if client is None:
+            client = OpenAI(api_key=api_key, base_url=base_url,
+                            max_retries=OPENAI_MAX_RETRIES, http_client=http_client)
+            _openai_clients[(api_key, base_url)] = client
+        return client
+
+
+def get_chat_model(model: str = "gpt-4o-mini", temperature: float = 0, **kwargs) -> ChatOpenAI:
+    """
+    Shared LangChain chat model for these settings on the pooled HTTP client.
+    Callers must not mutate it; pass per-call options to invoke/batch instead.
+    """
+    http_client = get_http_client()
+    api_key, base_url = _env_key()
+    key = (api_key, base_url, model, temperature, tuple(sorted(kwargs.items())))
+    with _lock:
+        llm = _chat_models.get(key)
+        if llm is None:
+            llm = ChatOpenAI(model=model, temperature=temperature, api_key=api_key, base_url=base_url,
+                             max_retries=OPENAI_MAX_RETRIES, http_client=http_client, **kwargs)
+            _chat_models[key] = llm
+        return llm
+
+
+def get_model_chain(llm: ChatOpenAI, name: str, build):
+    """
+    `build(llm)` (e.g. a LangChain chain), built once per shared chat model
+    and cached under the model's own key, so it is dropped with the model
+    and never handed to a different one. Models not from get_chat_model
+    are not cached.
+    """
+    with _lock:
+        key = next((k for k, model in _chat_models.items() if model is llm), None)
+        if key is None:
+            return build(llm)
+        chain = _model_chains.get((key, name))
+        if chain is None:
+            chain = _model_chains[(key, name)] = build(llm)
+        return chain
@@ -0,0 +1,123 @@
+"""
+Token-budgeted packing of context (retrieved chunks, documents, lists) into
+LLM prompts, so prompt size and cost stay predictable.
+
+- Items are taken in relevance order (lowest distance first when distances are
+  given, else as passed) and added while they fit the budget; an item that
+  does not fit is skipped so smaller, less relevant ones can still fill it.
+- Near-duplicates are dropped, and the text a chunk shares with an
+  already-packed one (split_text windows overlap by CHUNK_OVERLAP tokens) is
+  trimmed off its ends, using word shingles.
+- Budgets are per model and per kind of prompt: 'retrieval' for top-k
+  chunks, 'document' for whole-file prompts, 'list' for lists such as
+  student questions. Override one with CONTEXT_BUDGET_<MODEL>_<KIND>,
+  e.g. CONTEXT_BUDGET_GPT_4O_RETRIEVAL=2000.
+"""
+import os
+import re
+from typing import List, Optional, Sequence
+
+from src.textUtils import count_tokens, truncate_tokens
+
+# Tokens of packed context per prompt; the rest of each model's 128k window
+# is left for instructions, history and the reply
+CONTEXT_BUDGETS = {
+    'gpt-4o': {'retrieval': 3000, 'document': 60000, 'list': 8000},
+    'gpt-4o-mini': {'retrieval': 3000, 'document': 60000, 'list': 8000},
+}
+DEFAULT_MODEL = 'gpt-4o'
+
+# Words per shingle, and the share of already-seen shingles that makes a
+# chunk a near-duplicate
+SHINGLE_WORDS = 8
+DUPLICATE_RATIO = float(os.getenv("CONTEXT_DUPLICATE_RATIO", "0.8"))
+
+# Framing tokens added per packed item (chunk header / separator)
+_ITEM_OVERHEAD = 8
+
+
+def context_budget(model: str, kind: str = 'retrieval') -> int:
+    env = re.sub(r'[^A-Z0-9]+', '_', f"CONTEXT_BUDGET_{model}_{kind}".upper())
+    if os.getenv(env):
+        return int(os.getenv(env))
+    return CONTEXT_BUDGETS.get(model, CONTEXT_BUDGETS[DEFAULT_MODEL])[kind]
+
+
+def _shingles(words: List[str]) -> List[str]:
+    lowered = [w.lower() for w in words]
+    return [" ".join(lowered[i:i + SHINGLE_WORDS]) for i in range(len(lowered) - SHINGLE_WORDS + 1)]
+
+
+def _dedupe(text: str, seen: set):
+    """
+    (`text` minus its leading/trailing words already packed, its shingles),
+    with None for the text if it is (nearly) all repeated.
+    """
+    words = text.split()
+    shingles = _shingles(words)
+    if not shingles:
+        key = " ".join(words).lower()
+        return (None if not key or key in seen else text), {key}
+
+    repeated = [s in seen for s in shingles]
+    if sum(repeated) >= DUPLICATE_RATIO * len(shingles):
+        return None, set()
+
+    lead = next((i for i, r in enumerate(repeated) if not r), len(repeated))
+    tail = next((i for i, r in enumerate(reversed(repeated)) if not r), len(repeated))
+    if not lead and not tail:
+        return text, set(shingles)
+    # A run of k seen shingles covers k + SHINGLE_WORDS - 1 words
+    start = lead + SHINGLE_WORDS - 1 if lead else 0
+    end = len(words) - (tail + SHINGLE_WORDS - 1) if tail else len(words)
+    return (" ".join(words[start:end]) if end > start else None), set(shingles)
+
+
+def _pack(texts: Sequence[str], budget: int, model: str, distances=None, dedupe=True) -> List[tuple]:
+    order = range(len(texts))
+    if distances is not None:
+        order = sorted(order, key=lambda i: distances[i])
+
+    packed, seen, used = [], set(), 0
+    for i in order:
+        text, shingles = (texts[i] or "").strip(), set()
+        if dedupe:
+            text, shingles = _dedupe(text, seen)
+        if not text:
+            continue
+        cost = count_tokens(text, model) + _ITEM_OVERHEAD
+        if used + cost > budget:
+            continue
+        packed.append((i, text))
+        seen.update(shingles)
+        used += cost
+    return packed
+
+
+def pack_chunks(chunks: Sequence[str], model: str = DEFAULT_MODEL, budget: Optional[int] = None,
+                distances: Optional[Sequence[float]] = None, dedupe: bool = True) -> List[str]:
+    """
+    Chunk texts to put in a prompt, most relevant first, within `budget`
+    tokens (default: the model's 'retrieval' budget).
+    """
+    if budget is None:
+        budget = context_budget(model, 'retrieval')
+    return [text for _, text in _pack(chunks, budget, model, distances, dedupe)]
+
+
+def pack_documents(docs, model: str = DEFAULT_MODEL, budget: Optional[int] = None):
+    """
+    LangChain Documents selected and trimmed the same way (in the order
+    given), metadata kept.
+    """
+    if budget is None:
+        budget = context_budget(model, 'retrieval')
+    packed = _pack([d.page_content for d in docs], budget, model)
+    return [type(docs[i])(page_content=text, metadata=docs[i].metadata) for i, text in packed]
+
+
+def fit_text(text: str, model: str = DEFAULT_MODEL, budget: Optional[int] = None) -> str:
+    """A single context string cut to the model's 'document' budget."""
+    if budget is None:
+        budget = context_budget(model, 'document')
+    return truncate_tokens(text, budget, model)
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS "EmbeddingCache" (
+  "content_hash" VARCHAR(64) NOT NULL,
+  "model" VARCHAR(64) NOT NULL,
+  "dimensions" INTEGER NOT NULL,
+  "embedding" BYTEA NOT NULL,
+  "created_at" TIMESTAMP NOT NULL DEFAULT now(),
+  CONSTRAINT pk_embeddingcache PRIMARY KEY ("content_hash", "model", "dimensions")
+);
@@ -0,0 +1,22 @@
+CREATE TABLE IF NOT EXISTS "IngestionJob" (
+  "id" UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  "kind" VARCHAR(32) NOT NULL DEFAULT 'ingest_file',
+  "status" VARCHAR(16) NOT NULL DEFAULT 'queued',
+  "file_id" UUID,
+  "course_id" UUID,
+  "created_by" UUID,
+  "progress" INTEGER NOT NULL DEFAULT 0,
+  "message" TEXT,
+  "result" JSONB,
+  "attempts" INTEGER NOT NULL DEFAULT 0,
+  "created_at" TIMESTAMP NOT NULL DEFAULT now(),
+  "started_at" TIMESTAMP,
+  "finished_at" TIMESTAMP,
+  CONSTRAINT fk_ingestionjob_file FOREIGN KEY("file_id") REFERENCES "File"("id") ON DELETE CASCADE,
+  CONSTRAINT fk_ingestionjob_course FOREIGN KEY("course_id") REFERENCES "Course"("id") ON DELETE CASCADE,
+  CONSTRAINT fk_ingestionjob_user FOREIGN KEY("created_by") REFERENCES "User"("id") ON DELETE SET NULL
+);
+
+-- Workers poll for the oldest queued job
+CREATE INDEX IF NOT EXISTS idx_ingestionjob_queued
+  ON "IngestionJob" ("created_at") WHERE "status" = 'queued';
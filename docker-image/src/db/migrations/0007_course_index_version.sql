@@ -0,0 +1,5 @@
+-- Bumped on every write of Course.index_faiss/index_pkl so a build started
+-- from an older index can never overwrite a newer one.
+ALTER TABLE "Course" ADD COLUMN IF NOT EXISTS "index_version" INTEGER NOT NULL DEFAULT 0;
+-- Set while a full rebuild is requested; cleared when a rebuild starts.
+ALTER TABLE "Course" ADD COLUMN IF NOT EXISTS "index_rebuild_pending" BOOLEAN NOT NULL DEFAULT FALSE;
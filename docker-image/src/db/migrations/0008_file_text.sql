@@ -0,0 +1,11 @@
+CREATE TABLE IF NOT EXISTS "FileText" (
+  "file_id" UUID PRIMARY KEY,
+  "content_hash" VARCHAR(64) NOT NULL,
+  "extractor_version" VARCHAR(32) NOT NULL,
+  "text" TEXT NOT NULL,
+  "chunks" JSONB,
+  "chunk_max_tokens" INTEGER,
+  "chunk_overlap" INTEGER,
+  "created_at" TIMESTAMP NOT NULL DEFAULT now(),
+  CONSTRAINT fk_filetext_file FOREIGN KEY("file_id") REFERENCES "File"("id") ON DELETE CASCADE
+);
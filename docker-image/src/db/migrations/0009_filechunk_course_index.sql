@@ -0,0 +1,5 @@
+-- Course filter for FileChunk searches. For small courses the planner scans
+-- this and sorts the few rows exactly; large courses use the HNSW index.
+-- CONCURRENTLY must be the only statement in its file (no transaction block).
+-- If a concurrent build fails it leaves an INVALID index: DROP it and re-run.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_filechunk_course_id ON "FileChunk" ("course_id");
@@ -0,0 +1,4 @@
+-- Approximate nearest-neighbour index for `ORDER BY embedding <-> :query_vec`.
+-- Built without blocking chunk inserts; recall/latency is tuned per query via
+-- hnsw.ef_search and hnsw.iterative_scan (see search_file_chunks).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_filechunk_embedding_hnsw ON "FileChunk" USING hnsw ("embedding" vector_l2_ops) WITH (m = 16, ef_construction = 64);
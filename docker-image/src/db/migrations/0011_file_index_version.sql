@@ -0,0 +1,3 @@
+-- Bumped whenever File.index_faiss/index_pkl are rewritten; keys the
+-- in-process vectorstore cache so stale entries are never served.
+ALTER TABLE "File" ADD COLUMN IF NOT EXISTS "index_version" INTEGER NOT NULL DEFAULT 0;
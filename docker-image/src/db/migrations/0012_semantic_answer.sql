@@ -0,0 +1,16 @@
+CREATE TABLE IF NOT EXISTS "SemanticAnswer" (
+  "id" UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+  "course_id" UUID NOT NULL,
+  "persona_hash" VARCHAR(64) NOT NULL,
+  "index_version" INTEGER NOT NULL,
+  "query" TEXT NOT NULL,
+  "embedding" vector(1536) NOT NULL,
+  "answer" TEXT NOT NULL,
+  "hits" INTEGER NOT NULL DEFAULT 0,
+  "created_at" TIMESTAMP NOT NULL DEFAULT now(),
+  CONSTRAINT fk_semanticanswer_course FOREIGN KEY("course_id") REFERENCES "Course"("id") ON DELETE CASCADE
+);
+
+-- Lookups scan one (course, persona bucket, index version) slice exactly
+CREATE INDEX IF NOT EXISTS idx_semanticanswer_bucket
+  ON "SemanticAnswer" ("course_id", "persona_hash", "index_version", "created_at");
@@ -0,0 +1,4 @@
+-- Rolling summary of chat turns that no longer fit in the ai_chat prompt
+-- window; summarized_until is the created_at of the newest folded message.
+ALTER TABLE "Chat" ADD COLUMN IF NOT EXISTS "summary" TEXT;
+ALTER TABLE "Chat" ADD COLUMN IF NOT EXISTS "summarized_until" TIMESTAMP;
@@ -0,0 +1,9 @@
+-- Map-step summaries of consecutive chunk groups, reused by every
+-- whole-file prompt over the same content (see FAISS_retriever)
+CREATE TABLE IF NOT EXISTS "ChunkGroupSummary" (
+  "content_hash" VARCHAR(64) NOT NULL,
+  "model" VARCHAR(64) NOT NULL,
+  "summary" TEXT NOT NULL,
+  "created_at" TIMESTAMP NOT NULL DEFAULT now(),
+  CONSTRAINT pk_chunkgroupsummary PRIMARY KEY ("content_hash", "model")
+);
@@ -0,0 +1,3 @@
+-- Workers refresh heartbeat_at while a job runs; a running job whose
+-- heartbeat stops is requeued (or failed after INGESTION_MAX_ATTEMPTS).
+ALTER TABLE "IngestionJob" ADD COLUMN IF NOT EXISTS "heartbeat_at" TIMESTAMP;
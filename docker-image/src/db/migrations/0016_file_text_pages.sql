@@ -0,0 +1,16 @@
+-- Extracted text is stored a page at a time so indexing can stream it in
+-- batches; chunks are re-split from the pages instead of being stored.
+CREATE TABLE IF NOT EXISTS "FileTextPage" (
+  "file_id" UUID NOT NULL,
+  "ordinal" INTEGER NOT NULL,
+  "page" INTEGER,
+  "text" TEXT NOT NULL,
+  PRIMARY KEY ("file_id", "ordinal"),
+  CONSTRAINT fk_filetextpage_file FOREIGN KEY("file_id") REFERENCES "File"("id") ON DELETE CASCADE
+);
+
+-- Rows written before this keep their whole text in "text" (read as one page)
+ALTER TABLE "FileText" ALTER COLUMN "text" DROP NOT NULL;
+ALTER TABLE "FileText" DROP COLUMN IF EXISTS "chunks";
+ALTER TABLE "FileText" DROP COLUMN IF EXISTS "chunk_max_tokens";
+ALTER TABLE "FileText" DROP COLUMN IF EXISTS "chunk_overlap";
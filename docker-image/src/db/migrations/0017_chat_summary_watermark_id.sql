@@ -0,0 +1,3 @@
+-- Messages can share a created_at, so the summary watermark is the
+-- (created_at, id) of the newest folded message; id breaks the tie.
+ALTER TABLE "Chat" ADD COLUMN IF NOT EXISTS "summarized_until_id" UUID;
@@ -0,0 +1,108 @@
+"""
+Connection pool instrumentation for the app engine.
+
+- InstrumentedQueuePool times every checkout that has to go to the pool
+  (wait time includes blocking on a full pool and opening new connections).
+- Checkout/checkin events track which connections are out, since when, and
+  for which request, so `pool_stats()` can report them.
+- A background scan logs connections held longer than DB_LEAK_WARN_SECONDS
+  once, with the route that checked them out. These are usually sessions that
+  were never closed; each one holds a pool slot until it is garbage collected.
+"""
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+DB_LEAK_WARN_SECONDS = float(os.getenv("DB_LEAK_WARN_SECONDS", "60"))
+
+_lock = threading.Lock()
+_checked_out = {}   # id(connection record) -> [checked out at, request label, reported]
+_stats = {'checkouts': 0, 'waits': 0, 'waitSecondsTotal': 0.0, 'waitSecondsMax': 0.0,
+          'timeouts': 0, 'leaksLogged': 0}
+_scanner_started = False
+
+
+class InstrumentedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with _lock:
+                _stats['timeouts'] += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with _lock:
+                _stats['waits'] += 1
+                _stats['waitSecondsTotal'] += waited
+                _stats['waitSecondsMax'] = max(_stats['waitSecondsMax'], waited)
+
+
+def _request_label() -> str:
+    try:
+        from flask import has_request_context, request
+        if has_request_context():
+            return f"{request.method} {request.path}"
+    except ImportError:
+        pass
+    return threading.current_thread().name
+
+
+def _on_checkout(dbapi_conn, record, proxy):
+    with _lock:
+        _checked_out[id(record)] = [time.monotonic(), _request_label(), False]
+        _stats['checkouts'] += 1
+
+
+def _on_checkin(dbapi_conn, record):
+    with _lock:
+        _checked_out.pop(id(record), None)
+
+
+def _scan_for_leaks():
+    while True:
+        time.sleep(max(DB_LEAK_WARN_SECONDS / 2, 1))
+        now = time.monotonic()
+        with _lock:
+            held = []
+            for entry in _checked_out.values():
+                since, label, reported = entry
+                if not reported and now - since > DB_LEAK_WARN_SECONDS:
+                    entry[2] = True
+                    held.append((now - since, label))
+            _stats['leaksLogged'] += len(held)
+        for seconds, label in held:
+            logger.warning("DB connection held for %.0fs, checked out by %s (unclosed session?)", seconds, label)
+
+
+def instrument(engine):
+    """Attaches the checkout tracking and starts the leak scan (once)."""
+    global _scanner_started
+    event.listen(engine, "checkout", _on_checkout)
+    event.listen(engine, "checkin", _on_checkin)
+    with _lock:
+        if not _scanner_started:
+            _scanner_started = True
+            threading.Thread(target=_scan_for_leaks, name="db-leak-scan", daemon=True).start()
+
+
+def pool_stats(engine) -> dict:
+    pool = engine.pool
+    now = time.monotonic()
+    with _lock:
+        stats = dict(_stats)
+        held = [now - since for since, _, _ in _checked_out.values()]
+    stats['checkedOut'] = len(held)
+    stats['longestHeldSeconds'] = max(held, default=0.0)
+    stats['waitSecondsAvg'] = stats['waitSecondsTotal'] / stats['waits'] if stats['waits'] else 0.0
+    if isinstance(pool, QueuePool):
+        stats.update({'size': pool.size(), 'overflow': pool.overflow(), 'idle': pool.checkedin()})
+    return stats
@@ -1,7 +1,10 @@
-from sqlalchemy import func, select, asc, desc, delete
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select, asc, desc, delete, update, insert, text, bindparam, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, undefer_group, selectinload
 from werkzeug.security import generate_password_hash
-from datetime import datetime
+from datetime import datetime, timedelta
+import os
+import re
 import uuid
 
 from src.db.schema import (
@@ -14,6 +17,12 @@ from src.db.schema import (
     Module,
     File,
     FileChunk,
+    IngestionJob,
+    FileText,
+    FileTextPage,
+    EmbeddingCache,
+    ChunkGroupSummary,
+    SemanticAnswer,
     AccessCode,
     Enrollment,
     PersonalizedFile,
@@ -130,6 +139,13 @@ def get_role_by_user_id(db: Session, user_id):
     return db.execute(select(Role).filter_by(user_id=user_id)).scalars().first()
 
 
+def get_users_with_roles(db: Session):
+    """All users with their Role (or None) as (User, Role) rows, in one query."""
+    return db.execute(
+        select(User, Role).outerjoin(Role, Role.user_id == User.id)
+    ).all()
+
+
 def set_role(db: Session, user_id: str, role_type: str):
     if isinstance(user_id, str):
         user_id = uuid.UUID(user_id)
@@ -196,6 +212,22 @@ def get_student_profile(db: Session, user_id):
     ).scalars().first()
 
 
+def get_course_students(db: Session, course_id):
+    """
+    (Enrollment, User, StudentProfile or None) rows for a course's students,
+    oldest enrollment first, in one query.
+    """
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    return db.execute(
+        select(Enrollment, User, StudentProfile)
+        .join(User, User.id == Enrollment.user_id)
+        .outerjoin(StudentProfile, StudentProfile.user_id == Enrollment.user_id)
+        .filter(Enrollment.course_id == course_id)
+        .order_by(Enrollment.enrolled_at)
+    ).all()
+
+
 def create_student_profile(db: Session, user_id: str, name: str, onboard_answers: dict, want_quizzes: bool = False):
     if isinstance(user_id, str):
         user_id = uuid.UUID(user_id)
@@ -277,10 +309,17 @@ def delete_admin_profile(db: Session, user_id: str):
 
 # --- Course CRUD ---
 
-def get_course_by_id(db: Session, course_id):
+def get_course_by_id(db: Session, course_id, with_index: bool = False):
+    """
+    The Course row. Its index blobs are deferred; pass with_index=True when
+    the caller reads index_faiss/index_pkl, to fetch them in the same query.
+    """
     if isinstance(course_id, str):
         course_id = uuid.UUID(course_id)
-    return db.execute(select(Course).filter_by(id=course_id)).scalars().first()
+    stmt = select(Course).filter_by(id=course_id)
+    if with_index:
+        stmt = stmt.options(undefer_group('index'))
+    return db.execute(stmt).scalars().first()
 
 
 def get_courses_by_instructor_id(db: Session, instructor_id):
@@ -334,7 +373,7 @@ def update_course(db: Session, course_id: str, **kwargs):
     c = get_course_by_id(db, course_id)
     if not c:
         return None
-    for key in ('title', 'description', 'code', 'term', 'index_pkl', 'index_faiss', 'published'):
+    for key in ('title', 'description', 'code', 'term', 'published'):
         if key in kwargs:
             setattr(c, key, kwargs[key])
     db.commit()
@@ -342,6 +381,45 @@ def update_course(db: Session, course_id: str, **kwargs):
     return c
 
 
+def get_index_version(db: Session, model, row_id):
+    """index_version of a Course or File row, without loading its blobs."""
+    if isinstance(row_id, str):
+        row_id = uuid.UUID(row_id)
+    return db.execute(select(model.index_version).filter(model.id == row_id)).scalar()
+
+
+def update_course_index(db: Session, course_id, expected_version: int,
+                        index_faiss: bytes, index_pkl: bytes) -> bool:
+    """
+    Writes the course index only if nobody has written it since
+    `expected_version` was read, and bumps index_version.
+    Returns False when the write lost the race.
+    """
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    result = db.execute(
+        update(Course)
+        .where(Course.id == course_id, Course.index_version == expected_version)
+        .values(index_faiss=index_faiss, index_pkl=index_pkl,
+                index_version=Course.index_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def set_course_rebuild_pending(db: Session, course_id, pending: bool):
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    db.execute(
+        update(Course)
+        .where(Course.id == course_id)
+        .values(index_rebuild_pending=pending)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
 
 
 def delete_course(db: Session, course_id: str):
@@ -402,10 +480,39 @@ def delete_module(db: Session, module_id: str):
 
 # --- File CRUD ---
 
-def get_file_by_id(db: Session, file_id):
+def get_file_by_id(db: Session, file_id, with_data: bool = False, with_index: bool = False):
+    """
+    The File row. file_data and the index blobs are deferred; opt in with
+    with_data / with_index when the caller reads them.
+    """
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    stmt = select(File).filter_by(id=file_id)
+    if with_data:
+        stmt = stmt.options(undefer_group('data'))
+    if with_index:
+        stmt = stmt.options(undefer_group('index'))
+    return db.execute(stmt).scalars().first()
+
+
+def file_has_index(db: Session, file_id) -> bool:
+    """Whether the file has a FAISS store, checked without fetching it."""
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    return bool(db.execute(
+        select(File.index_faiss.isnot(None) & File.index_pkl.isnot(None)).filter_by(id=file_id)
+    ).scalar())
+
+
+def get_file_course_id(db: Session, file_id):
+    """The id of the course a file belongs to (None if no such file), in one query."""
     if isinstance(file_id, str):
         file_id = uuid.UUID(file_id)
-    return db.execute(select(File).filter_by(id=file_id)).scalars().first()
+    return db.execute(
+        select(Module.course_id)
+        .join(File, File.module_id == Module.id)
+        .filter(File.id == file_id)
+    ).scalar()
 
 
 def get_files_by_module(db: Session, module_id):
@@ -418,6 +525,21 @@ def get_files_by_module(db: Session, module_id):
     ).scalars().all()
 
 
+def get_modules_with_files(db: Session, course_id):
+    """
+    A course's modules in order, with `module.files` loaded (id, title,
+    ordering only) by one extra IN query rather than one per module.
+    """
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    return db.execute(
+        select(Module)
+        .filter_by(course_id=course_id)
+        .order_by(Module.ordering)
+        .options(selectinload(Module.files).load_only(File.id, File.module_id, File.title, File.ordering))
+    ).scalars().all()
+
+
 def get_files_without_raw_by_module(db: Session, module_id):
     if isinstance(module_id, str):
         module_id = uuid.UUID(module_id)
@@ -460,6 +582,8 @@ def update_file(db: Session, file_id: str, **kwargs):
     ):
         if key in kwargs:
             setattr(f, key, kwargs[key])
+    if 'index_faiss' in kwargs or 'index_pkl' in kwargs:
+        f.index_version = (f.index_version or 0) + 1
     db.commit()
     db.refresh(f)
     return f
@@ -472,9 +596,10 @@ def delete_file(db: Session, file_id: str):
 
 # --- FileChunk CRUD ---
 
-def insert_file_chunks(db, file_id: str, course_id: str, chunks: list[str], vectors) -> int:
+def insert_file_chunks(db, file_id: str, course_id: str, chunks: list[str], vectors, start_index: int = 0) -> int:
     """
-    Inserts chunked text and their embeddings into the FileChunk table.
+    Inserts chunked text and their embeddings into the FileChunk table,
+    numbering them from `start_index`.
     Returns the number of inserted chunks.
     """
     rows = [
@@ -485,13 +610,354 @@ def insert_file_chunks(db, file_id: str, course_id: str, chunks: list[str], vect
             content=chunk,
             embedding=vec
         )
-        for i, (chunk, vec) in enumerate(zip(chunks, vectors))
+        for i, (chunk, vec) in enumerate(zip(chunks, vectors), start=start_index)
     ]
 
     db.bulk_save_objects(rows)
     db.commit()
     return len(rows)
 
+
+# HNSW search knobs: candidate list size (recall vs latency) and pgvector's
+# iterative scan, which keeps walking the graph until `k` rows survive the
+# course_id filter instead of returning fewer results for small courses.
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+HNSW_ITERATIVE_SCAN = os.getenv("HNSW_ITERATIVE_SCAN", "relaxed_order")
+
+_pgvector_version = None
+
+
+def _supports_iterative_scan(db: Session) -> bool:
+    """
+    hnsw.iterative_scan only exists from pgvector 0.8; on older versions
+    setting it is an error (the hnsw. prefix is reserved on PG15+). The
+    extension version is read once per process.
+    """
+    global _pgvector_version
+    if _pgvector_version is None:
+        version = db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+        _pgvector_version = tuple(int(part) for part in re.findall(r"\d+", version or "")[:2])
+    return _pgvector_version >= (0, 8)
+
+
+def search_file_chunks(db: Session, course_id, query_vector, k: int = 5, ef_search: int = None):
+    """
+    Nearest FileChunk rows of one course to `query_vector` (L2 distance).
+    Returns rows of (content, file_id, chunk_index, distance), closest first.
+    """
+    # set_config(..., true) is SET LOCAL: it only lasts for this transaction
+    db.execute(text("SELECT set_config('hnsw.ef_search', :v, true)"),
+               {"v": str(max(ef_search or HNSW_EF_SEARCH, k))})
+    if HNSW_ITERATIVE_SCAN and _supports_iterative_scan(db):
+        db.execute(text("SELECT set_config('hnsw.iterative_scan', :v, true)"), {"v": HNSW_ITERATIVE_SCAN})
+
+    # relaxed_order may return neighbours slightly out of order; re-sort them
+    sql = text("""
+        WITH nearest AS MATERIALIZED (
+            SELECT content, file_id, chunk_index, embedding <-> CAST(:query_vec AS vector) AS distance
+            FROM "FileChunk"
+            WHERE course_id = :cid
+            ORDER BY distance
+            LIMIT :k
+        )
+        SELECT content, file_id, chunk_index, distance FROM nearest ORDER BY distance
+    """)
+    pgvector_str = f"[{','.join(map(str, query_vector))}]"
+    return db.execute(sql, {"cid": str(course_id), "query_vec": pgvector_str, "k": k}).fetchall()
+
+
+def delete_file_chunks(db: Session, file_id) -> int:
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    n = db.query(FileChunk).filter(FileChunk.file_id == file_id).delete(synchronize_session=False)
+    db.commit()
+    return n
+
+# --- IngestionJob queue ---
+
+def create_ingestion_job(db: Session, kind: str, file_id=None, course_id=None, created_by=None):
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    if isinstance(created_by, str):
+        created_by = uuid.UUID(created_by)
+    job = IngestionJob(kind=kind, file_id=file_id, course_id=course_id, created_by=created_by)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def get_ingestion_job_by_id(db: Session, job_id):
+    if isinstance(job_id, str):
+        job_id = uuid.UUID(job_id)
+    return db.execute(select(IngestionJob).filter_by(id=job_id)).scalars().first()
+
+
+def get_queued_ingestion_job(db: Session, kind: str, course_id):
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    return db.execute(
+        select(IngestionJob)
+        .filter_by(kind=kind, course_id=course_id, status='queued')
+        .limit(1)
+    ).scalars().first()
+
+
+def claim_next_ingestion_job(db: Session):
+    """
+    Atomically takes the oldest queued job and marks it running.
+    FOR UPDATE SKIP LOCKED lets any number of workers poll the same table
+    without handing one job to two of them or blocking on each other.
+    """
+    job = db.execute(
+        select(IngestionJob)
+        .filter_by(status='queued')
+        .order_by(asc(IngestionJob.created_at))
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).scalars().first()
+    if not job:
+        db.rollback()
+        return None
+    job.status = 'running'
+    job.attempts += 1
+    job.started_at = job.heartbeat_at = datetime.utcnow()
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def update_ingestion_job(db: Session, job_id, **kwargs):
+    job = get_ingestion_job_by_id(db, job_id)
+    if not job:
+        return None
+    for key in ('status', 'progress', 'message', 'result', 'finished_at'):
+        if key in kwargs:
+            setattr(job, key, kwargs[key])
+    if job.status == 'running':
+        job.heartbeat_at = datetime.utcnow()
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def heartbeat_ingestion_job(db: Session, job_id):
+    """Marks a running job as still alive."""
+    if isinstance(job_id, str):
+        job_id = uuid.UUID(job_id)
+    db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == job_id, IngestionJob.status == 'running')
+        .values(heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def requeue_stale_ingestion_jobs(db: Session, older_than_seconds: int, max_attempts: int):
+    """
+    Handles running jobs whose heartbeat stopped (their worker died): back in
+    the queue, or failed once they have used max_attempts, so a job that kills
+    its worker cannot loop forever. Returns (requeued, failed).
+    """
+    now = datetime.utcnow()
+    stale = (
+        IngestionJob.status == 'running',
+        func.coalesce(IngestionJob.heartbeat_at, IngestionJob.started_at) < now - timedelta(seconds=older_than_seconds)
+    )
+    failed = (
+        db.query(IngestionJob)
+        .filter(*stale, IngestionJob.attempts >= max_attempts)
+        .update({'status': 'failed', 'finished_at': now,
+                 'message': f'Worker stopped responding on all {max_attempts} attempts'},
+                synchronize_session=False)
+    )
+    requeued = (
+        db.query(IngestionJob)
+        .filter(*stale)
+        .update({'status': 'queued', 'message': 'Requeued after worker timeout'},
+                synchronize_session=False)
+    )
+    db.commit()
+    return requeued, failed
+
+# --- FileText ---
+
+def get_file_text(db: Session, file_id):
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    return db.execute(select(FileText).filter_by(file_id=file_id)).scalars().first()
+
+
+def replace_file_text(db: Session, file_id, content_hash: str, extractor_version: str,
+                      pages, batch_size: int = 64) -> int:
+    """
+    Stores a file's extracted text from an iterable of (page, text), inserting
+    `batch_size` pages at a time so the whole text is never held. The
+    FileText row is written last, in the same transaction, so a half-written
+    file never looks stored. Returns the number of pages.
+    """
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    db.execute(delete(FileText).where(FileText.file_id == file_id))
+    db.execute(delete(FileTextPage).where(FileTextPage.file_id == file_id))
+    count, batch = 0, []
+    for page, page_text in pages:
+        batch.append({'file_id': file_id, 'ordinal': count, 'page': page, 'text': page_text})
+        count += 1
+        if len(batch) >= batch_size:
+            db.execute(insert(FileTextPage), batch)
+            batch = []
+    if batch:
+        db.execute(insert(FileTextPage), batch)
+    db.add(FileText(file_id=file_id, content_hash=content_hash, extractor_version=extractor_version))
+    db.commit()
+    return count
+
+
+def get_file_text_pages(db: Session, file_id, after: int, limit: int) -> list:
+    """Up to `limit` (ordinal, page, text) rows of a file after ordinal `after`."""
+    if isinstance(file_id, str):
+        file_id = uuid.UUID(file_id)
+    return db.execute(
+        select(FileTextPage.ordinal, FileTextPage.page, FileTextPage.text)
+        .where(FileTextPage.file_id == file_id, FileTextPage.ordinal > after)
+        .order_by(FileTextPage.ordinal)
+        .limit(limit)
+    ).all()
+
+# --- SemanticAnswer ---
+
+def find_semantic_answer(db: Session, course_id, persona_hash: str, index_version: int,
+                         embedding, max_distance: float, created_after: datetime):
+    """
+    Closest cached answer in the bucket by cosine distance, if within
+    `max_distance`. Returns the SemanticAnswer or None.
+    """
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    distance = SemanticAnswer.embedding.cosine_distance(embedding)
+    row = db.execute(
+        select(SemanticAnswer, distance.label('distance'))
+        .filter(
+            SemanticAnswer.course_id == course_id,
+            SemanticAnswer.persona_hash == persona_hash,
+            SemanticAnswer.index_version == index_version,
+            SemanticAnswer.created_at > created_after
+        )
+        .order_by(distance)
+        .limit(1)
+    ).first()
+    if not row or row.distance > max_distance:
+        return None
+    row.SemanticAnswer.hits += 1
+    db.commit()
+    return row.SemanticAnswer
+
+
+def create_semantic_answer(db: Session, course_id, persona_hash: str, index_version: int,
+                           query: str, embedding, answer: str):
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    sa = SemanticAnswer(
+        course_id=course_id,
+        persona_hash=persona_hash,
+        index_version=index_version,
+        query=query,
+        embedding=embedding,
+        answer=answer
+    )
+    db.add(sa)
+    db.commit()
+    return sa
+
+
+def delete_stale_semantic_answers(db: Session, course_id, index_version: int, created_before: datetime) -> int:
+    """Drops a course's answers from older index versions or past their TTL."""
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    n = db.execute(
+        delete(SemanticAnswer).where(
+            SemanticAnswer.course_id == course_id,
+            (SemanticAnswer.index_version != index_version) | (SemanticAnswer.created_at <= created_before)
+        )
+    ).rowcount
+    db.commit()
+    return n
+
+# --- EmbeddingCache ---
+
+def get_cached_embeddings(db: Session, content_hashes, model: str, dimensions: int) -> dict:
+    """
+    Bulk lookup of cached embeddings.
+    Returns {content_hash: float32 vector bytes} for the hashes that are cached.
+    """
+    content_hashes = list(content_hashes)
+    found = {}
+    for i in range(0, len(content_hashes), 1000):
+        rows = db.execute(
+            select(EmbeddingCache.content_hash, EmbeddingCache.embedding)
+            .filter(
+                EmbeddingCache.content_hash.in_(content_hashes[i : i + 1000]),
+                EmbeddingCache.model == model,
+                EmbeddingCache.dimensions == dimensions
+            )
+        ).all()
+        found.update({h: bytes(e) for h, e in rows})
+    return found
+
+
+def store_cached_embeddings(db: Session, embeddings: dict, model: str, dimensions: int) -> int:
+    """
+    Inserts {content_hash: float32 vector bytes}; rows already cached are skipped.
+    """
+    if not embeddings:
+        return 0
+    rows = [
+        {'content_hash': h, 'model': model, 'dimensions': dimensions, 'embedding': e}
+        for h, e in embeddings.items()
+    ]
+    for i in range(0, len(rows), 1000):
+        db.execute(pg_insert(EmbeddingCache).values(rows[i : i + 1000]).on_conflict_do_nothing())
+    db.commit()
+    return len(rows)
+
+
+# --- ChunkGroupSummary ---
+
+def get_chunk_group_summaries(db: Session, content_hashes, model: str) -> dict:
+    """
+    Bulk lookup of map-step summaries. Returns {content_hash: summary} for the
+    hashes that are cached.
+    """
+    content_hashes = list(content_hashes)
+    found = {}
+    for i in range(0, len(content_hashes), 1000):
+        rows = db.execute(
+            select(ChunkGroupSummary.content_hash, ChunkGroupSummary.summary)
+            .filter(
+                ChunkGroupSummary.content_hash.in_(content_hashes[i : i + 1000]),
+                ChunkGroupSummary.model == model
+            )
+        ).all()
+        found.update(dict(rows))
+    return found
+
+
+def store_chunk_group_summaries(db: Session, summaries: dict, model: str) -> int:
+    """
+    Inserts {content_hash: summary}; groups already cached are skipped.
+    """
+    if not summaries:
+        return 0
+    rows = [{'content_hash': h, 'model': model, 'summary': s} for h, s in summaries.items()]
+    for i in range(0, len(rows), 1000):
+        db.execute(pg_insert(ChunkGroupSummary).values(rows[i : i + 1000]).on_conflict_do_nothing())
+    db.commit()
+    return len(rows)
+
 # --- AccessCode CRUD ---
 
 def get_access_code_by_id(db: Session, code_id):
@@ -677,6 +1143,17 @@ def update_chat(db: Session, chat_id: str, **kwargs):
     return c
 
 
+def update_chat_summary(db: Session, chat_id, summary: str, summarized_until: datetime, summarized_until_id=None):
+    c = get_chat_by_id(db, chat_id)
+    if not c:
+        return None
+    c.summary = summary
+    c.summarized_until = summarized_until
+    c.summarized_until_id = summarized_until_id
+    db.commit()
+    return c
+
+
 def delete_chat(db: Session, chat_id: str):
     c = get_chat_by_id(db, chat_id)
     if c:
@@ -690,14 +1167,23 @@ def get_message_by_id(db: Session, message_id):
     return db.execute(select(Message).filter_by(id=message_id)).scalars().first()
 
 
-def get_messages_by_chat(db: Session, chat_id: str):
+def get_messages_by_chat(db: Session, chat_id: str, after: datetime = None, after_id=None):
+    """
+    A chat's messages in (created_at, id) order, optionally only those after
+    the message (`after`, `after_id`). Messages can share a created_at, so the
+    id breaks ties; with no `after_id` the cut is on created_at alone.
+    """
     if isinstance(chat_id, str):
         chat_id = uuid.UUID(chat_id)
-    return db.execute(
-        select(Message)
-        .filter_by(chat_id=chat_id)
-        .order_by(asc(Message.created_at))
-    ).scalars().all()
+    stmt = select(Message).filter_by(chat_id=chat_id)
+    if after is not None and after_id is not None:
+        stmt = stmt.filter(or_(
+            Message.created_at > after,
+            and_(Message.created_at == after, Message.id > after_id)
+        ))
+    elif after is not None:
+        stmt = stmt.filter(Message.created_at > after)
+    return db.execute(stmt.order_by(asc(Message.created_at), asc(Message.id))).scalars().all()
 
 
 def create_message(db: Session, chat_id: str, role: str, content: str):
@@ -904,4 +1390,29 @@ def get_module_metrics_for_course(db: Session, course_id: str) -> list[dict]:
             'chatCount': chats
         }
         for mid, views, chats in rows
-    ]
\ No newline at end of file
+    ]
+
+
+FILE_COUNTERS = ('view_count_raw', 'view_count_personalized', 'chat_count')
+
+
+def increment_file_counters(db: Session, deltas: dict):
+    """
+    Adds counts to File analytics counters: `deltas` maps file id ->
+    {counter: n}. One executemany of UPDATE ... SET x = x + n, in file id
+    order so concurrent writers lock rows in the same order; files that no
+    longer exist are skipped.
+    """
+    table = File.__table__
+    stmt = (
+        update(table)
+        .where(table.c.id == bindparam('file_id'))
+        .values({c: table.c[c] + bindparam(f'add_{c}') for c in FILE_COUNTERS})
+    )
+    rows = [
+        {'file_id': uuid.UUID(str(fid)), **{f'add_{c}': counts.get(c, 0) for c in FILE_COUNTERS}}
+        for fid, counts in sorted(deltas.items(), key=lambda item: str(item[0]))
+    ]
+    if rows:
+        db.execute(stmt, rows)
+        db.commit()
@@ -10,7 +10,7 @@ from sqlalchemy import (
     Date,
     Text
 )
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, deferred
 from sqlalchemy.dialects.postgresql import UUID, BYTEA, ENUM, JSONB
 from pgvector.sqlalchemy import Vector
 import uuid
@@ -86,8 +86,12 @@ class Course(Base):
     published = Column(Boolean, nullable=False, default=False)
     last_updated = Column(DateTime, nullable=False, default=datetime.utcnow)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    index_pkl = Column(BYTEA)
-    index_faiss = Column(BYTEA)
+    # Blobs are deferred: loaded on first access, or up front with
+    # get_course_by_id(..., with_index=True); list queries never fetch them
+    index_pkl = deferred(Column(BYTEA), group='index')
+    index_faiss = deferred(Column(BYTEA), group='index')
+    index_version = Column(Integer, nullable=False, default=0)
+    index_rebuild_pending = Column(Boolean, nullable=False, default=False)
     instructor_id = Column(UUID(as_uuid=True),
                            ForeignKey('InstructorProfile.user_id', ondelete='SET NULL'),
                            nullable=True)
@@ -124,11 +128,13 @@ class File(Base):
     filename = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
     file_size = Column(Integer, nullable=False)
-    file_data = Column(BYTEA, nullable=False)
+    # Deferred like Course's; see get_file_by_id(..., with_data=, with_index=)
+    file_data = deferred(Column(BYTEA, nullable=False), group='data')
     transcription = Column(Text, nullable=True)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
-    index_pkl   = Column(BYTEA, nullable=True)
-    index_faiss = Column(BYTEA, nullable=True)
+    index_pkl   = deferred(Column(BYTEA, nullable=True), group='index')
+    index_faiss = deferred(Column(BYTEA, nullable=True), group='index')
+    index_version = Column(Integer, nullable=False, default=0)
     ordering = Column(Integer, nullable=False, default=0)
     view_count_raw = Column(Integer, nullable=False, default=0)
     view_count_personalized = Column(Integer, nullable=False, default=0)
@@ -158,6 +164,77 @@ class FileChunk(Base):
     file = relationship('File')
     course = relationship('Course')
 
+class IngestionJob(Base):
+    __tablename__ = 'IngestionJob'
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String(32), nullable=False, default='ingest_file')
+    status = Column(String(16), nullable=False, default='queued')   # queued → running → done | failed
+    file_id = Column(UUID(as_uuid=True),
+                     ForeignKey('File.id', ondelete='CASCADE'),
+                     nullable=True)
+    course_id = Column(UUID(as_uuid=True),
+                       ForeignKey('Course.id', ondelete='CASCADE'),
+                       nullable=True)
+    created_by = Column(UUID(as_uuid=True),
+                        ForeignKey('User.id', ondelete='SET NULL'),
+                        nullable=True)
+    progress = Column(Integer, nullable=False, default=0)
+    message = Column(Text, nullable=True)
+    result = Column(JSONB, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)                   # refreshed by the worker while running
+    finished_at = Column(DateTime, nullable=True)
+
+class FileText(Base):
+    __tablename__ = 'FileText'
+    file_id = Column(UUID(as_uuid=True),
+                     ForeignKey('File.id', ondelete='CASCADE'),
+                     primary_key=True)
+    content_hash = Column(String(64), nullable=False)        # sha256 of the extraction source
+    extractor_version = Column(String(32), nullable=False)
+    text = Column(Text, nullable=True)                       # legacy rows only; the text is in FileTextPage
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class FileTextPage(Base):
+    __tablename__ = 'FileTextPage'
+    file_id = Column(UUID(as_uuid=True),
+                     ForeignKey('File.id', ondelete='CASCADE'),
+                     primary_key=True)
+    ordinal = Column(Integer, primary_key=True)              # order within the file
+    page = Column(Integer, nullable=True)                    # source page/slide number, if any
+    text = Column(Text, nullable=False)                      # cleaned, normalized text
+
+class EmbeddingCache(Base):
+    __tablename__ = 'EmbeddingCache'
+    content_hash = Column(String(64), primary_key=True)   # sha256 of the embedded text
+    model = Column(String(64), primary_key=True)
+    dimensions = Column(Integer, primary_key=True)
+    embedding = Column(BYTEA, nullable=False)             # float32 vector bytes
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ChunkGroupSummary(Base):
+    __tablename__ = 'ChunkGroupSummary'
+    content_hash = Column(String(64), primary_key=True)   # sha256 of map prompt version + group text
+    model = Column(String(64), primary_key=True)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class SemanticAnswer(Base):
+    __tablename__ = 'SemanticAnswer'
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    course_id = Column(UUID(as_uuid=True),
+                       ForeignKey('Course.id', ondelete='CASCADE'),
+                       nullable=False)
+    persona_hash = Column(String(64), nullable=False)
+    index_version = Column(Integer, nullable=False)   # Course.index_version the answer was grounded on
+    query = Column(Text, nullable=False)
+    embedding = Column(Vector(1536), nullable=False)
+    answer = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
 class AccessCode(Base):
     __tablename__ = 'AccessCode'
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -213,6 +290,11 @@ class Chat(Base):
                      nullable=True)
     title = Column(Text, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    # Rolling summary of the turns older than the prompt window, and the
+    # (created_at, id) of the newest message it covers
+    summary = Column(Text, nullable=True)
+    summarized_until = Column(DateTime, nullable=True)
+    summarized_until_id = Column(UUID(as_uuid=True), nullable=True)
 
     student = relationship('StudentProfile', back_populates='chats', foreign_keys=[user_id])
     file = relationship('File', back_populates='chats')
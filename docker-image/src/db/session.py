@@ -0,0 +1,36 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.db.pool_metrics import InstrumentedQueuePool, instrument
+
+load_dotenv()
+
+POSTGRES_URL = os.getenv("POSTGRES_URL")
+if not POSTGRES_URL:
+    raise RuntimeError("POSTGRES_URL not set")
+
+# Pool sizing: size it for gunicorn's threads plus streaming responses that
+# hold a session past their request; DB_POOL_TIMEOUT bounds how long a
+# request waits for a free connection before failing
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+pool_args = {}
+if not POSTGRES_URL.startswith("sqlite"):
+    pool_args = dict(
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+engine = create_engine(
+    POSTGRES_URL,
+    pool_pre_ping=True,   # Validate connection before each checkout
+    pool_recycle=1800,    # Recycle connections every 30 minutes to avoid idle EOF
+    **pool_args
+)
+instrument(engine)
+Session = sessionmaker(bind=engine, expire_on_commit=False)
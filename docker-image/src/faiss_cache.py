@@ -0,0 +1,137 @@
+"""
+Process-wide LRU cache of deserialized FAISS indexes.
+
+Entries are keyed by (kind, row id, index_version). The version is read with
+a cheap column-only query, so a hit never fetches the BYTEA blobs or
+deserializes; misses are decoded in memory, with no temp files. Any writer
+that rewrites Course/File index blobs bumps index_version (see
+update_course_index / update_file), which makes old entries unreachable in
+every process; they age out of the LRU.
+
+FAISS_CACHE_MB bounds the resident size, estimated from the serialized blob
+sizes (close to the in-memory size for flat indexes).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+from sqlalchemy.orm import Session
+
+from FAISS_db_generation import vectorstore_from_bytes, load_metadata_bytes
+from src.db.schema import Course, File
+from src.db.queries import get_index_version, get_course_by_id, get_file_by_id
+
+FAISS_CACHE_MB = int(os.getenv("FAISS_CACHE_MB", "512"))
+
+
+class FaissIndexCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, nbytes)
+        self._lock = threading.Lock()
+        self._resident = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes: int):
+        with self._lock:
+            if key in self._entries:
+                self._resident -= self._entries.pop(key)[1]
+            # Anything bigger than the whole budget is served uncached
+            if nbytes > self.max_bytes:
+                return
+            # Older versions of the same row can never be hit again
+            for stale in [k for k in self._entries if k[:2] == key[:2]]:
+                self._resident -= self._entries.pop(stale)[1]
+            self._entries[key] = (value, nbytes)
+            self._resident += nbytes
+            while self._resident > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._resident -= size
+                self._evictions += 1
+
+    def invalidate(self, kind: str, row_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[:2] == (kind, str(row_id))]:
+                self._resident -= self._entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hitRate': self._hits / total if total else 0.0,
+                'evictions': self._evictions,
+                'entries': len(self._entries),
+                'residentBytes': self._resident,
+                'maxBytes': self.max_bytes,
+            }
+
+
+_cache = FaissIndexCache(FAISS_CACHE_MB * 1024 * 1024)
+
+
+def get_file_vectorstore(db: Session, file_id):
+    """
+    LangChain FAISS store for a file, or None if the file has no index yet.
+    Queries are embedded with the store's own model (see vectorstore_from_bytes).
+    """
+    version = get_index_version(db, File, file_id)
+    if version is None:
+        return None
+    key = ('file', str(file_id), version)
+    vectordb = _cache.get(key)
+    if vectordb is not None:
+        return vectordb
+
+    f = get_file_by_id(db, file_id, with_index=True)
+    if not f or not f.index_faiss or not f.index_pkl:
+        return None
+    vectordb = vectorstore_from_bytes(f.index_faiss, f.index_pkl)
+    _cache.put(key, vectordb, len(f.index_faiss) + len(f.index_pkl))
+    return vectordb
+
+
+def get_course_index(db: Session, course_id):
+    """
+    (faiss index, metadata dict) for a course, or (None, {}) if unbuilt.
+    Callers must not mutate the returned objects.
+    """
+    version = get_index_version(db, Course, course_id)
+    if version is None:
+        return None, {}
+    key = ('course', str(course_id), version)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    course = get_course_by_id(db, course_id, with_index=True)
+    if not course or not course.index_faiss or not course.index_pkl:
+        return None, {}
+    index = faiss.deserialize_index(np.frombuffer(course.index_faiss, dtype=np.uint8))
+    value = (index, load_metadata_bytes(course.index_pkl))
+    _cache.put(key, value, len(course.index_faiss) + len(course.index_pkl))
+    return value
+
+
+def invalidate(kind: str, row_id):
+    """Drops a row's entries now rather than waiting for the LRU ('file' or 'course')."""
+    _cache.invalidate(kind, row_id)
+
+
+def get_faiss_cache_stats() -> dict:
+    return _cache.stats()
@@ -0,0 +1,120 @@
+"""
+Serializes writes to Course.index_faiss / index_pkl.
+
+Every change to a course index (incremental add/remove or full rebuild) is a
+read-modify-write of one BYTEA pair, so concurrent ingestion workers and
+request threads would otherwise overwrite each other's vectors.
+
+- `course_index_lock` takes a per-course Postgres advisory lock (a process-local
+  lock on other databases, e.g. sqlite in tests).
+- `apply_course_index_update` runs a build under that lock against a freshly
+  read Course and writes it only if index_version is still the one it read.
+- `request_course_rebuild` coalesces rebuild requests: it flags the course and
+  enqueues a 'rebuild_course' job only if none is already waiting, so ten
+  requests in a row produce one rebuild.
+"""
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from indexer import rebuild_course_index
+from src.db.queries import (
+    get_course_by_id, update_course_index, set_course_rebuild_pending,
+    create_ingestion_job, get_queued_ingestion_job
+)
+
+logger = logging.getLogger(__name__)
+
+_local_locks = {}
+_local_locks_guard = threading.Lock()
+
+
+def _advisory_key(course_id) -> int:
+    # Fold the UUID into the signed bigint pg_advisory_lock takes
+    return int.from_bytes(course_id.bytes[:8], "big", signed=True)
+
+
+@contextmanager
+def course_index_lock(db: Session, course_id):
+    """
+    Holds the course's index lock for the duration of the block.
+    Uses its own connection so commits on `db` don't release it.
+    """
+    if isinstance(course_id, str):
+        course_id = uuid.UUID(course_id)
+    engine = db.get_bind()
+    if engine.dialect.name != "postgresql":
+        with _local_locks_guard:
+            lock = _local_locks.setdefault(course_id, threading.Lock())
+        with lock:
+            yield
+        return
+
+    key = _advisory_key(course_id)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": key})
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": key})
+            conn.commit()
+
+
+def apply_course_index_update(db: Session, course_id, build) -> bool:
+    """
+    Runs `build(course) -> (index_bytes, pkl_bytes)` under the course lock on
+    the latest stored index and writes the result with a version check.
+    Returns False if a newer index was written meanwhile (the result is dropped).
+    """
+    with course_index_lock(db, course_id):
+        course = get_course_by_id(db, course_id)
+        db.refresh(course)
+        base_version = course.index_version
+        idx_bytes, pkl_bytes = build(course)
+        if update_course_index(db, course.id, base_version, idx_bytes, pkl_bytes):
+            return True
+    logger.warning("Dropped stale index build for course %s (version %s)", course_id, base_version)
+    return False
+
+
+def request_course_rebuild(db: Session, course_id, created_by=None):
+    """
+    Marks the course for a full rebuild and returns the queued job that will
+    run it, reusing one that is already waiting.
+    """
+    course = get_course_by_id(db, course_id)
+    set_course_rebuild_pending(db, course.id, True)
+    job = get_queued_ingestion_job(db, 'rebuild_course', course.id)
+    if job:
+        return job
+    return create_ingestion_job(db, 'rebuild_course', course_id=course.id, created_by=created_by)
+
+
+def run_course_rebuild(db: Session, course_id) -> dict:
+    """
+    Worker side of `request_course_rebuild`. A job whose request was already
+    covered by an earlier rebuild is a no-op.
+    """
+    with course_index_lock(db, course_id):
+        course = get_course_by_id(db, course_id)
+        db.refresh(course)
+        if not course.index_rebuild_pending:
+            return {'skipped': True, 'indexVersion': course.index_version}
+        # Cleared before reading files: a request arriving mid-build sets it
+        # again and queues a fresh job, so no upload is missed.
+        set_course_rebuild_pending(db, course.id, False)
+        base_version = course.index_version
+        try:
+            idx_bytes, pkl_bytes = rebuild_course_index(db, course.id)
+        except Exception:
+            # e.g. a file hit the extraction limits: keep the request so the
+            # job's retry rebuilds instead of skipping
+            db.rollback()
+            set_course_rebuild_pending(db, course.id, True)
+            raise
+        written = update_course_index(db, course.id, base_version, idx_bytes, pkl_bytes)
+        return {'skipped': not written, 'indexVersion': base_version + 1 if written else base_version}
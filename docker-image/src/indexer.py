@@ -1,10 +1,198 @@
+import os
 import pickle
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
 import faiss
 import numpy as np
 from sqlalchemy.orm import Session
 
-from textUtils import extract_text, clean_extracted_text, split_text, embed_text, openai_embed_text
-from src.db.queries import get_file_by_id, get_modules_by_course, get_files_by_module, insert_file_chunks
+from src.textUtils import (
+    iter_clean_pages, iter_chunks, extraction_timeout, limit_worker_memory,
+    embed_texts_cached, openai_embed_text, content_hash,
+    EMBEDDING_MODEL, EMBED_BATCH_SIZE, EXTRACTOR_VERSION
+)
+from src.db.session import Session as _Session
+from src.db.queries import (
+    get_file_by_id, get_modules_by_course, get_files_by_module, insert_file_chunks,
+    get_file_text, replace_file_text, get_file_text_pages
+)
+from FAISS_db_generation import load_metadata_bytes
+
+logger = logging.getLogger(__name__)
+
+# Extraction pool: processes, per-file timeout, per-process address-space cap
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", str(os.cpu_count() or 2)))
+EXTRACT_TIMEOUT_SECONDS = int(os.getenv("EXTRACT_TIMEOUT_SECONDS", "300"))
+EXTRACT_MEMORY_MB = int(os.getenv("EXTRACT_MEMORY_MB", "2048"))
+
+# FileTextPage rows written / read per statement
+TEXT_PAGE_BATCH = int(os.getenv("TEXT_PAGE_BATCH", "64"))
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+def _source_hash(f) -> str:
+    if f.transcription is not None:
+        return content_hash(f.transcription)
+    return hashlib.sha256(f.file_data).hexdigest()
+
+def _text_is_stored(db: Session, f, source_hash: str) -> bool:
+    """Whether FileText holds this file's current source, extracted by the current extractor."""
+    stored = get_file_text(db, f.id)
+    return bool(stored and stored.content_hash == source_hash and stored.extractor_version == EXTRACTOR_VERSION)
+
+def _store_text(db: Session, file_id, source_hash: str, file_data: bytes, filename: str, transcription) -> int:
+    pages = iter_clean_pages(file_data, filename, transcription)
+    return replace_file_text(db, file_id, source_hash, EXTRACTOR_VERSION, pages, batch_size=TEXT_PAGE_BATCH)
+
+def extract_file_text(file_id, file_data: bytes, filename: str, transcription, source_hash: str,
+                      timeout: int = None) -> int:
+    """
+    Extraction pool entry point: streams the file's cleaned pages into
+    FileTextPage through its own session, so only the page count is sent
+    back to the parent. Returns that count.
+    """
+    db = _Session()
+    try:
+        with extraction_timeout(timeout):
+            return _store_text(db, file_id, source_hash, file_data, filename, transcription)
+    finally:
+        db.close()
+
+def iter_file_pages(db: Session, file_id):
+    """A file's stored (page, text) pairs, read TEXT_PAGE_BATCH rows per query."""
+    stored = get_file_text(db, file_id)
+    if stored is not None and stored.text is not None:
+        # written before text was stored per page
+        yield None, stored.text
+        return
+    after = -1
+    while True:
+        rows = get_file_text_pages(db, file_id, after, TEXT_PAGE_BATCH)
+        for _, page, text in rows:
+            yield page, text
+        if len(rows) < TEXT_PAGE_BATCH:
+            return
+        after = rows[-1][0]
+
+def iter_file_chunks(db: Session, f):
+    """
+    The one extract → clean → split path shared by every index. Audio/video
+    uploads are indexed through their transcription. A file is only parsed
+    once: its cleaned pages are stored in FileTextPage, keyed by the source
+    hash and EXTRACTOR_VERSION, and chunks are split from them on the fly.
+    Returns an iterator of {'text', 'page'} chunk dicts, so only about one
+    page batch and one chunk window are held at a time.
+    """
+    source_hash = _source_hash(f)
+    if not _text_is_stored(db, f, source_hash):
+        _store_text(db, f.id, source_hash, f.file_data, f.filename, f.transcription)
+    return iter_chunks(iter_file_pages(db, f.id))
+
+def iter_chunk_batches(chunks, size: int = EMBED_BATCH_SIZE):
+    """Yields (index of the first chunk, list of up to `size` chunks)."""
+    start, batch = 0, []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield start, batch
+            start += len(batch)
+            batch = []
+    if batch:
+        yield start, batch
+
+def _extraction_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # spawn: forking a threaded gunicorn worker is not safe
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_MAX_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=limit_worker_memory,
+                initargs=(EXTRACT_MEMORY_MB,)
+            )
+        return _extract_pool
+
+def _reset_extraction_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+def iter_chunked_files(db: Session, files):
+    """
+    Yields (file, chunk iterator) for each file, extracting FileText misses
+    in the process pool (workers write the pages themselves). Stored files
+    come first, the rest in completion order, so callers can start embedding
+    before the slowest file is parsed. A file that times out or exceeds the
+    memory cap raises RuntimeError naming the file, so the job running the
+    rebuild fails (and is retried) with that reason instead of finishing
+    with the file silently left out; other extraction errors propagate.
+    """
+    pending = {}
+    for f in files:
+        source_hash = _source_hash(f)
+        if _text_is_stored(db, f, source_hash):
+            yield f, iter_chunks(iter_file_pages(db, f.id))
+        else:
+            fut = _extraction_pool().submit(
+                extract_file_text, f.id, f.file_data, f.filename, f.transcription, source_hash,
+                EXTRACT_TIMEOUT_SECONDS
+            )
+            pending[fut] = f
+
+    for fut in as_completed(pending):
+        f = pending[fut]
+        try:
+            fut.result()
+        except (TimeoutError, MemoryError) as e:
+            logger.error("Extraction of %s hit its limit: %r", f.filename, e)
+            raise RuntimeError(f"Text extraction of {f.filename} hit its limit: {e!r}") from e
+        except BrokenProcessPool:
+            # a worker died outright; start a fresh pool for the next caller
+            _reset_extraction_pool()
+            raise
+        yield f, iter_chunks(iter_file_pages(db, f.id))
+
+def _embed(texts):
+    return embed_texts_cached(texts, model=EMBEDDING_MODEL)
+
+def _new_course_index(dim: int):
+    # IDs are the metadata keys, so single files can be added/removed later
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+def _serialize_course_index(index, metadata: dict):
+    if index is None:
+        index = faiss.IndexFlatL2(1)
+    return faiss.serialize_index(index).tobytes(), pickle.dumps(metadata)
+
+def _load_course_index(course):
+    """
+    Deserializes a course's stored index for incremental updates.
+    Returns (index, metadata), with index=None when nothing has been indexed
+    yet. Raises ValueError for legacy (non ID-mapped) indexes, which need a
+    full rebuild before they can be patched.
+    """
+    if not course.index_faiss or not course.index_pkl:
+        return None, {}
+    index = faiss.deserialize_index(np.frombuffer(course.index_faiss, dtype=np.uint8))
+    metadata = load_metadata_bytes(course.index_pkl)
+    if index.ntotal == 0:
+        return None, {}
+    if not isinstance(index, faiss.IndexIDMap2):
+        raise ValueError("course index is not ID-mapped")
+    if not isinstance(metadata, dict) or not metadata:
+        raise ValueError("course index has vectors but no metadata")
+    if next(iter(metadata.values())).get('model') != EMBEDDING_MODEL:
+        raise ValueError("course index was built with a different embedding model")
+    return index, metadata
 
 def rebuild_course_index(db: Session, course_id: str):
     """
@@ -12,87 +200,140 @@ def rebuild_course_index(db: Session, course_id: str):
     based on all files in all modules of that course.
     Returns: (index_bytes, pkl_bytes)
     """
-    texts = []
     metadata = {}
+    files = [f for mod in get_modules_by_course(db, course_id) for f in get_files_by_module(db, mod.id)]
+
+    index = None
+    texts = []
+
+    def flush():
+        # 3) Add to the FAISS index, keyed by the metadata ids
+        nonlocal index
+        arr = _embed(texts)
+        if index is None:
+            index = _new_course_index(arr.shape[1])
+        start = len(metadata) - len(texts)
+        index.add_with_ids(arr, np.arange(start, start + len(texts), dtype='int64'))
+        texts.clear()
+
+    # 1) Extract & chunk in the process pool; 2) embed as files land, a batch at a time
+    for f, chunks in iter_chunked_files(db, files):
+        for i, chunk in enumerate(chunks):
+            metadata[len(metadata)] = {
+                'file_id': str(f.id),
+                'chunk_index': i,
+                'filename': f.filename,
+                'page': chunk['page'],
+                'model': EMBEDDING_MODEL
+            }
+            texts.append(chunk['text'])
+            if len(texts) >= EMBED_BATCH_SIZE:
+                flush()
+    if texts:
+        flush()
+
+    # 4) Serialize index + pickle metadata dict
+    return _serialize_course_index(index, metadata)
+
+def add_file_to_course_index(db: Session, course, file_id: str):
+    """
+    Appends one file's vectors to the course index instead of re-embedding the
+    whole course. Any vectors already stored for the file are replaced.
+    Chunks are embedded EMBED_BATCH_SIZE at a time through the embedding
+    cache, so a caller that just embedded the file pays no API calls.
+    Falls back to a full rebuild for legacy indexes.
+    Returns: (index_bytes, pkl_bytes)
+    """
+    try:
+        index, metadata = _load_course_index(course)
+    except ValueError:
+        return rebuild_course_index(db, course.id)
+
+    f = get_file_by_id(db, file_id)
+    if index is not None:
+        _remove_file_vectors(index, metadata, str(f.id))
+
+    next_id = max(metadata) + 1 if metadata else 0
+    for start, batch in iter_chunk_batches(iter_file_chunks(db, f)):
+        arr = _embed([c['text'] for c in batch])
+        if index is not None and index.d != arr.shape[1]:
+            # embedding model changed under us: the old vectors are unusable
+            return rebuild_course_index(db, course.id)
+        if index is None:
+            index = _new_course_index(arr.shape[1])
+
+        ids = np.arange(next_id, next_id + len(batch), dtype='int64')
+        index.add_with_ids(arr, ids)
+        for i, vid in enumerate(ids.tolist()):
+            metadata[vid] = {
+                'file_id': str(f.id),
+                'chunk_index': start + i,
+                'filename': f.filename,
+                'page': batch[i]['page'],
+                'model': EMBEDDING_MODEL
+            }
+        next_id += len(batch)
 
-    # 1) Iterate modules → files → extract & chunk
-    modules = get_modules_by_course(db, course_id)
-    for mod in modules:
-        files = get_files_by_module(db, mod.id)
-        for f in files:
-            raw = extract_text(f.file_data, f.filename)
-            chunks = split_text(raw)
-            for i, chunk in enumerate(chunks):
-                idx = len(texts)
-                texts.append(chunk)
-                metadata[idx] = {
-                    'file_id': str(f.id),
-                    'chunk_index': i,
-                    'filename': f.filename
-                }
-
-    if not texts:
-        # no content: return empty index + metadata
-        empty_index = faiss.IndexFlatL2(1)
-        return faiss.serialize_index(empty_index), pickle.dumps(metadata)
-
-    # 2) Embed all chunks
-    embeddings = [embed_text(t) for t in texts]
-    arr = np.vstack(embeddings).astype('float32')
-    dim = arr.shape[1]
-
-    # 3) Build FAISS index
-    index = faiss.IndexFlatL2(dim)
-    index.add(arr)
-    index_bytes = faiss.serialize_index(index)
-
-    # 4) Pickle metadata dict
-    pkl_bytes = pickle.dumps(metadata)
-
-    return index_bytes, pkl_bytes
+    return _serialize_course_index(index, metadata)
+
+def remove_file_from_course_index(db: Session, course, file_id: str):
+    """
+    Drops a (possibly already deleted) file's vectors from the course index by
+    ID. Falls back to a full rebuild for legacy indexes.
+    Returns: (index_bytes, pkl_bytes)
+    """
+    try:
+        index, metadata = _load_course_index(course)
+    except ValueError:
+        return rebuild_course_index(db, course.id)
+
+    if index is not None:
+        _remove_file_vectors(index, metadata, str(file_id))
+    return _serialize_course_index(index, metadata)
+
+def _remove_file_vectors(index, metadata: dict, file_id: str) -> int:
+    ids = [vid for vid, md in metadata.items() if md.get('file_id') == file_id]
+    if ids:
+        index.remove_ids(np.asarray(ids, dtype='int64'))
+        for vid in ids:
+            del metadata[vid]
+    return len(ids)
 
 def rebuild_file_index(db: Session, file_id: str):
-    
+
     f = get_file_by_id(db, file_id)
-    raw = extract_text(f.file_data, f.filename)
-    chunks = split_text(raw)
-
-    texts, metadata = [], {}
-    for i, chunk in enumerate(chunks):
-        idx = len(texts)
-        texts.append(chunk)
-        metadata[idx] = {
-            'file_id':     str(f.id),
-            'chunk_index': i,
-            'filename':    f.filename
-        }
-
-    if not texts:
+
+    index, metadata = None, {}
+    for start, batch in iter_chunk_batches(iter_file_chunks(db, f)):
+        arr = _embed([c['text'] for c in batch])
+        if index is None:
+            index = faiss.IndexFlatL2(arr.shape[1])
+        index.add(arr)
+        for i, chunk in enumerate(batch):
+            metadata[start + i] = {
+                'file_id':     str(f.id),
+                'chunk_index': start + i,
+                'filename':    f.filename,
+                'page':        chunk['page']
+            }
+
+    if index is None:
         empty = faiss.IndexFlatL2(1)
         return faiss.serialize_index(empty), pickle.dumps(metadata)
-
-    emb = [embed_text(t) for t in texts]
-    arr = np.vstack(emb).astype('float32')
-    dim = arr.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(arr)
     return faiss.serialize_index(index), pickle.dumps(metadata)
 
 def store_file_embeddings(db: Session, file_id: str) -> int:
     """
-    Extracts, splits, embeds, and persists all chunks for one file.
+    Extracts, splits, embeds, and persists all chunks for one file, a batch
+    of EMBED_BATCH_SIZE chunks at a time.
     Returns the number of chunks stored.
     """
     f = get_file_by_id(db, file_id)
-    raw_text = extract_text(f.file_data, f.filename)
-    clean_text = clean_extracted_text(raw_text)
-    chunks = split_text(clean_text)
-
-    if not chunks:
-        return 0
-
-    vectors = openai_embed_text(chunks)
-
     course_id = f.module.course_id
 
-    return insert_file_chunks(db, file_id, course_id, chunks, vectors)
\ No newline at end of file
+    stored = 0
+    for start, batch in iter_chunk_batches(iter_file_chunks(db, f)):
+        texts = [c['text'] for c in batch]
+        vectors = openai_embed_text(texts)
+        stored += insert_file_chunks(db, file_id, course_id, texts, vectors, start_index=start)
+    return stored
@@ -0,0 +1,103 @@
+"""
+Single-pass ingestion for uploaded files.
+
+A file is extracted once and its chunks are embedded EMBED_BATCH_SIZE at a
+time; each batch of chunks and vectors then feeds the stores:
+  1) File.index_faiss / index_pkl   – LangChain FAISS store used by the prompts
+  2) Course.index_faiss / index_pkl – ID-mapped course index (appended in place)
+  3) "FileChunk" rows               – pgvector search for /ai-chat and /search
+"""
+import io
+import logging
+
+from sqlalchemy.orm import Session
+from werkzeug.datastructures import FileStorage
+
+from transcriber import transcribe_audio
+from indexer import iter_file_chunks, iter_chunk_batches, add_file_to_course_index
+from index_coordinator import apply_course_index_update
+from src.textUtils import embed_texts_cached, EMBEDDING_MODEL
+from src.db.queries import (
+    get_file_by_id, get_course_by_id, update_file,
+    insert_file_chunks, delete_file_chunks
+)
+from FAISS_db_generation import VectorstoreBuilder, obtain_reference_using_gpt
+
+logger = logging.getLogger(__name__)
+
+# Leading chunks sampled to generate a source's APA citation
+CITATION_SAMPLE_CHUNKS = 3
+
+
+def is_media_upload(mimetype: str) -> bool:
+    mimetype = mimetype or ""
+    return mimetype.startswith("audio/") or mimetype in ["application/octet-stream", "video/mp4"]
+
+
+def _no_progress(percent: int, message: str):
+    pass
+
+
+def ingest_file(db: Session, file_id: str, progress=_no_progress) -> int:
+    """
+    Indexes one File into every store. Safe to re-run: existing vectors and
+    chunk rows for the file are replaced.
+    `progress(percent, message)` is called as each stage starts.
+    Returns the number of chunks indexed.
+    """
+    f = get_file_by_id(db, file_id)
+    if not f:
+        raise ValueError(f"File {file_id} not found")
+    course = get_course_by_id(db, f.module.course_id)
+
+    # 0) Audio/video is indexed through its Whisper transcription
+    if f.transcription is None and is_media_upload(f.file_type):
+        progress(5, "Transcribing")
+        transcription = transcribe_audio(FileStorage(stream=io.BytesIO(f.file_data), filename=f.filename))
+        f = update_file(db, f.id, transcription=transcription)
+
+    # 1) Extract once (stored per page), then split lazily
+    progress(10, "Extracting text")
+    chunks = iter_file_chunks(db, f)
+
+    # 2) Embed a batch at a time, feeding the file store and the pgvector rows
+    #    as each batch lands; the citation comes from the first batch
+    progress(30, "Embedding chunks")
+    delete_file_chunks(db, f.id)
+    builder = VectorstoreBuilder()
+    citation = None
+    count = 0
+    for start, batch in iter_chunk_batches(chunks):
+        texts = [c['text'] for c in batch]
+        vectors = embed_texts_cached(texts, model=EMBEDDING_MODEL)
+        if citation is None:
+            citation = obtain_reference_using_gpt(" ".join(texts[:CITATION_SAMPLE_CHUNKS]))
+        builder.add(texts, vectors, [
+            {'source': f.filename, 'file_id': str(f.id), 'chunk_index': start + i, 'page': c['page'],
+             'citation': citation}
+            for i, c in enumerate(batch)
+        ])
+        insert_file_chunks(db, f.id, course.id, texts, vectors, start_index=start)
+        count += len(batch)
+    if not count:
+        logger.warning("No text extracted from file %s (%s)", f.id, f.filename)
+        return 0
+
+    # 3) File-level FAISS store; every chunk carries the file's APA citation
+    progress(60, "Building file index")
+    file_idx, file_pkl = builder.to_bytes()
+    update_file(db, f.id, index_faiss=file_idx, index_pkl=file_pkl)
+
+    # 4) Course-level index: append this file's vectors only. This bumps
+    #    Course.index_version, so it runs after the FileChunk rows are written:
+    #    a semantic-cache answer stored under the new version must not have
+    #    been retrieved from the old chunks. It re-embeds through the embedding
+    #    cache, so the batches above are cache hits
+    progress(90, "Updating course index")
+    apply_course_index_update(
+        db, course.id,
+        lambda latest: add_file_to_course_index(db, latest, f.id)
+    )
+
+    logger.info("Ingested file %s: %d chunks", f.id, count)
+    return count
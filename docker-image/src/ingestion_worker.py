@@ -0,0 +1,156 @@
+"""
+Ingestion worker pool.
+
+Uploads only persist the File row and enqueue an IngestionJob; this process
+pool does the slow part (transcription, extraction, citation, embedding,
+index updates) outside the gunicorn request threads.
+
+Run from the app root (PYTHONPATH must include the app and src/ dirs):
+    python src/ingestion_worker.py
+Settings: INGESTION_WORKERS (processes, default 2), INGESTION_POLL_SECONDS
+(idle poll interval, default 2), INGESTION_HEARTBEAT_SECONDS (how often a
+running job is marked alive, default 30), INGESTION_STALE_SECONDS (requeue
+running jobs with no heartbeat for this long, default 300),
+INGESTION_MAX_ATTEMPTS (default 3; a stale job that has used them all is
+marked failed instead of requeued).
+"""
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import traceback
+import multiprocessing
+from contextlib import contextmanager
+from datetime import datetime
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ingestion_worker")
+
+WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+POLL_SECONDS = float(os.getenv("INGESTION_POLL_SECONDS", "2"))
+HEARTBEAT_SECONDS = float(os.getenv("INGESTION_HEARTBEAT_SECONDS", "30"))
+STALE_SECONDS = int(os.getenv("INGESTION_STALE_SECONDS", "300"))
+MAX_ATTEMPTS = int(os.getenv("INGESTION_MAX_ATTEMPTS", "3"))
+
+
+def run_job(db, job):
+    from ingestion import ingest_file
+    from index_coordinator import run_course_rebuild
+    from src.db.queries import update_ingestion_job
+
+    def progress(percent, message):
+        update_ingestion_job(db, job.id, progress=percent, message=message)
+
+    if job.kind == 'ingest_file':
+        return {'chunks': ingest_file(db, job.file_id, progress=progress)}
+    if job.kind == 'rebuild_course':
+        progress(10, "Rebuilding course index")
+        return run_course_rebuild(db, job.course_id)
+    raise ValueError(f"Unknown job kind: {job.kind}")
+
+
+@contextmanager
+def heartbeat(job_id):
+    """
+    Marks the job alive every HEARTBEAT_SECONDS while the block runs, from a
+    thread with its own session, so long stages that report no progress are
+    not mistaken for a dead worker. It stops with the process.
+    """
+    from src.db.session import Session
+    from src.db.queries import heartbeat_ingestion_job
+
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(HEARTBEAT_SECONDS):
+            db = Session()
+            try:
+                heartbeat_ingestion_job(db, job_id)
+            except Exception as e:
+                logger.warning("Heartbeat for job %s failed: %s", job_id, e)
+            finally:
+                db.close()
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        done.set()
+        thread.join()
+
+
+def work_forever(stop):
+    # Imported here so every (spawned) process builds its own engine and pool
+    from src.db.session import Session
+    from src.db.queries import claim_next_ingestion_job, update_ingestion_job, requeue_stale_ingestion_jobs
+
+    last_requeue = 0.0
+    while not stop.is_set():
+        db = Session()
+        try:
+            if time.monotonic() - last_requeue > 60:
+                requeued, failed = requeue_stale_ingestion_jobs(db, STALE_SECONDS, MAX_ATTEMPTS)
+                if requeued or failed:
+                    logger.warning("Stale jobs: %d requeued, %d failed", requeued, failed)
+                last_requeue = time.monotonic()
+
+            job = claim_next_ingestion_job(db)
+            if not job:
+                db.close()
+                stop.wait(POLL_SECONDS)
+                continue
+
+            logger.info("Running %s job %s (attempt %d)", job.kind, job.id, job.attempts)
+            try:
+                with heartbeat(job.id):
+                    result = run_job(db, job)
+            except Exception as e:
+                db.rollback()
+                traceback.print_exc()
+                retry = job.attempts < MAX_ATTEMPTS
+                update_ingestion_job(
+                    db, job.id,
+                    status='queued' if retry else 'failed',
+                    message=str(e),
+                    finished_at=None if retry else datetime.utcnow()
+                )
+                logger.error("Job %s failed: %s%s", job.id, e, " (will retry)" if retry else "")
+            else:
+                update_ingestion_job(db, job.id, status='done', progress=100, message='Done',
+                                     result=result, finished_at=datetime.utcnow())
+                logger.info("Job %s done: %s", job.id, result)
+        except Exception:
+            # DB outage etc.: back off rather than spinning
+            traceback.print_exc()
+            db.rollback()
+            stop.wait(POLL_SECONDS)
+        finally:
+            db.close()
+
+
+def main():
+    ctx = multiprocessing.get_context("spawn")
+    stop = ctx.Event()
+
+    def shutdown(signum, frame):
+        logger.info("Signal %s received, finishing in-flight jobs", signum)
+        stop.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    procs = [ctx.Process(target=work_forever, args=(stop,), name=f"ingest-{i}") for i in range(WORKERS)]
+    for p in procs:
+        p.start()
+    logger.info("Started %d ingestion workers", len(procs))
+    for p in procs:
+        p.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,13 @@
 import os
 
 from flask import json
-from openai import OpenAI
 from dotenv import load_dotenv, find_dotenv
 from FAISS_retriever import answer_to_QA, answer_to_QA_all_chunks
+from src.clients import get_openai_client
+from context_packer import pack_chunks, fit_text, context_budget
 
 load_dotenv(find_dotenv())
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 def prompt1_create_course(user_query):
     system_query = (
     """
@@ -27,7 +26,7 @@ def prompt1_create_course(user_query):
     """
     )
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": system_query},
@@ -111,7 +110,7 @@ def prompt2_generate_course_outline(topic, expertise):
 
     user_query = f"The topic is: {topic}. My expertise level is: {expertise}"
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": system_query},
@@ -224,7 +223,7 @@ def prompt_generate_personalized_file_content(working_dir, persona):
     """
     )
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": personalization_query},
@@ -252,7 +251,7 @@ def prompt3_generate_module_content_RAG(persona, expertise_summary, topic, worki
     """
     )
 
-    rag_response = answer_to_QA(rag_query, working_dir)
+    rag_response = fit_text(answer_to_QA(rag_query, working_dir), model="gpt-4o")
 
     # After retrieval, personalize the content to the user.
     personalization_query = (
@@ -287,7 +286,7 @@ def prompt3_generate_module_content_RAG(persona, expertise_summary, topic, worki
     """
     )
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": personalization_query},
@@ -321,7 +320,7 @@ def prompt3_generate_module_content(persona, expertise_summary, topic):
     """
     )
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": system_query},
@@ -334,6 +333,7 @@ def prompt3_generate_module_content(persona, expertise_summary, topic):
 
 def prompt4_valid_query(user_query, course_outline):
     # Take a query given by a user and verify it is related to the course content
+    course_outline = fit_text(str(course_outline), model="gpt-4o", budget=context_budget("gpt-4o", 'list'))
     system_query = (
     f"""
     You are an AI determining the relevance of a user query.
@@ -356,7 +356,7 @@ def prompt4_valid_query(user_query, course_outline):
     """
     )
 
-    response = client.chat.completions.create(
+    response = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": system_query},
@@ -378,6 +378,8 @@ def prompt_course_faqs(course_title: str, questions: list[str]) -> dict:
     if not questions:
         return {"faqs": []}
 
+    # Repeats are kept (they are what gets counted), only the total is capped
+    questions = pack_chunks(questions, model="gpt-4o", budget=context_budget("gpt-4o", 'list'), dedupe=False)
     max_n = min(10, len(questions))
     bullet_list = "\n".join(f"- {q}" for q in questions)
 
@@ -411,7 +413,7 @@ Questions:
 """
     )
 
-    resp = client.chat.completions.create(
+    resp = get_openai_client().chat.completions.create(
         model="gpt-4o",
         messages=[
             {"role": "system", "content": system_query},
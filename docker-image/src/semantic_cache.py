@@ -0,0 +1,116 @@
+"""
+Opt-in semantic answer cache for /ai-chat.
+
+A first-turn question is answered from a previous reply when one exists for
+the same course and persona bucket whose query embedding is within
+SEMANTIC_CACHE_THRESHOLD cosine similarity, skipping retrieval and the LLM.
+
+- Answers are tied to Course.index_version, so any change to the course's
+  material (upload, delete, rebuild) stops old answers from matching; they
+  are purged lazily on the next store for that course.
+- SEMANTIC_CACHE_TTL_SECONDS bounds how long an answer is reused.
+- The persona bucket is a few coarse, normalized profile fields (depth and
+  learning style), so students who answered onboarding alike share answers.
+  First-turn replies that may be cached are personalized with those fields
+  only (see ai_chat), never with a name or free-text interests.
+
+Enable with SEMANTIC_CACHE_ENABLED=1.
+"""
+import os
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from src.db.schema import Course
+from src.db.queries import (
+    get_index_version, find_semantic_answer, create_semantic_answer, delete_stale_semantic_answers
+)
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "0").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'errors': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+# Onboarding fields a cached reply may be personalized with
+BUCKET_FIELDS = ('depth', 'learningStyle')
+DEPTHS = ('beginner', 'intermediate', 'advanced')
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value or '').lower().split())
+
+
+def bucket_answers(onboard_answers: dict) -> dict:
+    """
+    The BUCKET_FIELDS of a profile, normalized. Depth outside DEPTHS counts as
+    beginner, as the chat prompt already treats it.
+    """
+    answers = onboard_answers or {}
+    depth = _normalize(answers.get('depth'))
+    return {
+        'depth': depth if depth in DEPTHS else 'beginner',
+        'learningStyle': _normalize(answers.get('learningStyle')),
+    }
+
+
+def persona_bucket(onboard_answers: dict) -> str:
+    fields = bucket_answers(onboard_answers)
+    return hashlib.sha256("|".join(fields[k] for k in BUCKET_FIELDS).encode('utf-8')).hexdigest()
+
+
+def lookup(db: Session, course_id, persona_hash: str, embedding):
+    """Cached answer text for a near-identical question, or None."""
+    try:
+        version = get_index_version(db, Course, course_id)
+        hit = find_semantic_answer(
+            db, course_id, persona_hash, version, list(map(float, embedding)),
+            max_distance=1.0 - SEMANTIC_CACHE_THRESHOLD,
+            created_after=datetime.utcnow() - timedelta(seconds=SEMANTIC_CACHE_TTL_SECONDS)
+        )
+    except Exception as e:
+        # The cache must never fail the chat itself
+        db.rollback()
+        logger.warning("Semantic cache lookup failed: %s", e)
+        _count('errors')
+        return None
+    _count('hits' if hit else 'misses')
+    return hit.answer if hit else None
+
+
+def store(db: Session, course_id, persona_hash: str, query: str, embedding, answer: str):
+    try:
+        version = get_index_version(db, Course, course_id)
+        delete_stale_semantic_answers(
+            db, course_id, version,
+            created_before=datetime.utcnow() - timedelta(seconds=SEMANTIC_CACHE_TTL_SECONDS)
+        )
+        create_semantic_answer(db, course_id, persona_hash, version, query,
+                               list(map(float, embedding)), answer)
+    except Exception as e:
+        db.rollback()
+        logger.warning("Semantic cache store failed: %s", e)
+        _count('errors')
+        return
+    _count('stores')
+
+
+def get_semantic_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hitRate'] = stats['hits'] / lookups if lookups else None
+    stats['enabled'] = SEMANTIC_CACHE_ENABLED
+    return stats
@@ -1,30 +1,131 @@
 import io
-from typing import Sequence, List
+import hashlib
+import logging
+import random
+import signal
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, Sequence, List, Optional, Tuple
 
 import tiktoken
 from PyPDF2 import PdfReader
-import textract
-from openai import OpenAI
+import docx
+import pptx
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from langchain_core.embeddings import Embeddings
+from src.clients import get_openai_client
 import numpy as np
 import os
 import re
 
-_embed_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+logger = logging.getLogger(__name__)
 
-def extract_text(file_data: bytes, filename: str) -> str:
+# Bulk embedding knobs: inputs per request, parallel requests, retries per batch
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "512"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+# Single embedding model for FileChunk rows and the file/course FAISS indexes
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Native output size per model, used when no explicit `dimensions` is requested
+MODEL_DIMENSIONS = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+
+# Bump whenever extract_text/clean_extracted_text output changes, so stored
+# FileText rows are re-extracted instead of served stale
+EXTRACTOR_VERSION = "3"
+
+# Default split_text / iter_chunks window
+CHUNK_MAX_TOKENS = 300
+CHUNK_OVERLAP = 50
+
+_cache_stats = {'hits': 0, 'misses': 0}
+_cache_stats_lock = threading.Lock()
+
+# In-process tier of the query embedding cache (entries, LRU order)
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+_query_lru = OrderedDict()
+_query_inflight = {}
+_query_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+_query_lock = threading.Lock()
+
+def _pdf_pages(file_data: bytes):
+    reader = PdfReader(io.BytesIO(file_data))
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text()
+
+def _docx_pages(file_data: bytes):
+    doc = docx.Document(io.BytesIO(file_data))
+    parts = [p.text for p in doc.paragraphs]
+    for table in doc.tables:
+        for row in table.rows:
+            parts.append(" | ".join(cell.text for cell in row.cells))
+    yield None, "\n".join(parts)
+
+def _shape_text(shape):
+    if shape.has_text_frame:
+        yield shape.text_frame.text
+    if getattr(shape, "has_table", False) and shape.has_table:
+        for row in shape.table.rows:
+            yield " | ".join(cell.text for cell in row.cells)
+    if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+        for child in shape.shapes:
+            yield from _shape_text(child)
+
+def _pptx_pages(file_data: bytes):
+    # Slides stand in for pages; speaker notes follow the slide text
+    prs = pptx.Presentation(io.BytesIO(file_data))
+    for number, slide in enumerate(prs.slides, start=1):
+        parts = [txt for shape in slide.shapes for txt in _shape_text(shape)]
+        if slide.has_notes_slide:
+            parts.append(slide.notes_slide.notes_text_frame.text)
+        yield number, "\n".join(parts)
+
+def _textract_pages(ext: str):
+    # Legacy binary Office formats still need textract's external converters
+    def pages(file_data: bytes):
+        import textract
+        yield None, textract.process(io.BytesIO(file_data), extension=ext).decode('utf-8', errors='ignore')
+    return pages
+
+# Extension → page generator. OOXML is parsed in-process so extraction can
+# run in the extraction pool without spawning converter subprocesses.
+EXTRACTORS = {
+    'pdf': _pdf_pages,
+    'docx': _docx_pages,
+    'pptx': _pptx_pages,
+    'doc': _textract_pages('doc'),
+    'ppt': _textract_pages('ppt'),
+}
+
+def iter_pages(file_data: bytes, filename: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Yields (page_number, raw_text) one page at a time; PDFs are parsed lazily
+    so only the current page's text is held. Formats without pages yield a
+    single (None, text) item. Unknown extensions are read as UTF-8 text.
+    """
     ext = filename.lower().rsplit('.', 1)[-1]
-    if ext == 'pdf':
-        reader = PdfReader(io.BytesIO(file_data))
-        texts = []
-        for page in reader.pages:
-            txt = page.extract_text()
-            if txt:
-                texts.append(txt)
-        return "\n".join(texts)
-    elif ext in ('doc', 'docx', 'ppt', 'pptx'):
-        return textract.process(io.BytesIO(file_data), extension=ext).decode('utf-8', errors='ignore')
-    else:
-        return file_data.decode('utf-8', errors='ignore')
+    extractor = EXTRACTORS.get(ext)
+    if extractor is None:
+        yield None, file_data.decode('utf-8', errors='ignore')
+        return
+    for number, txt in extractor(file_data):
+        if txt:
+            yield number, txt
+
+def extract_text(file_data: bytes, filename: str) -> str:
+    return "\n".join(txt for _, txt in iter_pages(file_data, filename))
     
 def clean_extracted_text(text: str) -> str:
     text = re.sub(r'\s+', ' ', text)
@@ -34,39 +135,269 @@ def clean_extracted_text(text: str) -> str:
 
     return text.strip()
 
-def split_text(text: str, max_tokens: int = 300, overlap: int = 50) -> List[str]:
+def _raise_extract_timeout(signum, frame):
+    raise TimeoutError("text extraction timed out")
+
+def limit_worker_memory(memory_mb: int):
+    """ProcessPoolExecutor initializer: caps the worker's address space."""
+    if memory_mb:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+@contextmanager
+def extraction_timeout(seconds: Optional[int]):
+    """
+    Raises TimeoutError in the block after `seconds` (None/0: no limit). Uses
+    SIGALRM, so it only works on a process's main thread (e.g. a pool worker).
+    """
+    if seconds:
+        signal.signal(signal.SIGALRM, _raise_extract_timeout)
+        signal.alarm(seconds)
+    try:
+        yield
+    finally:
+        if seconds:
+            signal.alarm(0)
+
+def iter_clean_pages(file_data: bytes, filename: str,
+                     transcription: Optional[str] = None) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    extract → clean for one file, one (page_number, cleaned_text) at a time;
+    empty pages are dropped. A transcription stands in for the file's bytes.
+    """
+    pages = [(None, transcription)] if transcription is not None else iter_pages(file_data, filename)
+    for number, raw in pages:
+        txt = clean_extracted_text(raw)
+        if txt:
+            yield number, txt
+
+def iter_chunks(pages: Iterable[Tuple[Optional[int], str]],
+                max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP) -> Iterator[dict]:
+    """
+    Token-window chunker over (page_number, cleaned_text) pairs. Windows are
+    emitted as soon as they fill, so only about one page plus one window of
+    token ids is held at a time. Each chunk is {'text', 'page'}, page being
+    where the chunk starts. Same windows as split_text for a single page.
+    """
     enc = tiktoken.get_encoding("cl100k_base")
-    token_ids = enc.encode(text)
-    chunks = []
-    start = 0
-    while start < len(token_ids):
-        end = min(start + max_tokens, len(token_ids))
-        chunk = enc.decode(token_ids[start:end])
-        chunks.append(chunk)
-        start += max_tokens - overlap
-    return chunks
-def embed_text(text: str) -> List[float]:
-    response = _embed_client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=text
-    )
-    return response.data[0].embedding
+    step = max_tokens - overlap
+    buf, buf_pages = [], []
+    first = True
+    for number, txt in pages:
+        ids = enc.encode(txt if first else " " + txt)
+        first = False
+        buf.extend(ids)
+        buf_pages.extend([number] * len(ids))
+        while len(buf) >= max_tokens:
+            yield {'text': enc.decode(buf[:max_tokens]), 'page': buf_pages[0]}
+            del buf[:step]
+            del buf_pages[:step]
+    # Like split_text, every window start before the end emits, even short ones
+    while buf:
+        yield {'text': enc.decode(buf[:max_tokens]), 'page': buf_pages[0]}
+        del buf[:step]
+        del buf_pages[:step]
+
+def split_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return [c['text'] for c in iter_chunks([(None, text)] if text else [], max_tokens, overlap)]
+
+_model_encodings = {}
+
+
+def _model_encoding(model: str):
+    enc = _model_encodings.get(model)
+    if enc is None:
+        try:
+            enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            enc = tiktoken.get_encoding("cl100k_base")
+        _model_encodings[model] = enc
+    return enc
 
-def openai_embed_text(texts: Sequence[str]) -> np.ndarray:
-    if not texts:
-        return np.empty((0, 1536), dtype=np.float32)
-    CHUNK = 512
-    out: List[np.ndarray] = []
 
-    for i in range(0, len(texts), CHUNK):
-        batch = texts[i : i + CHUNK]
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Token count of `text` under the chat model's tokenizer."""
+    return len(_model_encoding(model).encode(text or "", disallowed_special=()))
 
-        resp = _embed_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=batch,
-            encoding_format="float"
-        )
-        arr = np.asarray([d.embedding for d in resp.data], dtype=np.float32)
-        out.append(arr)
 
+def truncate_tokens(text: str, max_tokens: int, model: str = "gpt-4o") -> str:
+    """`text` cut to at most `max_tokens` tokens of the chat model's tokenizer."""
+    enc = _model_encoding(model)
+    ids = enc.encode(text or "", disallowed_special=())
+    return text if len(ids) <= max_tokens else enc.decode(ids[:max(max_tokens, 0)])
+
+def _embed_batch(batch: Sequence[str], model: str, dimensions: Optional[int] = None) -> np.ndarray:
+    """Embeds one request-sized batch, backing off on rate limits and transient errors."""
+    extra = {"dimensions": dimensions} if dimensions else {}
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        try:
+            resp = get_openai_client().embeddings.create(
+                model=model,
+                input=list(batch),
+                encoding_format="float",
+                **extra
+            )
+            return np.asarray([d.embedding for d in resp.data], dtype=np.float32)
+        except _RETRYABLE_ERRORS as e:
+            if attempt == EMBED_MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+            logger.warning("Embedding batch failed (%s), retry %d/%d in %.1fs",
+                           e.__class__.__name__, attempt + 1, EMBED_MAX_RETRIES, delay)
+            time.sleep(delay)
+
+def embed_texts_batched(texts: Sequence[str],
+                        model: str = EMBEDDING_MODEL,
+                        dimensions: Optional[int] = None,
+                        batch_size: int = EMBED_BATCH_SIZE,
+                        max_concurrency: int = EMBED_MAX_CONCURRENCY) -> np.ndarray:
+    """
+    Embeds many texts with at most `max_concurrency` batched requests in flight.
+    Returns a float32 array with one row per input, in input order.
+    """
+    if not texts:
+        return np.empty((0, dimensions or MODEL_DIMENSIONS.get(model, 1536)), dtype=np.float32)
+
+    started = time.perf_counter()
+    batches = [texts[i : i + batch_size] for i in range(0, len(texts), batch_size)]
+    workers = max(1, min(max_concurrency, len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        out = list(pool.map(lambda b: _embed_batch(b, model, dimensions), batches))
+
+    elapsed = time.perf_counter() - started
+    logger.info("Embedded %d chunks in %d batches with %s in %.2fs (%.1f chunks/sec)",
+                len(texts), len(batches), model, elapsed, len(texts) / elapsed if elapsed else float('inf'))
     return np.vstack(out)
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def _cache_io(fn, *args):
+    # The cache is an optimization: a DB hiccup must never fail the embedding itself
+    from src.db.session import Session
+    db = Session()
+    try:
+        return fn(db, *args)
+    except Exception as e:
+        db.rollback()
+        logger.warning("Embedding cache unavailable: %s", e)
+        return None
+    finally:
+        db.close()
+
+def embed_texts_cached(texts: Sequence[str],
+                       model: str = EMBEDDING_MODEL,
+                       dimensions: Optional[int] = None) -> np.ndarray:
+    """
+    Content-addressed wrapper around embed_texts_batched. Cached vectors are
+    looked up in bulk by (sha256(text), model, dimensions); only the misses
+    are sent to the API, and their vectors are written back to the cache.
+    """
+    from src.db.queries import get_cached_embeddings, store_cached_embeddings
+
+    dims = dimensions or MODEL_DIMENSIONS.get(model, 1536)
+    if not texts:
+        return np.empty((0, dims), dtype=np.float32)
+
+    hashes = [content_hash(t) for t in texts]
+    cached = _cache_io(get_cached_embeddings, set(hashes), model, dims) or {}
+    vectors = {h: np.frombuffer(e, dtype=np.float32) for h, e in cached.items()}
+
+    missing = {}
+    for h, t in zip(hashes, texts):
+        if h not in vectors:
+            missing.setdefault(h, t)
+    n_missed = sum(1 for h in hashes if h in missing)
+    with _cache_stats_lock:
+        _cache_stats['hits'] += len(hashes) - n_missed
+        _cache_stats['misses'] += n_missed
+
+    if missing:
+        fresh = embed_texts_batched(list(missing.values()), model=model, dimensions=dimensions)
+        new_rows = {}
+        for h, vec in zip(missing.keys(), fresh):
+            vectors[h] = vec
+            new_rows[h] = vec.astype(np.float32).tobytes()
+        _cache_io(store_cached_embeddings, new_rows, model, dims)
+
+    return np.vstack([vectors[h] for h in hashes]).astype(np.float32)
+
+def get_embedding_cache_stats() -> dict:
+    with _cache_stats_lock:
+        hits, misses = _cache_stats['hits'], _cache_stats['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hitRate': hits / total if total else None
+    }
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a chat/search query: NFKC, case-folded, single-spaced."""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', text)).strip().casefold()
+
+def embed_query(text: str, model: str = EMBEDDING_MODEL, dimensions: Optional[int] = None) -> np.ndarray:
+    """
+    Embeds one query through two cache tiers: an in-process LRU, then the
+    shared EmbeddingCache table (via embed_texts_cached). Concurrent callers
+    with the same normalized query wait on a single in-flight request.
+    """
+    key = (model, dimensions, normalize_query(text))
+    with _query_lock:
+        vec = _query_lru.get(key)
+        if vec is not None:
+            _query_lru.move_to_end(key)
+            _query_stats['hits'] += 1
+            return vec
+        future = _query_inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _query_inflight[key] = future
+            _query_stats['misses'] += 1
+        else:
+            _query_stats['coalesced'] += 1
+
+    if not owner:
+        return future.result()
+
+    try:
+        vec = embed_texts_cached([key[2]], model=model, dimensions=dimensions)[0]
+        vec.setflags(write=False)   # shared between callers
+    except BaseException as e:
+        with _query_lock:
+            _query_inflight.pop(key, None)
+        future.set_exception(e)
+        raise
+
+    with _query_lock:
+        _query_inflight.pop(key, None)
+        _query_lru[key] = vec
+        while len(_query_lru) > QUERY_CACHE_SIZE:
+            _query_lru.popitem(last=False)
+    future.set_result(vec)
+    return vec
+
+def get_query_cache_stats() -> dict:
+    with _query_lock:
+        stats = dict(_query_stats, entries=len(_query_lru))
+    total = stats['hits'] + stats['misses']
+    stats['hitRate'] = stats['hits'] / total if total else None
+    return stats
+
+def openai_embed_text(texts: Sequence[str]) -> np.ndarray:
+    return embed_texts_cached(texts, model=EMBEDDING_MODEL)
+
+class CachedEmbeddings(Embeddings):
+    """LangChain embeddings backed by the shared embedding cache."""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embed_texts_cached(texts, model=self.model, dimensions=self.dimensions).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_query(text, model=self.model, dimensions=self.dimensions).tolist()
@@ -1,15 +1,13 @@
 import io
-from openai import OpenAI
-import os
+from src.clients import get_openai_client
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 def transcribe_audio(file_storage):
     try:
         file_bytes = file_storage.read()
         file_obj = io.BytesIO(file_bytes)
         file_obj.name = file_storage.filename
 
-        response = client.audio.transcriptions.create(
+        response = get_openai_client().audio.transcriptions.create(
             model="whisper-1",
             file=file_obj
         )
@@ -25,6 +25,10 @@ load_dotenv(override=False)
 # ─── 4) Stub OpenAI env so transcriber/indexer init won’t fail───────────
 os.environ.setdefault("OPENAI_API_KEY", "testkey")
 
+# — Analytics counters are flushed by the tests themselves (the in-memory
+#   DB is per thread, so the background flusher would not see the tables)
+os.environ["ANALYTICS_FLUSH_SECONDS"] = "3600"
+
 # ─── 5) Stub out external modules before importing your app ────────────
 # — transcriber
 transcriber_stub = types.ModuleType("transcriber")
@@ -34,8 +38,14 @@ sys.modules["transcriber"] = transcriber_stub
 # — indexer
 indexer_stub = types.ModuleType("indexer")
 indexer_stub.rebuild_course_index = lambda db, cid: (b"", b"")
+indexer_stub.remove_file_from_course_index = lambda db, course, fid: (b"", b"")
 sys.modules["indexer"] = indexer_stub
 
+# — ingestion pipeline
+ingestion_stub = types.ModuleType("ingestion")
+ingestion_stub.ingest_file = lambda db, fid: 0
+sys.modules["ingestion"] = ingestion_stub
+
 # — textUtils / textract
 sys.modules["textUtils"] = types.ModuleType("textUtils")
 sys.modules["textract"] = types.ModuleType("textract")
@@ -65,6 +75,8 @@ atexit.register(lambda: Base.metadata.drop_all(engine))
 
 # ─── 9) Pytest fixtures ───────────────────────────────────────────────
 import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
 
 @pytest.fixture
 def client():
@@ -74,4 +86,24 @@ def client():
 def auth_client(client):
     # set session cookie to a valid UUID string
     client.set_cookie("session", str(uuid.uuid4()))
-    return client
\ No newline at end of file
+    return client
+
+@pytest.fixture
+def count_statements():
+    """
+    `with count_statements() as stmts:` records the SQL statements run on the
+    test engine inside the block, so tests can pin a route's query count.
+    """
+    @contextmanager
+    def counting():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+    return counting
@@ -0,0 +1,257 @@
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import chat_history
+import context_packer
+import src.app as app_module
+from src.db.session import Session
+from src.db.queries import (
+    create_user, create_student_profile, create_course, create_module,
+    create_file, create_chat, create_message, get_messages_by_chat, get_chat_by_id
+)
+
+TOKENS = ["Corals ", "bleach ", "when ", "stressed."]
+
+
+class OpenAIStub(BaseHTTPRequestHandler):
+    """Speaks just enough of /v1/chat/completions, streaming or not."""
+
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(body)
+        base = {"id": "chatcmpl-stub", "created": 0, "model": body["model"]}
+        if not body.get("stream"):
+            payload = dict(base, object="chat.completion", choices=[{
+                "index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "".join(TOKENS)},
+            }])
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for token in TOKENS:
+            chunk = dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "finish_reason": None, "delta": {"content": token},
+            }])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def openai_stub(monkeypatch):
+    OpenAIStub.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    yield
+    server.shutdown()
+
+
+@pytest.fixture
+def student_chat(client, monkeypatch):
+    # Cookie value doubles as the Firebase uid
+    monkeypatch.setattr(app_module.auth, "verify_session_cookie",
+                        lambda cookie, check_revoked=True: {"uid": cookie})
+    monkeypatch.setattr(app_module, "embed_query", lambda text: np.zeros(1536, dtype=np.float32))
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(app_module, "search_file_chunks",
+                        lambda db, course_id, vec, k=5: [("Bleaching is a stress response.", None, 0, 0.0)])
+
+    uid = str(uuid.uuid4())
+    db = Session()
+    user = create_user(db, f"{uid}@example.com", "pw", uid, "student")
+    create_student_profile(db, user.id, "Stu", {"depth": "beginner"})
+    course = create_course(db, "Reefs", "", creator_id=user.id)
+    module = create_module(db, course.id, "Week 1")
+    f = create_file(db, module.id, "Notes", "notes.txt", "text/plain", 4, b"data")
+    chat = create_chat(db, user.id, f.id, "Chat")
+    ids = {"chat": str(chat.id), "file": str(f.id)}
+    db.close()
+
+    client.set_cookie("session", uid)
+    return ids
+
+
+def _events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+def _saved_replies(chat_id):
+    db = Session()
+    try:
+        return [m.content for m in get_messages_by_chat(db, chat_id) if m.role == "assistant"]
+    finally:
+        db.close()
+
+
+def test_ai_chat_json_mode(client, openai_stub, student_chat):
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?"})
+    assert rv.status_code == 200
+    assert rv.get_json() == {"assistant": "".join(TOKENS).strip(), "chatId": student_chat["chat"]}
+    assert _saved_replies(student_chat["chat"]) == ["".join(TOKENS).strip()]
+
+
+def test_ai_chat_streams_tokens(client, openai_stub, student_chat):
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?", "stream": True})
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/event-stream"
+
+    events = _events(rv.get_data(as_text=True))
+    assert events[0] == ("meta", {"chatId": student_chat["chat"]})
+    assert [data["delta"] for event, data in events[1:-1]] == TOKENS
+    assert events[-1] == ("done", {"assistant": "".join(TOKENS).strip(), "chatId": student_chat["chat"]})
+    assert _saved_replies(student_chat["chat"]) == ["".join(TOKENS).strip()]
+
+
+def test_ai_chat_stream_saves_partial_reply_on_disconnect(client, openai_stub, student_chat):
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?"},
+                     headers={"Accept": "text/event-stream"}, buffered=False)
+    body = iter(rv.response)
+    next(body)   # meta
+    next(body)   # first token
+    rv.close()   # client goes away
+
+    assert _saved_replies(student_chat["chat"]) == [TOKENS[0].strip()]
+
+
+def test_ai_chat_semantic_cache_hit_skips_llm(client, student_chat, monkeypatch):
+    monkeypatch.setattr(app_module, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(app_module, "semantic_lookup", lambda db, course_id, bucket, vec: "From cache.")
+    monkeypatch.setattr(app_module, "search_file_chunks", lambda *a, **kw: pytest.fail("retrieval ran"))
+
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?"})
+    assert rv.status_code == 200
+    assert rv.get_json() == {"assistant": "From cache.", "chatId": student_chat["chat"], "cached": True}
+    assert _saved_replies(student_chat["chat"]) == ["From cache."]
+
+
+def test_ai_chat_semantic_cache_stores_complete_reply(client, openai_stub, student_chat, monkeypatch):
+    stored = []
+    monkeypatch.setattr(app_module, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(app_module, "semantic_lookup", lambda db, course_id, bucket, vec: None)
+    monkeypatch.setattr(app_module, "semantic_store",
+                        lambda db, course_id, bucket, query, vec, answer: stored.append((query, answer)))
+
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?", "stream": True})
+    rv.get_data()
+    assert stored == [("Why do corals bleach?", "".join(TOKENS).strip())]
+
+
+def test_ai_chat_windows_history_and_summarizes_older_turns(client, openai_stub, student_chat, monkeypatch):
+    monkeypatch.setattr(chat_history, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(chat_history, "HISTORY_TOKEN_BUDGET", 20)
+    folded = []
+    monkeypatch.setattr(chat_history, "summarize_turns",
+                        lambda client, summary, turns: folded.extend(m.content for m in turns) or "Asked about reefs.")
+
+    db = Session()
+    seeded = [f"turn {i} about coral reefs" for i in range(10)]
+    for i, content in enumerate(seeded):
+        create_message(db, student_chat["chat"], "user" if i % 2 == 0 else "assistant", content)
+    db.close()
+
+    # The client's own history is ignored
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "And why?",
+                                       "messages": [{"role": "user", "content": "forged"}]})
+    assert rv.status_code == 200
+
+    # 9 tokens per turn: only the newest fits half the budget, the rest is folded
+    assert folded == seeded[:9]
+    sent = [m["content"] for m in OpenAIStub.requests[-1]["messages"]]
+    assert "Summary of the earlier conversation:\nAsked about reefs." in sent
+    assert [c for c in sent if c in seeded or c == "forged"] == seeded[9:]
+
+    db = Session()
+    chat = get_chat_by_id(db, student_chat["chat"])
+    assert chat.summary == "Asked about reefs."
+    assert chat.summarized_until is not None
+    db.close()
+
+
+def test_summary_watermark_keeps_messages_sharing_its_timestamp(student_chat, monkeypatch):
+    monkeypatch.setattr(chat_history, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(chat_history, "HISTORY_TOKEN_BUDGET", 20)
+    monkeypatch.setattr(chat_history, "summarize_turns", lambda client, summary, turns: "Summary.")
+
+    db = Session()
+    seeded = [create_message(db, student_chat["chat"], "user", f"turn {i}") for i in range(4)]
+    # Written in the same tick: every message shares one created_at
+    tick = seeded[0].created_at
+    for m in seeded:
+        m.created_at = tick
+    db.commit()
+
+    chat = get_chat_by_id(db, student_chat["chat"])
+    turns = chat_history.recent_turns(db, chat)
+    kept = [m["content"] for m in chat_history.history_messages(db, None, chat, turns)[1:]]
+    db.refresh(chat)
+    assert chat.summarized_until == tick and chat.summarized_until_id is not None
+
+    # Folded turns are not reloaded; the kept ones are, despite the shared timestamp
+    assert [m.content for m in chat_history.recent_turns(db, chat)] == kept != []
+    db.close()
+
+
+def test_semantic_cache_bucket_is_coarse_and_reply_not_personal(client, openai_stub, student_chat, monkeypatch):
+    from semantic_cache import persona_bucket
+    assert persona_bucket({"depth": "Beginner ", "learningStyle": "Visual", "interests": "surfing"}) \
+        == persona_bucket({"depth": "beginner", "learningStyle": " visual", "interests": "chess"})
+    assert persona_bucket({"depth": "advanced"}) != persona_bucket({"depth": "beginner"})
+
+    monkeypatch.setattr(app_module, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(app_module, "semantic_lookup", lambda db, course_id, bucket, vec: None)
+    monkeypatch.setattr(app_module, "semantic_store", lambda *args: None)
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?"})
+    assert rv.status_code == 200
+    prompt = json.dumps(OpenAIStub.requests[-1]["messages"])
+    assert "Name: Stu" not in prompt and "Depth: beginner" in prompt
+
+
+def test_ai_chat_stream_writes_through_its_own_session(client, openai_stub, student_chat, monkeypatch):
+    opened = []
+
+    def session():
+        db = Session()
+        opened.append(db)
+        return db
+    monkeypatch.setattr(app_module, "Session", session)
+    writes = []
+    create = app_module.create_message
+    monkeypatch.setattr(app_module, "create_message",
+                        lambda db, chat_id, role, content: writes.append((role, db)) or create(db, chat_id, role, content))
+
+    rv = client.post("/ai-chat", json={"id": student_chat["chat"], "fileId": student_chat["file"],
+                                       "userMessage": "Why do corals bleach?", "stream": True})
+    request_db = writes[0][1]
+    rv.get_data()
+    assert [role for role, _ in writes] == ["user", "assistant"]
+    assert writes[1][1] is not request_db and writes[1][1] is opened[-1]
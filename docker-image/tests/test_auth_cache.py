@@ -0,0 +1,65 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import auth_cache
+import src.app as app_module
+from src.db.session import Session
+from src.db.queries import create_user, create_admin_profile
+
+
+@pytest.fixture
+def firebase(monkeypatch):
+    calls = []
+
+    def verify(cookie, check_revoked=True):
+        calls.append(cookie)
+        return {"uid": cookie, "auth_time": 1000}
+    monkeypatch.setattr(auth_cache.auth, "verify_session_cookie", verify)
+    return calls
+
+
+@pytest.fixture
+def admin(client):
+    uid = str(uuid.uuid4())
+    db = Session()
+    user = create_user(db, f"{uid}@example.com", "pw", uid, "admin")
+    create_admin_profile(db, user.id, "Ada")
+    user_id = str(user.id)
+    db.close()
+    client.set_cookie("session", uid)
+    return SimpleNamespace(uid=uid, id=user_id)
+
+
+def test_verified_session_and_identity_are_reused(client, firebase, admin, count_statements):
+    assert client.get("/admin/metrics").status_code == 200
+    with count_statements() as stmts:
+        rv = client.get("/admin/metrics")
+    assert rv.status_code == 200
+    assert firebase == [admin.uid]
+    assert stmts == []
+
+
+def test_role_change_invalidates_identity(client, firebase, admin):
+    assert client.get("/admin/metrics").status_code == 200
+    rv = client.patch(f"/admin/users/{admin.id}", json={"role_type": "student"})
+    assert rv.status_code == 200
+    assert client.get("/admin/metrics").status_code == 403
+
+
+def test_logout_forgets_session(client, firebase, admin):
+    client.get("/admin/metrics")
+    client.post("/sessionLogout")
+    client.set_cookie("session", admin.uid)
+    client.get("/admin/metrics")
+    assert firebase == [admin.uid, admin.uid]
+
+
+def test_background_check_evicts_revoked_sessions(client, firebase, admin, monkeypatch):
+    client.get("/admin/metrics")
+    monkeypatch.setattr(auth_cache.auth, "get_user",
+                        lambda uid: SimpleNamespace(disabled=False, tokens_valid_after_timestamp=2_000_000))
+    auth_cache.check_revocations()
+    client.get("/admin/metrics")
+    assert firebase == [admin.uid, admin.uid]
@@ -0,0 +1,40 @@
+import context_packer
+import pytest
+from context_packer import pack_chunks, context_budget
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text, model: len(text.split()))
+
+
+WORDS = [f"w{i}" for i in range(100)]
+
+
+def _window(start, end):
+    return " ".join(WORDS[start:end])
+
+
+def test_overlap_between_windows_is_trimmed():
+    packed = pack_chunks([_window(0, 40), _window(30, 70), _window(60, 100)])
+    assert packed == [_window(0, 40), _window(40, 70), _window(70, 100)]
+
+
+def test_near_duplicates_are_dropped():
+    assert pack_chunks([_window(0, 40), _window(0, 40).upper(), _window(1, 40)]) == [_window(0, 40)]
+
+
+def test_orders_by_distance_and_fills_budget():
+    chunks = [_window(0, 20), _window(40, 90), _window(20, 30)]
+    # 8 tokens of framing per item: 58 + 18 fit in 80, the 28-token chunk does not
+    assert pack_chunks(chunks, budget=80, distances=[0.3, 0.1, 0.2]) == [_window(40, 90), _window(20, 30)]
+
+
+def test_repeats_kept_without_dedupe():
+    assert pack_chunks(["why?", "why?"], budget=100, dedupe=False) == ["why?", "why?"]
+
+
+def test_budget_env_override(monkeypatch):
+    monkeypatch.setenv("CONTEXT_BUDGET_GPT_4O_MINI_DOCUMENT", "123")
+    assert context_budget("gpt-4o-mini", "document") == 123
+    assert context_budget("unknown-model") == context_budget("gpt-4o")
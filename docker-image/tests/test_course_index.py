@@ -0,0 +1,103 @@
+import importlib.util
+import os
+import uuid
+
+import numpy as np
+import pytest
+
+from FAISS_db_generation import load_metadata_bytes
+from index_coordinator import apply_course_index_update
+from src.db.session import Session
+from src.db.queries import (
+    create_user, create_course, create_module, create_file, get_course_by_id, update_course_index
+)
+
+
+def _load_indexer():
+    # conftest stubs `indexer` for the app; load the real module under its own name
+    path = os.path.join(os.path.dirname(__file__), "..", "src", "indexer.py")
+    spec = importlib.util.spec_from_file_location("indexer_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def indexer(monkeypatch):
+    module = _load_indexer()
+    chunks = {}
+    monkeypatch.setattr(module, "iter_file_chunks", lambda db, f: iter(chunks[f.id]))
+    monkeypatch.setattr(module, "_embed", lambda texts: np.ones((len(texts), 4), dtype="float32"))
+    module.chunks = chunks
+    return module
+
+
+@pytest.fixture
+def course_files():
+    db = Session()
+    uid = str(uuid.uuid4())
+    user = create_user(db, f"{uid}@example.com", "pw", uid, "instructor")
+    course = create_course(db, "Reefs", "", creator_id=user.id, instructor_id=user.id)
+    module = create_module(db, course.id, "Week 1")
+    files = [create_file(db, module.id, name, f"{name}.txt", "text/plain", 4, b"data") for name in ("a", "b")]
+    ids = course.id, [f.id for f in files]
+    db.close()
+    return ids
+
+
+def _stored(db, course_id):
+    db.expire_all()
+    course = get_course_by_id(db, course_id, with_index=True)
+    return course.index_version, load_metadata_bytes(course.index_pkl)
+
+
+def test_add_file_continues_ids_and_remove_drops_its_vectors(indexer, course_files):
+    course_id, (a, b) = course_files
+    indexer.chunks[a] = [{'text': f"a{i}", 'page': 1} for i in range(3)]
+    indexer.chunks[b] = [{'text': f"b{i}", 'page': None} for i in range(2)]
+    db = Session()
+    version = get_course_by_id(db, course_id).index_version
+
+    for file_id in (a, b):
+        assert apply_course_index_update(db, course_id, lambda latest: indexer.add_file_to_course_index(db, latest, file_id))
+    new_version, metadata = _stored(db, course_id)
+    assert new_version == version + 2
+    assert sorted(metadata) == [0, 1, 2, 3, 4]
+    assert [metadata[i]['chunk_index'] for i in (3, 4)] == [0, 1]
+    assert {metadata[i]['file_id'] for i in (3, 4)} == {str(b)}
+
+    # Re-adding a file replaces its vectors under fresh ids after max(metadata)
+    assert apply_course_index_update(db, course_id, lambda latest: indexer.add_file_to_course_index(db, latest, a))
+    _, metadata = _stored(db, course_id)
+    assert sorted(metadata) == [3, 4, 5, 6, 7]
+
+    assert apply_course_index_update(db, course_id, lambda latest: indexer.remove_file_from_course_index(db, latest, a))
+    final_version, metadata = _stored(db, course_id)
+    assert final_version == version + 4
+    assert sorted(metadata) == [3, 4]
+    index, _ = indexer._load_course_index(get_course_by_id(db, course_id, with_index=True))
+    assert index.ntotal == 2
+    assert sorted(index.id_map.at(i) for i in range(index.ntotal)) == [3, 4]
+    db.close()
+
+
+def test_stale_course_index_write_is_refused(course_files):
+    course_id, _ = course_files
+    first, second = Session(), Session()
+    version = get_course_by_id(first, course_id).index_version
+
+    # Two writers read the same version; only the first write lands
+    assert update_course_index(first, course_id, version, b"first", b"first")
+    assert not update_course_index(second, course_id, version, b"second", b"second")
+
+    # A build that another writer overtakes while it runs is dropped, not written
+    def overtaken(latest):
+        assert update_course_index(second, course_id, latest.index_version, b"other", b"other")
+        return b"stale", b"stale"
+    assert apply_course_index_update(first, course_id, overtaken) is False
+
+    first.expire_all()
+    course = get_course_by_id(first, course_id, with_index=True)
+    assert (course.index_version, course.index_faiss) == (version + 2, b"other")
+    first.close()
+    second.close()
@@ -0,0 +1,76 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import src.textUtils as textUtils
+from src.textUtils import embed_texts_cached, embed_query, get_query_cache_stats, EMBEDDING_MODEL
+
+LEGACY_MODEL = "text-embedding-ada-002"
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls = []
+
+    def embed(texts, model, dimensions=None):
+        calls.append((list(texts), model))
+        # One constant per model, so a vector served for the wrong model shows
+        value = 1.0 if model == EMBEDDING_MODEL else 2.0
+        return np.full((len(texts), 1536), value, dtype=np.float32)
+    monkeypatch.setattr(textUtils, "embed_texts_batched", embed)
+    return calls
+
+
+def test_repeated_text_is_embedded_once(upstream):
+    text, other = f"coral {uuid.uuid4()}", f"kelp {uuid.uuid4()}"
+
+    first = embed_texts_cached([text, text, other])
+    assert upstream == [([text, other], EMBEDDING_MODEL)]
+    assert first.shape == (3, 1536)
+
+    again = embed_texts_cached([other, text])
+    assert len(upstream) == 1
+    np.testing.assert_array_equal(again, first[[2, 0]])
+
+
+def test_cache_key_includes_the_model(upstream):
+    text = f"coral {uuid.uuid4()}"
+
+    current = embed_texts_cached([text], model=EMBEDDING_MODEL)
+    legacy = embed_texts_cached([text], model=LEGACY_MODEL)
+    assert upstream == [([text], EMBEDDING_MODEL), ([text], LEGACY_MODEL)]
+
+    # Both entries are cached side by side and served to their own model
+    np.testing.assert_array_equal(embed_texts_cached([text], model=LEGACY_MODEL), legacy)
+    np.testing.assert_array_equal(embed_texts_cached([text], model=EMBEDDING_MODEL), current)
+    assert len(upstream) == 2
+    assert current[0, 0] == 1.0 and legacy[0, 0] == 2.0
+
+
+def test_concurrent_queries_share_one_embedding_request(monkeypatch):
+    calls, release = [], threading.Event()
+
+    def embed(texts, model, dimensions=None):
+        calls.append(list(texts))
+        release.wait(5)
+        return np.ones((len(texts), 1536), dtype=np.float32)
+    monkeypatch.setattr(textUtils, "embed_texts_cached", embed)
+
+    topic = uuid.uuid4()
+    variants = [f"Why do corals bleach {topic}?", f"  why DO corals   bleach {topic}? ", f"WHY do corals bleach {topic}?"] * 3
+    coalesced = get_query_cache_stats()['coalesced']
+    with ThreadPoolExecutor(max_workers=len(variants)) as pool:
+        futures = [pool.submit(embed_query, q) for q in variants]
+        # Hold the first request open until every other caller is waiting on it
+        deadline = time.monotonic() + 5
+        while get_query_cache_stats()['coalesced'] - coalesced < len(variants) - 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [f.result() for f in futures]
+
+    assert calls == [[f"why do corals bleach {topic}?"]]
+    assert all(r is results[0] for r in results)
@@ -0,0 +1,45 @@
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+import FAISS_db_generation
+from FAISS_db_generation import (
+    build_vectorstore_bytes, vectorstore_from_bytes, vectorstore_to_bytes, reembed_vectorstore_bytes,
+    stored_vectorstore_model, LEGACY_EMBEDDING_MODEL
+)
+from src.textUtils import CachedEmbeddings, EMBEDDING_MODEL
+
+TEXTS = ["coral reefs", "kelp forests"]
+
+
+def _vectors(n, dim=4):
+    return np.eye(n, dim, dtype="float32")
+
+
+def test_file_store_records_its_embedding_model():
+    index_bytes, pkl_bytes = build_vectorstore_bytes(TEXTS, _vectors(2), [{"source": "a.pdf"}] * 2)
+    assert stored_vectorstore_model(pkl_bytes) == EMBEDDING_MODEL
+    vectordb = vectorstore_from_bytes(index_bytes, pkl_bytes)
+    assert vectordb.embedding_function.model == EMBEDDING_MODEL
+
+
+def test_legacy_file_store_is_queried_with_its_model_until_reembedded(monkeypatch):
+    legacy = FAISS.from_embeddings(
+        text_embeddings=list(zip(TEXTS, _vectors(2).tolist())),
+        embedding=CachedEmbeddings(model=LEGACY_EMBEDDING_MODEL),
+        metadatas=[{"source": "a.pdf", "citation": "Doe (2020)"}] * 2,
+    )
+    index_bytes, pkl_bytes = vectorstore_to_bytes(legacy)
+    assert stored_vectorstore_model(pkl_bytes) == LEGACY_EMBEDDING_MODEL
+    assert vectorstore_from_bytes(index_bytes, pkl_bytes).embedding_function.model == LEGACY_EMBEDDING_MODEL
+
+    embedded = []
+
+    def embed(texts, model):
+        embedded.append((list(texts), model))
+        return _vectors(len(texts))
+    monkeypatch.setattr(FAISS_db_generation, "embed_texts_cached", embed)
+
+    vectordb = vectorstore_from_bytes(*reembed_vectorstore_bytes(index_bytes, pkl_bytes))
+    assert embedded == [(TEXTS, EMBEDDING_MODEL)]
+    docs = list(vectordb.docstore.__dict__['_dict'].values())
+    assert [d.metadata["citation"] for d in docs] == ["Doe (2020)"] * 2
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain.schema import Document
+
+import FAISS_retriever
+import context_packer
+
+
+class FakeLLM:
+    model_name = "gpt-4o-mini"
+
+    def __init__(self):
+        self.waves = []
+
+    def batch(self, prompts, config=None, **kwargs):
+        self.waves.append(len(prompts))
+        return [SimpleNamespace(content=f"summary of {p[1][1].split()[0]}") for p in prompts]
+
+
+@pytest.fixture
+def summary_store(monkeypatch):
+    store = {}
+    monkeypatch.setattr(FAISS_retriever, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(context_packer, "count_tokens", lambda text, model: len(text.split()))
+    monkeypatch.setattr(FAISS_retriever, "MAP_REDUCE_GROUP_TOKENS", 100)
+    monkeypatch.setattr(FAISS_retriever, "_summary_cache_io", lambda fn, *args: fn(store, *args))
+    monkeypatch.setattr(FAISS_retriever, "get_chunk_group_summaries",
+                        lambda db, hashes, model: {h: db[h] for h in hashes if h in db})
+    monkeypatch.setattr(FAISS_retriever, "store_chunk_group_summaries",
+                        lambda db, summaries, model: db.update(summaries))
+    monkeypatch.setattr(FAISS_retriever, "_stuff_response",
+                        lambda llm, query, docs: {"result": [d.page_content for d in docs]})
+    return store
+
+
+def _docs(n):
+    return [Document(page_content=" ".join([f"c{i}"] * 50), metadata={}) for i in range(n)]
+
+
+def test_groups_are_summarized_in_one_wave_then_reduced(summary_store):
+    llm = FakeLLM()
+    out = FAISS_retriever.map_reduce_response(llm, "outline", _docs(6))
+    assert llm.waves == [3]
+    assert out["result"] == ["summary of c0", "summary of c2", "summary of c4"]
+
+
+def test_cached_group_summaries_are_reused(summary_store):
+    FAISS_retriever.map_reduce_response(FakeLLM(), "outline", _docs(6))
+    llm = FakeLLM()
+    FAISS_retriever.map_reduce_response(llm, "another outline", _docs(8))
+    # Only the new trailing group is summarized
+    assert llm.waves == [1]
+
+
+def test_reduce_prompt_is_capped_when_summaries_stop_shrinking(summary_store, monkeypatch):
+    class VerboseLLM(FakeLLM):
+        def batch(self, prompts, config=None, **kwargs):
+            self.waves.append(len(prompts))
+            return [SimpleNamespace(content=" ".join([p[1][1].split()[0]] * 200)) for p in prompts]
+
+    monkeypatch.setattr(FAISS_retriever, "MAP_REDUCE_MIN_TOKENS", 100)
+    monkeypatch.setattr(FAISS_retriever, "context_budget", lambda model, kind: 500)
+    out = FAISS_retriever.map_reduce_response(VerboseLLM(), "outline", _docs(6))
+    assert len(out["result"]) == 2
@@ -0,0 +1,196 @@
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect
+
+import src.app as app_module
+import analytics_counters
+from src.db.session import Session, engine
+from src.db.pool_metrics import pool_stats
+from src.db.queries import (
+    create_user, create_instructor_profile, create_student_profile, create_enrollment,
+    create_course, create_module, create_file,
+    get_course_by_id, get_file_by_id, get_files_by_module, get_modules_with_files, file_has_index,
+    create_ingestion_job, get_ingestion_job_by_id, heartbeat_ingestion_job,
+    requeue_stale_ingestion_jobs, replace_file_text, get_file_text, get_file_text_pages
+)
+
+
+def _user(db, role):
+    uid = str(uuid.uuid4())
+    return create_user(db, f"{uid}@example.com", "pw", uid, role)
+
+
+def test_blobs_are_deferred_until_opted_in():
+    db = Session()
+    user = _user(db, "student")
+    course = create_course(db, "Reefs", "", creator_id=user.id,
+                           index_faiss=b"i" * 1024, index_pkl=b"p" * 1024)
+    module = create_module(db, course.id, "Week 1")
+    f = create_file(db, module.id, "Notes", "notes.txt", "text/plain", 4, b"data")
+    course_id, module_id, file_id = course.id, module.id, f.id
+    db.close()
+
+    db = Session()
+    try:
+        listed = get_files_by_module(db, module_id)[0]
+        assert {"file_data", "index_faiss", "index_pkl"} <= inspect(listed).unloaded
+        assert not file_has_index(db, file_id)
+
+        assert {"index_faiss", "index_pkl"} <= inspect(get_course_by_id(db, course_id)).unloaded
+    finally:
+        db.close()
+
+    db = Session()
+    try:
+        course = get_course_by_id(db, course_id, with_index=True)
+        assert not {"index_faiss", "index_pkl"} & inspect(course).unloaded
+        f = get_file_by_id(db, file_id, with_data=True)
+        assert "file_data" not in inspect(f).unloaded
+        assert "index_faiss" in inspect(f).unloaded
+    finally:
+        db.close()
+    # Loaded blobs stay readable after the session closes
+    assert course.index_faiss == b"i" * 1024
+    assert f.file_data == b"data"
+
+
+@pytest.fixture
+def login(client, monkeypatch):
+    # Cookie value doubles as the Firebase uid
+    monkeypatch.setattr(app_module.auth, "verify_session_cookie",
+                        lambda cookie, check_revoked=True: {"uid": cookie})
+
+    def as_user(user):
+        client.set_cookie("session", user.firebase_uid)
+    return as_user
+
+
+def _route_statements(client, count_statements, url):
+    with count_statements() as stmts:
+        rv = client.get(url)
+    assert rv.status_code == 200, rv.get_json()
+    return len(stmts), rv.get_json()
+
+
+def _instructor_course(db, modules, files_per_module, students):
+    instructor = _user(db, "instructor")
+    create_instructor_profile(db, instructor.id, "Prof")
+    course = create_course(db, "Reefs", "", creator_id=instructor.id, instructor_id=instructor.id)
+    for i in range(modules):
+        module = create_module(db, course.id, f"Week {i}")
+        for j in range(files_per_module):
+            create_file(db, module.id, f"Notes {j}", "notes.txt", "text/plain", 4, b"data")
+    for i in range(students):
+        student = _user(db, "student")
+        create_student_profile(db, student.id, f"Stu {i}", {})
+        create_enrollment(db, student.id, course.id)
+    return instructor, course
+
+
+@pytest.mark.parametrize("route", ["/courses/{}/moduleswithfiles", "/instructor/courses/{}/students"])
+def test_course_routes_do_not_query_per_row(client, login, count_statements, route):
+    counts = []
+    for n in (1, 4):
+        db = Session()
+        instructor, course = _instructor_course(db, modules=n, files_per_module=n, students=n)
+        url = route.format(course.id)
+        db.close()
+
+        login(instructor)
+        count, body = _route_statements(client, count_statements, url)
+        assert len(body) == n
+        counts.append(count)
+    assert counts[0] == counts[1]
+
+
+def test_admin_users_does_not_query_per_user(client, login, count_statements):
+    db = Session()
+    admin = _user(db, "admin")
+    db.close()
+    login(admin)
+    client.get("/admin/users")   # caches the admin's identity
+
+    before, _ = _route_statements(client, count_statements, "/admin/users")
+    db = Session()
+    for _ in range(3):
+        _user(db, "student")
+    db.close()
+    after, body = _route_statements(client, count_statements, "/admin/users")
+
+    assert after == before
+    assert {u["role"] for u in body} >= {"admin", "student"}
+
+
+def test_request_session_is_closed_when_route_fails(client, login, monkeypatch):
+    db = Session()
+    instructor, course = _instructor_course(db, modules=1, files_per_module=1, students=0)
+    db.close()
+    login(instructor)
+
+    def fail(db, course_id):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(app_module, "get_modules_with_files", fail)
+
+    assert client.get(f"/courses/{course.id}/moduleswithfiles").status_code == 500
+    assert pool_stats(engine)['checkedOut'] == 0
+
+
+def test_file_counters_are_buffered_and_flushed_in_one_update(client, login, count_statements):
+    db = Session()
+    _, course = _instructor_course(db, modules=1, files_per_module=1, students=0)
+    file_id = get_files_by_module(db, get_modules_with_files(db, course.id)[0].id)[0].id
+    student = _user(db, "student")
+    create_student_profile(db, student.id, "Stu", {})
+    create_enrollment(db, student.id, course.id)
+    db.close()
+    login(student)
+
+    with count_statements() as stmts:
+        for _ in range(3):
+            assert client.post(f"/student/files/{file_id}/view-raw").status_code == 204
+        assert client.post(f"/student/files/{file_id}/view-personalized").status_code == 204
+        assert client.post("/student/chats", json={"fileId": str(file_id), "title": "Notes"}).status_code == 201
+    assert not [s for s in stmts if s.lstrip().upper().startswith("UPDATE")]
+
+    with count_statements() as stmts:
+        assert analytics_counters.flush() == 1
+    assert len([s for s in stmts if s.lstrip().upper().startswith("UPDATE")]) == 1
+
+    db = Session()
+    f = get_file_by_id(db, file_id)
+    assert (f.view_count_raw, f.view_count_personalized, f.chat_count) == (3, 1, 1)
+    db.close()
+
+
+def test_stale_ingestion_jobs_follow_heartbeat_and_attempt_limit():
+    db = Session()
+    alive, dead, exhausted = [create_ingestion_job(db, "ingest_file") for _ in range(3)]
+    long_ago = datetime.utcnow() - timedelta(hours=1)
+    for job, attempts in ((alive, 1), (dead, 1), (exhausted, 3)):
+        job.status, job.attempts = "running", attempts
+        job.started_at = job.heartbeat_at = long_ago
+    db.commit()
+    heartbeat_ingestion_job(db, alive.id)
+
+    assert requeue_stale_ingestion_jobs(db, older_than_seconds=300, max_attempts=3) == (1, 1)
+    db.expire_all()
+    assert [get_ingestion_job_by_id(db, j.id).status for j in (alive, dead, exhausted)] == \
+        ["running", "queued", "failed"]
+    db.close()
+
+
+def test_file_text_is_stored_and_read_in_page_batches():
+    db = Session()
+    user = _user(db, "instructor")
+    course = create_course(db, "Reefs", "", creator_id=user.id, instructor_id=user.id)
+    f = create_file(db, create_module(db, course.id, "Week 1").id, "Deck", "deck.pdf", "application/pdf", 4, b"data")
+    replace_file_text(db, f.id, "old", "v1", [(1, "stale")])
+
+    pages = ((n, f"page {n}") for n in range(1, 6))
+    assert replace_file_text(db, f.id, "abc", "v2", pages, batch_size=2) == 5
+    assert (get_file_text(db, f.id).content_hash, get_file_text(db, f.id).text) == ("abc", None)
+    assert get_file_text_pages(db, f.id, after=-1, limit=3) == [(0, 1, "page 1"), (1, 2, "page 2"), (2, 3, "page 3")]
+    assert get_file_text_pages(db, f.id, after=2, limit=3) == [(3, 4, "page 4"), (4, 5, "page 5")]
+    db.close()
@@ -0,0 +1,58 @@
+"""
+Re-embeds per-file FAISS stores (File.index_faiss / index_pkl) that were not
+built with the current EMBEDDING_MODEL.
+
+Stores written before the model was recorded in their metadata were embedded
+with text-embedding-ada-002. The app keeps querying them with ada-002, so
+running this is optional: it moves old stores onto the current model (and off
+the ada-002 query embeddings). Chunk texts and metadata, citations included,
+are kept, so nothing is re-extracted and no chat model is called.
+
+Usage:
+    POSTGRES_URL=... OPENAI_API_KEY=... python scripts/backfill_file_store_models.py [--dry-run]
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path[:0] = [os.path.join(ROOT, "docker-image"), os.path.join(ROOT, "docker-image", "src")]
+
+from sqlalchemy import select  # noqa: E402
+
+from src.db.schema import File  # noqa: E402
+from src.db.session import Session  # noqa: E402
+from src.db.queries import get_file_by_id, update_file  # noqa: E402
+from src.textUtils import EMBEDDING_MODEL  # noqa: E402
+from FAISS_db_generation import stored_vectorstore_model, reembed_vectorstore_bytes  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="only report the stores that need re-embedding")
+    args = parser.parse_args()
+
+    db = Session()
+    try:
+        file_ids = db.execute(select(File.id).where(File.index_pkl.isnot(None))).scalars().all()
+        stale = 0
+        for file_id in file_ids:
+            f = get_file_by_id(db, file_id, with_index=True)
+            model = stored_vectorstore_model(f.index_pkl)
+            if model not in (None, EMBEDDING_MODEL):
+                stale += 1
+                print(f"{file_id} {f.filename}: {model}")
+                if not args.dry_run:
+                    index_faiss, index_pkl = reembed_vectorstore_bytes(f.index_faiss, f.index_pkl)
+                    update_file(db, file_id, index_faiss=index_faiss, index_pkl=index_pkl)
+            # One file's blobs in memory at a time
+            db.expunge_all()
+    finally:
+        db.close()
+
+    action = "need re-embedding" if args.dry_run else "re-embedded"
+    print(f"{stale} of {len(file_ids)} file stores {action} with {EMBEDDING_MODEL}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compares the in-process OOXML extractors in textUtils against textract on a
+directory of sample .docx/.pptx files.
+
+Usage:
+    python scripts/benchmarks/office_extraction.py <corpus_dir> [--repeat N] [--workers N]
+
+Reports per-file time for each extractor, total wall-clock for a sequential
+and a process-pool run of the native extractors, and the extracted character
+counts so obvious coverage gaps show up next to the timings.
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [os.path.join(ROOT, "docker-image"), os.path.join(ROOT, "docker-image", "src")]
+
+from src.textUtils import iter_pages  # noqa: E402
+
+
+def native_extract(path):
+    with open(path, "rb") as fh:
+        data = fh.read()
+    return "\n".join(text for _, text in iter_pages(data, path))
+
+
+def textract_extract(path):
+    import textract
+    ext = path.lower().rsplit(".", 1)[-1]
+    with open(path, "rb") as fh:
+        data = fh.read()
+    return textract.process(io.BytesIO(data), extension=ext).decode("utf-8", errors="ignore")
+
+
+def time_call(fn, path, repeat):
+    best, out = None, ""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus_dir")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per file; the best time is kept")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    files = sorted(
+        glob.glob(os.path.join(args.corpus_dir, "**", "*.docx"), recursive=True)
+        + glob.glob(os.path.join(args.corpus_dir, "**", "*.pptx"), recursive=True)
+    )
+    if not files:
+        print(f"No .docx/.pptx files under {args.corpus_dir}")
+        sys.exit(1)
+
+    try:
+        import textract  # noqa: F401
+        have_textract = True
+    except ImportError:
+        have_textract = False
+        print("textract is not installed; reporting native timings only\n")
+
+    print(f"{'file':40} {'native s':>9} {'chars':>8} {'textract s':>11} {'chars':>8} {'speedup':>8}")
+    native_total = textract_total = 0.0
+    for path in files:
+        n_time, n_chars = time_call(native_extract, path, args.repeat)
+        native_total += n_time
+        row = f"{os.path.basename(path)[:40]:40} {n_time:9.3f} {n_chars:8d}"
+        if have_textract:
+            try:
+                t_time, t_chars = time_call(textract_extract, path, args.repeat)
+                textract_total += t_time
+                row += f" {t_time:11.3f} {t_chars:8d} {t_time / n_time if n_time else 0:7.1f}x"
+            except Exception as e:
+                row += f" {'failed: ' + type(e).__name__:>29}"
+        print(row)
+
+    print(f"\nSequential native total: {native_total:.3f}s")
+    if have_textract:
+        print(f"Sequential textract total: {textract_total:.3f}s")
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(native_extract, files))
+    print(f"Native with {args.workers} processes: {time.perf_counter() - start:.3f}s wall-clock "
+          f"(includes pool start-up)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures what the shared, pooled OpenAI client saves per call compared with
+building a new client (and so a new connection) for every request, as the
+app used to.
+
+Usage:
+    OPENAI_API_KEY=... python scripts/benchmarks/openai_clients.py [--calls N] [--concurrency N]
+
+Each call is `models.retrieve` (no tokens billed). Reports median and p90
+latency for both modes and the connection setup time (TCP + TLS) observed
+through httpx trace events, so the saving per call shows up directly.
+Set OPENAI_BASE_URL to benchmark against a proxy or a local stub.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+sys.path[:0] = [os.path.join(ROOT, "docker-image"), os.path.join(ROOT, "docker-image", "src")]
+
+import httpx  # noqa: E402
+from openai import OpenAI  # noqa: E402
+
+from src.clients import get_openai_client, get_http_client  # noqa: E402
+
+
+class SetupTimer:
+    """Sums time spent in connect/TLS phases, via httpcore trace callbacks."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.connections = 0
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def trace(self, event_name, info):
+        phase, _, stage = event_name.rpartition(".")
+        if not phase.endswith(("connect_tcp", "start_tls")):
+            return
+        key = (threading.get_ident(), phase)
+        if stage == "started":
+            self._started[key] = time.perf_counter()
+        elif stage == "complete" and key in self._started:
+            elapsed = time.perf_counter() - self._started.pop(key)
+            with self._lock:
+                self.seconds += elapsed
+                self.connections += phase.endswith("connect_tcp")
+
+
+def timed_call(client):
+    start = time.perf_counter()
+    client.models.retrieve("gpt-4o-mini")
+    return time.perf_counter() - start
+
+
+def run(mode, calls, concurrency):
+    timer = SetupTimer()
+
+    def hooked(request):
+        request.extensions["trace"] = timer.trace
+
+    if mode == "shared":
+        client = get_openai_client()
+        get_http_client().event_hooks["request"] = [hooked]
+
+        def call(_):
+            return timed_call(client)
+    else:
+        def call(_):
+            http_client = httpx.Client(event_hooks={"request": [hooked]})
+            try:
+                return timed_call(OpenAI(http_client=http_client))
+            finally:
+                http_client.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(call, range(calls)))
+    return latencies, timer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    # Warm DNS and the shared pool so neither mode pays one-off costs
+    get_openai_client().models.retrieve("gpt-4o-mini")
+
+    print(f"{'mode':10} {'median ms':>10} {'p90 ms':>8} {'connections':>12} {'setup ms/call':>14}")
+    results = {}
+    for mode in ("per-call", "shared"):
+        latencies, timer = run(mode, args.calls, args.concurrency)
+        results[mode] = statistics.median(latencies)
+        p90 = latencies[int(0.9 * (len(latencies) - 1))]
+        print(f"{mode:10} {results[mode] * 1000:10.1f} {p90 * 1000:8.1f} {timer.connections:12d} "
+              f"{timer.seconds / args.calls * 1000:14.1f}")
+
+    print(f"\nShared pool saves {(results['per-call'] - results['shared']) * 1000:.1f} ms per call (median)")
+
+
+if __name__ == "__main__":
+    main()